@@ -0,0 +1,40 @@
+from typing import Dict, Iterable, List, NamedTuple, Union
+from django.conf import settings
+from django.db.models import QuerySet
+from .models import FixtureChange
+
+
+class ChangesPage(NamedTuple):
+    # Changes oldest first, the sequence number to ask for changes since next time, and whether there are more
+    # changes waiting after this page
+    changes: List[FixtureChange]
+    cursor: int
+    has_more: bool
+
+
+def get_changes_since(team_ids: Union[Iterable[int], QuerySet], sequence: int = None,
+                      page_size: int = None) -> ChangesPage:
+    # Without a sequence number there's nothing to catch up on, the client has just loaded the feed and syncs from
+    # the latest change onwards
+    if sequence is None:
+        return ChangesPage([], FixtureChange.get_latest_sequence(), False)
+    if page_size is None:
+        page_size = settings.FIXTURE_CHANGES_PAGE_SIZE
+
+    changes = list(FixtureChange.get_since(team_ids, sequence)[:page_size + 1])
+    has_more = len(changes) > page_size
+    changes = changes[:page_size]
+    return ChangesPage(changes, changes[-1].id if changes else sequence, has_more)
+
+
+def serialize_change(change: FixtureChange) -> Dict:
+    return {
+        'sequence': change.id,
+        'fixture_id': change.fixture_id,
+        'kickoff_time_utc': change.kickoff_time_utc.isoformat(),
+        'status': change.status.description,
+        'home_team': {'id': change.home_team.id, 'name': change.home_team.name},
+        'away_team': {'id': change.away_team.id, 'name': change.away_team.name},
+        'home_score': change.home_score,
+        'away_score': change.away_score,
+    }
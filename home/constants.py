@@ -9,3 +9,10 @@ REQUEST_LIMIT_TYPE_PER_MINUTE = 1
 
 PREMIER_LEAGUE_MATCH_URL = "https://api.football-data.org/v2/competitions/2021/matches"
 FDDO_PREMIER_LEAGUE_ID = 2021
+
+# Full pulls the whole season, window only fixtures around today and live only matches currently being played
+FDDO_FETCH_MODE_FULL = "full"
+FDDO_FETCH_MODE_WINDOW = "window"
+FDDO_FETCH_MODE_LIVE = "live"
+FDDO_FETCH_MODES = (FDDO_FETCH_MODE_FULL, FDDO_FETCH_MODE_WINDOW, FDDO_FETCH_MODE_LIVE)
+FDDO_LIVE_STATUS_FILTER = "LIVE"
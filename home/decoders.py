@@ -0,0 +1,130 @@
+from datetime import datetime, timezone
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Tuple, Type, Union
+
+
+class Field(NamedTuple):
+    # Where one attribute of a decoded record lives in the raw JSON, and what type it has to be
+    name: str
+    path: Tuple[str, ...]
+    type: type
+    required: bool = True
+
+
+class FieldError(NamedTuple):
+    field: str
+    message: str
+
+
+class DecodeResult(NamedTuple):
+    record: Union[Tuple, None]
+    errors: Tuple[FieldError, ...]
+
+
+NO_ERRORS: Tuple[FieldError, ...] = ()
+MISSING_VALUE = "missing"
+
+
+@lru_cache(maxsize=4096)
+def parse_utc_datetime(value: str) -> datetime:
+    # fromisoformat is implemented in C, and a season only has a few hundred distinct kickoff times so cache them too
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        raise ValueError("no UTC offset")
+    return parsed.astimezone(timezone.utc)
+
+
+def _to_int(value: Any) -> int:
+    # bool is an int subclass, but a boolean id or score is never valid
+    if type(value) is not int:
+        raise TypeError("expected an integer")
+    return value
+
+
+def _to_str(value: Any) -> str:
+    if type(value) is not str:
+        raise TypeError("expected a string")
+    return value
+
+
+def _to_datetime(value: Any) -> datetime:
+    if type(value) is not str:
+        raise TypeError("expected an ISO-8601 string")
+    return parse_utc_datetime(value)
+
+
+CONVERTERS: Dict[type, Callable[[Any], Any]] = {
+    int: _to_int,
+    str: _to_str,
+    datetime: _to_datetime,
+}
+
+
+def format_errors(errors: Iterable[FieldError]) -> str:
+    return ", ".join("%s: %s" % (error.field, error.message) for error in errors)
+
+
+class RecordDecoder:
+    # Compiles a declarative schema into a decoder for one kind of raw JSON record.  The path lookups and type
+    # converters are resolved once up front, so decoding a record is a flat loop over prepared steps producing the
+    # given NamedTuple type.  Every invalid field is reported rather than just the first.
+
+    def __init__(self, record_type: Type[Tuple], fields: Iterable[Field]):
+        fields_by_name = {field.name: field for field in fields}
+        if set(fields_by_name) != set(record_type._fields):
+            raise ValueError("Schema fields %s don't match %s" % (sorted(fields_by_name), record_type.__name__))
+
+        self.record_type = record_type
+        self.fields = tuple(fields_by_name[name] for name in record_type._fields)
+        self._make = record_type._make
+        self._steps = tuple((field.name, self._compile_getter(field.path), CONVERTERS[field.type], field.required)
+                            for field in self.fields)
+
+    def decode(self, raw: Dict) -> DecodeResult:
+        values = []
+        errors = []
+        for name, getter, convert, required in self._steps:
+            try:
+                value = getter(raw)
+            except (KeyError, IndexError, TypeError):
+                value = None
+
+            if value is None:
+                if required:
+                    errors.append(FieldError(name, MISSING_VALUE))
+                values.append(None)
+                continue
+
+            try:
+                values.append(convert(value))
+            except (TypeError, ValueError) as e:
+                errors.append(FieldError(name, "%s, got %r" % (e, value)))
+                values.append(None)
+
+        if errors:
+            return DecodeResult(None, tuple(errors))
+        return DecodeResult(self._make(values), NO_ERRORS)
+
+    def decode_many(self, raw_records: Iterable[Dict]) -> List[DecodeResult]:
+        return [self.decode(raw) for raw in raw_records]
+
+    def _compile_getter(self, path: Tuple[str, ...]) -> Callable[[Dict], Any]:
+        if not path:
+            raise ValueError("Field path can't be empty")
+        if len(path) == 1:
+            return itemgetter(path[0])
+        if len(path) == 2:
+            outer, inner = path
+            return lambda raw: raw[outer][inner]
+        if len(path) == 3:
+            outer, middle, inner = path
+            return lambda raw: raw[outer][middle][inner]
+
+        def get_nested(raw: Dict) -> Any:
+            for key in path:
+                raw = raw[key]
+            return raw
+        return get_nested
@@ -0,0 +1,163 @@
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple, Union
+
+MATCHES_PATH = re.compile(r'^/v2/competitions/(\d+)/matches(\?.*)?$')
+DEFAULT_TEAM_IDS = list(range(1, 21))
+SEASON_START = datetime(2019, 8, 9, 19, tzinfo=timezone.utc)
+MATCHES_PER_DAY = 10
+
+
+class FakeCompetition:
+    # A synthetic season for one competition.  Churn changes the score of random matches and bumps the version the
+    # ETag is derived from; the encoded body is cached between churns.
+
+    def __init__(self, competition_id: int, match_count: int, team_ids: List[int]):
+        self.competition_id = competition_id
+        self.version = 0
+        self.matches = [self._create_match(i, match_count, team_ids) for i in range(match_count)]
+        self._body = None
+
+    def churn(self, match_count: int, rng: random.Random) -> None:
+        if match_count <= 0 or not self.matches:
+            return
+        for match in rng.sample(self.matches, min(match_count, len(self.matches))):
+            full_time = match['score']['fullTime']
+            side = rng.choice(('homeTeam', 'awayTeam'))
+            full_time['homeTeam'] = full_time['homeTeam'] or 0
+            full_time['awayTeam'] = full_time['awayTeam'] or 0
+            full_time[side] += 1
+            if match['status'] == 'SCHEDULED':
+                match['status'] = 'IN_PLAY'
+        self.version += 1
+        self._body = None
+
+    @property
+    def etag(self) -> str:
+        return '"%s-%s"' % (self.competition_id, self.version)
+
+    def get_body(self) -> bytes:
+        if self._body is None:
+            self._body = json.dumps({
+                'count': len(self.matches),
+                'filters': {},
+                'competition': {'id': self.competition_id, 'name': 'Fake competition %s' % self.competition_id},
+                'matches': self.matches,
+            }).encode('utf-8')
+        return self._body
+
+    def _create_match(self, index: int, match_count: int, team_ids: List[int]) -> Dict:
+        # Every team plays every other, home and away, the first half of the season already played
+        home_team_id = team_ids[index % len(team_ids)]
+        away_team_id = team_ids[(index + 1 + (index // len(team_ids)) % (len(team_ids) - 1)) % len(team_ids)]
+        finished = index < match_count // 2
+        kickoff = SEASON_START + timedelta(days=index // MATCHES_PER_DAY)
+        return {
+            'id': self.competition_id * 100000 + index,
+            'status': 'FINISHED' if finished else 'SCHEDULED',
+            'matchday': index // MATCHES_PER_DAY + 1,
+            'utcDate': kickoff.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'homeTeam': {'id': home_team_id, 'name': 'Team %s' % home_team_id},
+            'awayTeam': {'id': away_team_id, 'name': 'Team %s' % away_team_id},
+            'score': {'fullTime': {'homeTeam': index % 4 if finished else None,
+                                   'awayTeam': index % 3 if finished else None}},
+        }
+
+
+class FakeFootballDataHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'FakeFootballDataServer'
+
+    def do_GET(self):
+        path_match = MATCHES_PATH.match(self.path)
+        if path_match is None:
+            self._send(404, b'{"message": "Not found"}')
+            return
+
+        if self.server.latency_seconds:
+            time.sleep(self.server.latency_seconds)
+
+        status, body, etag = self.server.handle_matches_request(int(path_match.group(1)),
+                                                                self.headers.get('If-None-Match'))
+        self._send(status, body, etag)
+
+    def _send(self, status: int, body: bytes, etag: str = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeFootballDataServer(ThreadingHTTPServer):
+    # Local stand in for football-data.org's /v2/competitions/<id>/matches, for measuring ingestion without the real
+    # API or a key.  Payload size, latency, error rate, ETag support and per request score churn are all tunable.
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int] = ('127.0.0.1', 0), match_count: int = 380,
+                 latency_seconds: float = 0.0, error_rate: float = 0.0, etags: bool = True, churn_rate: float = 0.0,
+                 team_ids: List[int] = None, seed: Union[int, None] = None):
+        super().__init__(address, FakeFootballDataHandler)
+        self.match_count = match_count
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+        self.etags = etags
+        self.churn_rate = churn_rate
+        self.team_ids = team_ids or DEFAULT_TEAM_IDS
+        self.stats = {'requests': 0, 'ok': 0, 'not_modified': 0, 'errors': 0}
+        self._competitions: Dict[int, FakeCompetition] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def matches_url(self) -> str:
+        # In RequestType.base_url form, with the competition id as the placeholder
+        return 'http://%s:%s/v2/competitions/[Competition ID]/matches' % self.server_address[:2]
+
+    def start(self) -> 'FakeFootballDataServer':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def get_competition(self, competition_id: int) -> FakeCompetition:
+        with self._lock:
+            return self._get_competition(competition_id)
+
+    def handle_matches_request(self, competition_id: int, if_none_match: Union[str, None]) -> Tuple[int, bytes, str]:
+        with self._lock:
+            self.stats['requests'] += 1
+            if self._random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return 500, b'{"message": "Simulated failure"}', None
+
+            competition = self._get_competition(competition_id)
+            competition.churn(round(self.churn_rate * len(competition.matches)), self._random)
+            etag = competition.etag if self.etags else None
+            if etag is not None and if_none_match == etag:
+                self.stats['not_modified'] += 1
+                return 304, b'', etag
+
+            self.stats['ok'] += 1
+            return 200, competition.get_body(), etag
+
+    def _get_competition(self, competition_id: int) -> FakeCompetition:
+        competition = self._competitions.get(competition_id)
+        if competition is None:
+            competition = FakeCompetition(competition_id, self.match_count, self.team_ids)
+            self._competitions[competition_id] = competition
+        return competition
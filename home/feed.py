@@ -0,0 +1,168 @@
+import base64
+from datetime import datetime
+from typing import Callable, Dict, Hashable, Iterable, List, NamedTuple, Union
+from django.conf import settings
+from django.db.models import QuerySet
+from django.utils import timezone
+from .cache import LRUCache
+from .models import Fixture
+
+DIRECTION_EARLIER = 'earlier'
+DIRECTION_LATER = 'later'
+
+_feed_cache = None
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class FeedCursor(NamedTuple):
+    # A position between fixtures in (kickoff_time_utc, id) order, which is unique even when kickoffs coincide
+    kickoff_time_utc: datetime
+    fixture_id: int
+
+    def encode(self) -> str:
+        raw = '%s|%s' % (self.kickoff_time_utc.isoformat(), self.fixture_id)
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @classmethod
+    def decode(cls, encoded: str) -> 'FeedCursor':
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode('utf-8')
+            kickoff, fixture_id = raw.split('|')
+            kickoff_time_utc = datetime.fromisoformat(kickoff)
+            fixture_id = int(fixture_id)
+        except ValueError as e:
+            raise InvalidCursor("Invalid feed cursor %r" % encoded) from e
+        if kickoff_time_utc.tzinfo is None:
+            raise InvalidCursor("Invalid feed cursor %r" % encoded)
+        return cls(kickoff_time_utc, fixture_id)
+
+    @classmethod
+    def for_fixture(cls, fixture: Fixture) -> 'FeedCursor':
+        return cls(fixture.kickoff_time_utc, fixture.id)
+
+
+class FeedPage(NamedTuple):
+    # Fixtures in kickoff order, with cursors for the pages either side or None when there's nothing there
+    fixtures: List[Fixture]
+    earlier_cursor: Union[FeedCursor, None]
+    later_cursor: Union[FeedCursor, None]
+
+
+def get_feed_page(team_ids: Union[Iterable[int], QuerySet], cursor: FeedCursor = None,
+                  direction: str = DIRECTION_LATER, page_size: int = None) -> FeedPage:
+    # Keyset pagination over Fixture.get_feed: each page starts an index range scan at the cursor and stops after
+    # page_size rows, so neither OFFSET nor the rest of the history is ever read.  Without a cursor the page starts
+    # at the next kickoff.
+    if page_size is None:
+        page_size = settings.HOME_FEED_PAGE_SIZE
+    if direction not in (DIRECTION_EARLIER, DIRECTION_LATER):
+        raise ValueError("Unknown feed direction %r" % direction)
+    if cursor is None:
+        cursor = FeedCursor(timezone.now(), 0)
+        direction = DIRECTION_LATER
+
+    feed = Fixture.get_feed(team_ids)
+    if direction == DIRECTION_LATER:
+        fixtures = list(_after(feed, cursor).order_by('kickoff_time_utc', 'id')[:page_size + 1])
+        has_later = len(fixtures) > page_size
+        fixtures = fixtures[:page_size]
+        has_earlier = _before(feed, fixtures[0] if fixtures else cursor).exists()
+    else:
+        fixtures = list(_before(feed, cursor).order_by('-kickoff_time_utc', '-id')[:page_size + 1])
+        has_earlier = len(fixtures) > page_size
+        fixtures = fixtures[:page_size][::-1]
+        has_later = _after(feed, fixtures[-1] if fixtures else cursor).exists()
+    return FeedPage(fixtures,
+                    _get_edge_cursor(fixtures, 0, cursor) if has_earlier else None,
+                    _get_edge_cursor(fixtures, -1, cursor) if has_later else None)
+
+
+def get_first_page(team_ids: Union[Iterable[int], QuerySet]) -> FeedPage:
+    # What the feed opens on: the current gameweek when the teams play in it, otherwise the next kickoffs
+    return get_current_gameweek_page(team_ids) or get_feed_page(team_ids)
+
+
+def get_current_gameweek_page(team_ids: Union[Iterable[int], QuerySet]) -> Union[FeedPage, None]:
+    # One indexed lookup for the fixtures, using the current gameweek worked out at ingest, then a probe each side
+    fixtures = list(Fixture.get_current_gameweek_feed(team_ids))
+    if not fixtures:
+        return None
+    feed = Fixture.get_feed(team_ids)
+    return FeedPage(fixtures,
+                    FeedCursor.for_fixture(fixtures[0]) if _before(feed, fixtures[0]).exists() else None,
+                    FeedCursor.for_fixture(fixtures[-1]) if _after(feed, fixtures[-1]).exists() else None)
+
+
+def get_cached_page(team_versions: Dict[int, int], cursor: FeedCursor = None,
+                    direction: str = DIRECTION_LATER) -> FeedPage:
+    # Pages are shared by everyone following the same teams.  The teams' feed versions are part of the key, so an
+    # entry stops being used as soon as one of their fixtures changes and the LRU ages it out, while feeds for other
+    # teams stay cached.  Following different teams means a different key, so preference changes need no
+    # invalidation.  The next-kickoffs page moves with the clock rather than the fixtures, so it's never cached.
+    team_ids = tuple(sorted(team_versions))
+    versions = tuple(team_versions[team_id] for team_id in team_ids)
+    page_size = settings.HOME_FEED_PAGE_SIZE
+    if cursor is None:
+        page = _get_cached((team_ids, versions, page_size),
+                           lambda: get_current_gameweek_page(team_ids))
+        return page or get_feed_page(team_ids)
+    return _get_cached((team_ids, versions, page_size, cursor, direction),
+                       lambda: get_feed_page(team_ids, cursor, direction))
+
+
+def get_feed_cache() -> LRUCache:
+    global _feed_cache
+    if _feed_cache is None:
+        _feed_cache = LRUCache(settings.HOME_FEED_CACHE_MAX_ENTRIES)
+    return _feed_cache
+
+
+def serialize_fixture(fixture: Fixture) -> Dict:
+    return {
+        'id': fixture.id,
+        'kickoff_time_utc': fixture.kickoff_time_utc.isoformat(),
+        'status': fixture.status.description,
+        'home_team': {'id': fixture.home_team.id, 'name': fixture.home_team.name},
+        'away_team': {'id': fixture.away_team.id, 'name': fixture.away_team.name},
+        'home_score': fixture.home_score,
+        'away_score': fixture.away_score,
+    }
+
+
+def _after(feed: QuerySet, position: Union[Fixture, FeedCursor]) -> QuerySet:
+    kickoff_time_utc, fixture_id = _get_position(position)
+    # The plain range on kickoff_time_utc is what lets the (team, kickoff_time_utc) indexes bound the scan
+    return feed.filter(kickoff_time_utc__gte=kickoff_time_utc) \
+        .exclude(kickoff_time_utc=kickoff_time_utc, id__lte=fixture_id)
+
+
+def _before(feed: QuerySet, position: Union[Fixture, FeedCursor]) -> QuerySet:
+    kickoff_time_utc, fixture_id = _get_position(position)
+    return feed.filter(kickoff_time_utc__lte=kickoff_time_utc) \
+        .exclude(kickoff_time_utc=kickoff_time_utc, id__gte=fixture_id)
+
+
+def _get_cached(key: Hashable, get_page: Callable[[], Union[FeedPage, None]]) -> Union[FeedPage, None]:
+    # Stored in a tuple so that no current gameweek page, None, is cached too
+    feed_cache = get_feed_cache()
+    entry = feed_cache.get(key)
+    if entry is None:
+        entry = (get_page(),)
+        feed_cache.set(key, entry)
+    return entry[0]
+
+
+def _get_position(position: Union[Fixture, FeedCursor]) -> FeedCursor:
+    if isinstance(position, Fixture):
+        return FeedCursor.for_fixture(position)
+    return position
+
+
+def _get_edge_cursor(fixtures: List[Fixture], index: int, cursor: FeedCursor) -> FeedCursor:
+    # An empty page still pages onwards from where it was asked for
+    if not fixtures:
+        return cursor
+    return FeedCursor.for_fixture(fixtures[index])
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List
+from django.conf import settings
+from django.db import connections
+from .metrics import RATE_LIMITER_WAIT_SECONDS
+from .models import Api
+from .services import ApiGetClient, FDDOApiClient
+from .singleflight import refresh_flights
+
+logger = logging.getLogger(__name__)
+
+
+def get_competition_client_factories(competition_ids: List[int] = None, fetch_mode: str = None) -> List[Callable]:
+    if competition_ids is None:
+        competition_ids = settings.FDDO_COMPETITION_IDS
+    # Streamed bodies are read while the response is handled, which happens one client at a time
+    return [partial(FDDOApiClient, fetch_mode=fetch_mode, stream=False, competition_id=competition_id)
+            for competition_id in competition_ids]
+
+
+class AsyncFetcher:
+    # Fetches many clients at once.  Only the network round trips overlap, on a thread pool over the pooled session.
+    # Everything touching the database runs on one dedicated thread, since the ORM can't be used from the event loop
+    # and ingestion writes are better serialized anyway.  Each request type is leased for the whole batch and each
+    # Api's requests queue on its token bucket.
+
+    def __init__(self, client_factories: List[Callable] = None, max_workers: int = None, max_attempts: int = None):
+        if client_factories is None:
+            client_factories = get_competition_client_factories()
+        if max_workers is None:
+            max_workers = settings.ASYNC_FETCH_MAX_WORKERS
+        if max_attempts is None:
+            max_attempts = settings.ASYNC_FETCH_MAX_ATTEMPTS
+        self.client_factories = client_factories
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.clients: List[ApiGetClient] = []
+        self._lease_owners: Dict[int, str] = {}
+        self._database_executor = None
+        self._network_executor = None
+
+    def run(self) -> bool:
+        return asyncio.run(self.fetch_all())
+
+    async def fetch_all(self) -> bool:
+        self._database_executor = ThreadPoolExecutor(max_workers=1)
+        self._network_executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            clients = await self._run_in_database(self._create_leased_clients)
+
+            semaphores: Dict[int, asyncio.Semaphore] = {}
+            for client in clients:
+                api = client.request_type.api
+                if api.id not in semaphores:
+                    semaphores[api.id] = asyncio.Semaphore(self._get_api_concurrency(api))
+
+            results = await asyncio.gather(*[self.fetch(client, semaphores[client.request_type.api.id])
+                                             for client in clients])
+            return all(results)
+        finally:
+            await self._run_in_database(self._release_leases)
+            self._network_executor.shutdown(wait=True)
+            self._database_executor.shutdown(wait=True)
+
+    async def fetch(self, client: ApiGetClient, semaphore: asyncio.Semaphore) -> bool:
+        loop = asyncio.get_running_loop()
+        api = client.request_type.api
+        try:
+            async with semaphore:
+                for _ in range(self.max_attempts):
+                    wait_seconds = await self._run_in_database(api.seconds_until_request_allowed)
+                    if wait_seconds > 0:
+                        RATE_LIMITER_WAIT_SECONDS.observe(wait_seconds, api=api.name)
+                        await asyncio.sleep(wait_seconds)
+                    if not await self._run_in_database(client.prepare_request):
+                        # Another caller took the request slot first
+                        continue
+                    await loop.run_in_executor(self._network_executor, client.send_request)
+                    # Also called after a failed send, so the failure is recorded as an IngestionRun
+                    return await self._run_in_database(client.handle_response)
+            logger.warning("No request slot for %s after %s attempts", client.request_type, self.max_attempts)
+        except Exception:
+            logger.exception("Unhandled error fetching %s", client.url or client.request_type)
+        return False
+
+    async def _run_in_database(self, fn: Callable[[], Any]) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._database_executor, fn)
+
+    def _create_leased_clients(self) -> List[ApiGetClient]:
+        # Returns the clients whose request type this process now holds the lease for
+        self.clients = [client_factory() for client_factory in self.client_factories]
+        self._lease_owners = {}
+        leased_clients = []
+        skipped_request_type_ids = set()
+        for client in self.clients:
+            # Loaded here so the event loop never triggers a lazy query
+            client.request_type.api
+            request_type_id = client.request_type.id
+            if request_type_id not in self._lease_owners and request_type_id not in skipped_request_type_ids:
+                owner = refresh_flights.acquire_lease(request_type_id)
+                if owner is None:
+                    logger.info("Request type %s is being refreshed elsewhere, skipping", request_type_id)
+                    skipped_request_type_ids.add(request_type_id)
+                else:
+                    self._lease_owners[request_type_id] = owner
+            if request_type_id in self._lease_owners:
+                leased_clients.append(client)
+        return leased_clients
+
+    def _release_leases(self) -> None:
+        try:
+            for request_type_id, owner in self._lease_owners.items():
+                refresh_flights.release_lease(request_type_id, owner)
+            self._lease_owners = {}
+        finally:
+            # The database thread is about to go away, so don't leave its connection open
+            connections.close_all()
+
+    def _get_api_concurrency(self, api: Api) -> int:
+        # Never more requests in flight than the bucket could ever allow at once
+        if not api.is_rate_limited:
+            return settings.ASYNC_FETCH_CONCURRENCY_PER_API
+        return max(1, min(int(api.bucket_capacity), settings.ASYNC_FETCH_CONCURRENCY_PER_API))
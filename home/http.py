@@ -0,0 +1,70 @@
+import threading
+from typing import Dict
+from urllib.parse import urlsplit
+from django.conf import settings
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+
+_session = None
+_session_lock = threading.Lock()
+_mounted_hosts = set()
+
+
+def get(url: str, headers: Dict = None, **kwargs) -> Response:
+    # Shared keep-alive session for every ApiGetClient, so polls reuse connections instead of re-handshaking
+    session = get_session()
+    _mount_host(session, url)
+    kwargs.setdefault('timeout', (settings.API_CLIENT_CONNECT_TIMEOUT_SECONDS,
+                                  settings.API_CLIENT_READ_TIMEOUT_SECONDS))
+    return session.get(url, headers=headers, **kwargs)
+
+
+def get_session() -> Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            # requests already asks for gzip and keep-alive by default
+            _session = Session()
+        return _session
+
+
+def reset_session() -> None:
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _mounted_hosts.clear()
+
+
+def connection_stats() -> Dict[str, Dict[str, int]]:
+    # Per host: requests sent, connections opened, and how many requests went over an already open connection
+    stats = {}
+    with _session_lock:
+        if _session is None:
+            return stats
+        adapters = list(_session.adapters.values())
+    for adapter in adapters:
+        pool_manager = getattr(adapter, 'poolmanager', None)
+        if pool_manager is None:
+            continue
+        for pool_key in pool_manager.pools.keys():
+            pool = pool_manager.pools.get(pool_key)
+            if pool is None:
+                continue
+            host_stats = stats.setdefault(pool.host, {'requests': 0, 'connections': 0, 'reused': 0})
+            host_stats['requests'] += pool.num_requests
+            host_stats['connections'] += pool.num_connections
+            host_stats['reused'] += max(pool.num_requests - pool.num_connections, 0)
+    return stats
+
+
+def _mount_host(session: Session, url: str) -> None:
+    parsed_url = urlsplit(url)
+    prefix = '%s://%s' % (parsed_url.scheme, parsed_url.netloc)
+    with _session_lock:
+        if prefix in _mounted_hosts:
+            return
+        pool_size = settings.API_CLIENT_POOL_SIZES.get(parsed_url.hostname, settings.API_CLIENT_DEFAULT_POOL_SIZE)
+        session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        _mounted_hosts.add(prefix)
@@ -0,0 +1,206 @@
+import logging
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Set, Union
+from django.db import connection, transaction
+from django.db.models import F
+from .models import (
+    Fixture, FixtureChange, FixtureMapping, FixtureStatusMapping, Gameweek, Team, TeamMapping,
+    feed_versions_bumped_in_bulk
+)
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_UPDATE_FIELDS = ['home_team', 'away_team', 'home_score', 'away_score', 'kickoff_time_utc', 'status',
+                         'source_fingerprint', 'gameweek']
+
+
+class ExternalFixture(NamedTuple):
+    external_id: int
+    home_team_external_id: int
+    away_team_external_id: int
+    status_external_id: str
+    kickoff_time_utc: datetime
+    home_score: Union[int, None]
+    away_score: Union[int, None]
+    matchday: Union[int, None] = None
+
+
+class FixtureIngestor:
+    # Batched upsert of fixtures from one API: every mapping is preloaded up front, incoming fixtures are diffed
+    # against the stored ones in memory and the changes are written in bulk inside a single transaction.
+
+    def __init__(self, api_id: int, competition_external_id: int = None):
+        self.api_id = api_id
+        # Matchdays are only stored as gameweeks for fixtures from a known competition
+        self.competition_external_id = competition_external_id
+        self.team_ids: Dict[int, int] = {}
+        self.status_ids: Dict[str, int] = {}
+        self.gameweek_ids: Dict[int, int] = {}
+        self.fixtures: Dict[int, Fixture] = {}
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.invalid = 0
+        self._to_create: List[ExternalFixture] = []
+        self._to_update: Dict[int, Fixture] = {}
+        # Unchanged fixtures whose stored fingerprint is missing or from an older scheme, by primary key
+        self._to_fingerprint: Dict[int, Fixture] = {}
+        # Teams whose cached feeds the pending changes make stale, on both sides of any change of teams
+        self._changed_team_ids: Set[int] = set()
+        # Fixtures to append to the change log, by external id so a match repeated in a payload is logged once
+        self._to_log: Dict[int, Fixture] = {}
+        self._loaded = False
+
+    def load(self) -> None:
+        self.team_ids = dict(TeamMapping.objects.filter(api_id=self.api_id,
+                                                        numeric_external_identifier__isnull=False)
+                             .values_list('numeric_external_identifier', 'value_id'))
+        self.status_ids = dict(FixtureStatusMapping.objects.filter(api_id=self.api_id,
+                                                                   string_external_identifier__isnull=False)
+                               .values_list('string_external_identifier', 'value_id'))
+        existing_fixtures = Fixture.objects.filter(fixturemapping__api_id=self.api_id,
+                                                   fixturemapping__numeric_external_identifier__isnull=False) \
+            .annotate(external_id=F('fixturemapping__numeric_external_identifier'))
+        self.fixtures = {fixture.external_id: fixture for fixture in existing_fixtures}
+        if self.competition_external_id is not None:
+            self.gameweek_ids = Gameweek.get_ids(self.api_id, self.competition_external_id)
+        self._loaded = True
+
+    @property
+    def changed(self) -> int:
+        return self.created + self.updated
+
+    @property
+    def seen(self) -> int:
+        return self.created + self.updated + self.unchanged + self.invalid
+
+    @property
+    def pending(self) -> int:
+        return len(self._to_create) + len(self._to_update) + len(self._to_fingerprint)
+
+    def is_unchanged(self, external_id: int, fingerprint: bytes) -> bool:
+        # Lets callers skip parsing and mapping resolution entirely for matches nothing has happened in
+        if not self._loaded:
+            self.load()
+
+        fixture = self.fixtures.get(external_id)
+        if fixture is None or fixture.source_fingerprint is None:
+            return False
+        if bytes(fixture.source_fingerprint) != fingerprint:
+            return False
+        self.unchanged += 1
+        return True
+
+    def add(self, external_fixture: ExternalFixture, fingerprint: bytes = None) -> bool:
+        if not self._loaded:
+            self.load()
+
+        home_team_id = self.team_ids.get(external_fixture.home_team_external_id)
+        away_team_id = self.team_ids.get(external_fixture.away_team_external_id)
+        status_id = self.status_ids.get(external_fixture.status_external_id)
+        if home_team_id is None or away_team_id is None or status_id is None:
+            unmapped = [('home team', home_team_id, external_fixture.home_team_external_id),
+                        ('away team', away_team_id, external_fixture.away_team_external_id),
+                        ('status', status_id, external_fixture.status_external_id)]
+            logger.warning("Match %s from Api %s has unmapped external ids: %s", external_fixture.external_id,
+                           self.api_id, ', '.join('%s %r' % (description, external_id)
+                                                  for description, value_id, external_id in unmapped
+                                                  if value_id is None))
+            self.invalid += 1
+            return False
+        gameweek_id = self._get_gameweek_id(external_fixture.matchday)
+
+        fixture = self.fixtures.get(external_fixture.external_id)
+        if fixture is None:
+            fixture = Fixture(home_team_id=home_team_id, away_team_id=away_team_id,
+                              home_score=external_fixture.home_score, away_score=external_fixture.away_score,
+                              kickoff_time_utc=external_fixture.kickoff_time_utc, status_id=status_id,
+                              source_fingerprint=fingerprint, gameweek_id=gameweek_id)
+            # Registered straight away so a duplicate id later in the same payload updates rather than re-creates
+            fixture.external_id = external_fixture.external_id
+            self.fixtures[external_fixture.external_id] = fixture
+            self._to_create.append(external_fixture)
+            self._changed_team_ids.update((home_team_id, away_team_id))
+            self._to_log[external_fixture.external_id] = fixture
+            return True
+
+        incoming = (home_team_id, away_team_id, external_fixture.home_score, external_fixture.away_score,
+                    external_fixture.kickoff_time_utc, status_id, gameweek_id)
+        stored = (fixture.home_team_id, fixture.away_team_id, fixture.home_score, fixture.away_score,
+                  fixture.kickoff_time_utc, fixture.status_id, fixture.gameweek_id)
+        if incoming == stored:
+            # Rows stored before fingerprinting, or under an older scheme, only get their fingerprint written, so
+            # they're skipped from the next poll on without counting as a change to the feed or the change log
+            if fingerprint is not None and fixture.pk is not None and fixture.pk not in self._to_update and \
+                    (fixture.source_fingerprint is None or bytes(fixture.source_fingerprint) != fingerprint):
+                fixture.source_fingerprint = fingerprint
+                self._to_fingerprint[fixture.pk] = fixture
+            self.unchanged += 1
+            return True
+
+        self._changed_team_ids.update((fixture.home_team_id, fixture.away_team_id, home_team_id, away_team_id))
+        if incoming[2:6] != stored[2:6]:
+            # Scores, kickoff or status, the changes clients sync
+            self._to_log[external_fixture.external_id] = fixture
+        fixture.source_fingerprint = fingerprint
+        (fixture.home_team_id, fixture.away_team_id, fixture.home_score, fixture.away_score,
+         fixture.kickoff_time_utc, fixture.status_id, fixture.gameweek_id) = incoming
+        if fixture.pk is not None:
+            self._to_update[fixture.pk] = fixture
+            self._to_fingerprint.pop(fixture.pk, None)
+        return True
+
+    def flush(self) -> None:
+        if not self._to_create and not self._to_update and not self._to_fingerprint:
+            return
+
+        with transaction.atomic(), feed_versions_bumped_in_bulk():
+            if self._to_update:
+                Fixture.objects.bulk_update(list(self._to_update.values()), FIXTURE_UPDATE_FIELDS)
+                self.updated += len(self._to_update)
+            if self._to_create:
+                self._create_fixtures()
+                self.created += len(self._to_create)
+            if self._changed_team_ids:
+                Team.bump_feed_versions(self._changed_team_ids)
+            if self._to_log:
+                FixtureChange.append(self._to_log.values())
+            if self._to_fingerprint:
+                Fixture.objects.bulk_update(list(self._to_fingerprint.values()), ['source_fingerprint'])
+
+        self._to_create = []
+        self._to_update = {}
+        self._to_fingerprint = {}
+        self._changed_team_ids = set()
+        self._to_log = {}
+
+    def refresh_gameweeks(self) -> None:
+        # Bounds only move when fixtures do, but the current gameweek can roll over between any two polls
+        if self.competition_external_id is not None and self.gameweek_ids:
+            Gameweek.refresh(self.api_id, self.competition_external_id, bounds_changed=self.changed > 0)
+
+    def _get_gameweek_id(self, matchday: Union[int, None]) -> Union[int, None]:
+        if matchday is None or self.competition_external_id is None:
+            return None
+        gameweek_id = self.gameweek_ids.get(matchday)
+        if gameweek_id is None:
+            # A handful of times a season, when a competition's fixtures are first ingested
+            gameweek_id = Gameweek.objects.get_or_create(api_id=self.api_id,
+                                                         competition_external_id=self.competition_external_id,
+                                                         number=matchday)[0].id
+            self.gameweek_ids[matchday] = gameweek_id
+        return gameweek_id
+
+    def _create_fixtures(self) -> None:
+        new_fixtures = [self.fixtures[external_fixture.external_id] for external_fixture in self._to_create]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Fixture.objects.bulk_create(new_fixtures)
+        else:
+            # The backend can't hand back primary keys from a bulk insert, and we need them for the mappings.  New
+            # fixtures only turn up once per season so saving them one at a time is an acceptable fallback.
+            for fixture in new_fixtures:
+                fixture.save()
+
+        FixtureMapping.objects.bulk_create([FixtureMapping(value_id=fixture.id, api_id=self.api_id,
+                                                           numeric_external_identifier=fixture.external_id)
+                                            for fixture in new_fixtures])
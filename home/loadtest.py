@@ -0,0 +1,135 @@
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Iterable, List, Tuple
+from django.db import connection
+from .constants import FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE
+from .enums import FixtureStatusIds
+from .models import Api, FixtureStatus, FixtureStatusMapping, RequestType, RequestValidators, Team, TeamMapping
+
+
+class StageStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.peak_memory_bytes = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'calls': self.calls, 'seconds': round(self.seconds, 6), 'queries': self.queries,
+                'query_seconds': round(self.query_seconds, 6), 'peak_memory_bytes': self.peak_memory_bytes}
+
+
+class StageTimer:
+    # Attributes wall time, queries and memory to named stages.  Methods are instrumented in place for the duration
+    # of measure(); calls made while another stage is running count towards that outer stage.  A stage's peak memory
+    # is the most any single call allocated on top of what was already held when it started.
+
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {}
+        self.total = StageStats()
+        self._current = None
+
+    @contextmanager
+    def measure(self, instrumented: Iterable[Tuple[type, str, str]] = ()):
+        with ExitStack() as stack:
+            for owner, attribute, stage_name in instrumented:
+                stack.enter_context(self._instrument(owner, attribute, stage_name))
+            stack.enter_context(connection.execute_wrapper(self._execute))
+            tracemalloc.start()
+            started = time.perf_counter()
+            try:
+                yield self
+            finally:
+                self.total.seconds += time.perf_counter() - started
+                self.total.calls += 1
+                self.total.peak_memory_bytes = max(self.total.peak_memory_bytes, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name: str):
+        if self._current is not None:
+            yield
+            return
+
+        stats = self.stages.setdefault(name, StageStats())
+        self._current = stats
+        held_memory, peak_before = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats.seconds += time.perf_counter() - started
+            stats.calls += 1
+            peak = tracemalloc.get_traced_memory()[1]
+            stats.peak_memory_bytes = max(stats.peak_memory_bytes, peak - held_memory)
+            # Keep the overall peak, which reset_peak just threw away
+            self.total.peak_memory_bytes = max(self.total.peak_memory_bytes, peak_before, peak)
+            self._current = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'total': self.total.as_dict(), 'stages': {name: stats.as_dict() for name, stats in self.stages.items()}}
+
+    def _execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.total.queries += 1
+            self.total.query_seconds += elapsed
+            if self._current is not None:
+                self._current.queries += 1
+                self._current.query_seconds += elapsed
+
+    @contextmanager
+    def _instrument(self, owner: type, attribute: str, stage_name: str):
+        had_own_attribute = attribute in owner.__dict__
+        original = getattr(owner, attribute)
+
+        def instrumented(*args, **kwargs):
+            with self.stage(stage_name):
+                return original(*args, **kwargs)
+
+        setattr(owner, attribute, instrumented)
+        try:
+            yield
+        finally:
+            if had_own_attribute:
+                setattr(owner, attribute, original)
+            else:
+                delattr(owner, attribute)
+
+
+@contextmanager
+def throwaway_database():
+    # A freshly migrated copy of the default database, created and destroyed the way the test runner does, so load
+    # tests and benchmarks never touch real data
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def set_up_fake_fddo_api(base_url: str, team_ids: List[int]) -> Api:
+    # Points the football-data.org request type at a fake server, with its own Api so the mappings don't collide
+    # with any the migrations loaded
+    api = Api.objects.create(name='Fake football-data.org')
+    RequestType.objects.update_or_create(id=FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE, defaults={
+        'api': api, 'base_url': base_url, 'description': 'Fake football-data.org matches', 'current_version_iter': 0,
+    })
+    RequestValidators.objects.filter(request_type_id=FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE).delete()
+
+    for team_id in team_ids:
+        team = Team.objects.create(name='Team %s' % team_id)
+        TeamMapping.objects.create(value=team, api=api, numeric_external_identifier=team_id)
+    for status in FixtureStatusIds:
+        fixture_status, _ = FixtureStatus.objects.get_or_create(id=status.value,
+                                                                defaults={'description': status.name.title()})
+        FixtureStatusMapping.objects.create(value=fixture_status, api=api, string_external_identifier=status.name)
+    return api
@@ -0,0 +1,109 @@
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Union
+from django.core.management.base import BaseCommand, CommandError
+from home.ingestion import ExternalFixture
+from home.services import FDDO_MATCH_DECODER
+
+STATUSES = ['FINISHED', 'IN_PLAY', 'PAUSED', 'SCHEDULED']
+
+
+def legacy_parse_match(match_json: Dict) -> Union[ExternalFixture, None]:
+    # The hand written parser FDDO_MATCH_DECODER replaced, kept as the baseline to measure against
+    if 'id' not in match_json:
+        return None
+
+    status = None
+    utc_date = None
+    home_team_ext_id = None
+    away_team_ext_id = None
+    home_score = None
+    away_score = None
+
+    if 'status' in match_json:
+        status = match_json['status']
+    if 'utcDate' in match_json:
+        utc_date = match_json['utcDate']
+    if 'homeTeam' in match_json:
+        if 'id' in match_json['homeTeam']:
+            home_team_ext_id = match_json['homeTeam']['id']
+    if 'awayTeam' in match_json:
+        if 'id' in match_json['awayTeam']:
+            away_team_ext_id = match_json['awayTeam']['id']
+    if 'score' in match_json:
+        if 'fullTime' in match_json['score']:
+            if 'homeTeam' in match_json['score']['fullTime']:
+                home_score = match_json['score']['fullTime']['homeTeam']
+            if 'awayTeam' in match_json['score']['fullTime']:
+                away_score = match_json['score']['fullTime']['awayTeam']
+
+    if any(var is None for var in [status, utc_date, home_team_ext_id,
+                                   away_team_ext_id]):
+        return None
+
+    try:
+        fixture_dt = datetime.strptime(utc_date, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+    return ExternalFixture(external_id=match_json['id'], home_team_external_id=home_team_ext_id,
+                           away_team_external_id=away_team_ext_id, status_external_id=status,
+                           kickoff_time_utc=fixture_dt, home_score=home_score, away_score=away_score,
+                           matchday=match_json.get('matchday'))
+
+
+def decoder_parse_match(match_json: Dict) -> Union[ExternalFixture, None]:
+    return FDDO_MATCH_DECODER.decode(match_json).record
+
+
+def generate_matches(count: int) -> List[Dict]:
+    # Ten matches share each kickoff slot, like a real matchday
+    first_kickoff = datetime(2019, 8, 9, 19, tzinfo=timezone.utc)
+    matches = []
+    for i in range(count):
+        kickoff = first_kickoff + timedelta(days=i // 10)
+        matches.append({
+            'id': 200000 + i,
+            'status': STATUSES[i % len(STATUSES)],
+            'matchday': i // 10 + 1,
+            'utcDate': kickoff.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'homeTeam': {'id': 57 + i % 20, 'name': 'Home FC'},
+            'awayTeam': {'id': 58 + i % 20, 'name': 'Away FC'},
+            'score': {'winner': 'HOME_TEAM', 'duration': 'REGULAR',
+                      'fullTime': {'homeTeam': i % 5, 'awayTeam': i % 3},
+                      'halfTime': {'homeTeam': i % 2, 'awayTeam': 0}},
+        })
+    return matches
+
+
+class Command(BaseCommand):
+    help = "Compares FDDO match decoding throughput of the compiled decoder against the old hand written parser"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matches', type=int, default=4000, help="Matches per decoding run")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per parser, the fastest one is reported")
+
+    def handle(self, *args, **options):
+        matches = generate_matches(options['matches'])
+
+        if [legacy_parse_match(match) for match in matches] != [decoder_parse_match(match) for match in matches]:
+            raise CommandError("The decoder and the legacy parser disagree")
+
+        legacy_seconds = self.time_parser(legacy_parse_match, matches, options['repeat'])
+        decoder_seconds = self.time_parser(decoder_parse_match, matches, options['repeat'])
+
+        self.stdout.write("legacy:  %.0f matches/sec" % (len(matches) / legacy_seconds))
+        self.stdout.write("decoder: %.0f matches/sec" % (len(matches) / decoder_seconds))
+        self.stdout.write("speedup: %.2fx" % (legacy_seconds / decoder_seconds))
+
+    def time_parser(self, parse_match: Callable[[Dict], Union[ExternalFixture, None]], matches: List[Dict],
+                    repeat: int) -> float:
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for match in matches:
+                parse_match(match)
+            elapsed = time.perf_counter() - started
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
@@ -0,0 +1,107 @@
+import json
+import platform
+import random
+from datetime import datetime
+from typing import Any, Dict
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from home.constants import FDDO_FETCH_MODE_FULL
+from home.fakeserver import DEFAULT_TEAM_IDS, FakeCompetition
+from home.ingestion import FixtureIngestor
+from home.loadtest import StageTimer, set_up_fake_fddo_api, throwaway_database
+from home.services import ApiGetClient, FDDOApiClient
+
+COMPETITION_ID = 2021
+BENCHMARK_URL = 'http://benchmark.invalid/v2/competitions/[Competition ID]/matches'
+DEFAULT_SIZES = [400, 4000, 40000]
+# Share of matches whose score changes between the initial ingest and the update
+UPDATE_CHURN_RATE = 0.01
+
+
+class BenchmarkResponse:
+    # Just enough of requests.Response for ApiGetClient.handle_response
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.status_code = 200
+        self.ok = True
+        self.headers = {}
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+INSTRUMENTED_STAGES = [
+    (ApiGetClient, '_hash_content', 'hashing'),
+    (ApiGetClient, '_audit_request', 'auditing'),
+    (ApiGetClient, '_set_req_audit_successful', 'auditing'),
+    (ApiGetClient, '_identical_request_found', 'dedup'),
+    (BenchmarkResponse, 'json', 'decoding'),
+    (FDDOApiClient, '_validate', 'validation'),
+    (FDDOApiClient, '_fingerprint_match', 'parsing'),
+    (FDDOApiClient, '_parse_match', 'parsing'),
+    (FixtureIngestor, 'load', 'mapping resolution'),
+    (FixtureIngestor, 'is_unchanged', 'mapping resolution'),
+    (FixtureIngestor, 'add', 'mapping resolution'),
+    (FixtureIngestor, 'flush', 'persistence'),
+    (ApiGetClient, '_store_validators', 'persistence'),
+    (ApiGetClient, '_record_run', 'telemetry'),
+]
+
+
+class Command(BaseCommand):
+    help = "Times each stage of ApiGetClient.handle_response on synthetic FDDO payloads and writes the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Matches per payload")
+        parser.add_argument('--output', default=None, help="File to write the JSON results to, instead of stdout")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        results = {
+            'started_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'sizes': {},
+        }
+        for size in options['sizes']:
+            # A fresh database per size, so earlier runs' fixtures don't inflate the preloads
+            with throwaway_database():
+                set_up_fake_fddo_api(BENCHMARK_URL, DEFAULT_TEAM_IDS)
+                results['sizes'][str(size)] = self.run_size(size, random.Random(options['seed']))
+
+        output = json.dumps(results, indent=2)
+        if options['output'] is None:
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+            self.stderr.write("Results written to %s" % options['output'])
+
+    def run_size(self, size: int, rng: random.Random) -> Dict[str, Any]:
+        competition = FakeCompetition(COMPETITION_ID, size, DEFAULT_TEAM_IDS)
+        size_results = {'payload_bytes': len(competition.get_body())}
+
+        size_results['initial'] = self.run_handle_response(competition.get_body())
+        competition.churn(round(size * UPDATE_CHURN_RATE), rng)
+        size_results['update'] = self.run_handle_response(competition.get_body())
+
+        for scenario in ('initial', 'update'):
+            total = size_results[scenario]['total']
+            self.stderr.write("%s matches, %s: %.3fs, %s queries, %.1f MB peak"
+                              % (size, scenario, total['seconds'], total['queries'],
+                                 total['peak_memory_bytes'] / (1024 * 1024)))
+        return size_results
+
+    def run_handle_response(self, content: bytes) -> Dict[str, Any]:
+        client = FDDOApiClient(fetch_mode=FDDO_FETCH_MODE_FULL, stream=False, competition_id=COMPETITION_ID)
+        client.url = client.request_type.get_url(str(COMPETITION_ID))
+        client.request_time = datetime.utcnow()
+        client.response = BenchmarkResponse(content)
+
+        timer = StageTimer()
+        with timer.measure(INSTRUMENTED_STAGES):
+            succeeded = client.handle_response()
+        results = timer.as_dict()
+        results['succeeded'] = succeeded
+        results['matches'] = client.ingestor.seen if client.ingestor is not None else 0
+        return results
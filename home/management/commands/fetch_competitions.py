@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from home.constants import FDDO_FETCH_MODES
+from home.fetcher import AsyncFetcher, get_competition_client_factories
+
+
+class Command(BaseCommand):
+    help = "Fetches every configured football-data.org competition concurrently and ingests the fixtures"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--competition', type=int, action='append', dest='competition_ids',
+                            help="Competition id to fetch, repeatable. Defaults to FDDO_COMPETITION_IDS")
+        parser.add_argument('--mode', choices=FDDO_FETCH_MODES, default=None,
+                            help="Which fixtures to fetch, defaulting to FDDO_FETCH_MODE")
+
+    def handle(self, *args, **options):
+        fetcher = AsyncFetcher(get_competition_client_factories(options['competition_ids'], options['mode']))
+        if not fetcher.run():
+            raise CommandError("One or more competitions failed to fetch")
+        self.stdout.write("Fetched %s competitions" % len(fetcher.clients))
@@ -0,0 +1,81 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from home.constants import FDDO_FETCH_MODE_FULL
+from home.fakeserver import FakeFootballDataServer
+from home.loadtest import set_up_fake_fddo_api, throwaway_database
+from home.services import FDDOApiClient
+from home.telemetry import QueryCounter
+
+
+class PassStats:
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.matches = 0
+        self.changed = 0
+        self.seconds = 0.0
+        self.queries = QueryCounter()
+
+
+class Command(BaseCommand):
+    help = "Polls a local fake football-data.org server with FDDOApiClient and reports ingestion throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matches', type=int, default=380, help="Matches per competition payload")
+        parser.add_argument('--competition', type=int, action='append', dest='competition_ids',
+                            help="Competition id to poll, repeatable. Defaults to 2021")
+        parser.add_argument('--polls', type=int, default=10, help="Requests per competition")
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds the server waits before responding")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests failing with a 500")
+        parser.add_argument('--churn', type=float, default=0.0,
+                            help="Fraction of matches whose score changes on every request")
+        parser.add_argument('--no-etags', action='store_true', help="Don't send ETags or answer with 304s")
+        parser.add_argument('--stream', action='store_true', help="Use the streaming response mode")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        competition_ids = options['competition_ids'] or [2021]
+        server = FakeFootballDataServer(match_count=options['matches'], latency_seconds=options['latency'],
+                                        error_rate=options['error_rate'], etags=not options['no_etags'],
+                                        churn_rate=options['churn'], seed=options['seed']).start()
+        try:
+            with throwaway_database():
+                set_up_fake_fddo_api(server.matches_url, server.team_ids)
+                # The first poll creates every fixture, so it's reported apart from the steady state polls
+                initial = PassStats()
+                steady = PassStats()
+                for poll in range(options['polls']):
+                    for competition_id in competition_ids:
+                        self.poll(initial if poll == 0 else steady, competition_id, options['stream'])
+        finally:
+            server.stop()
+
+        self.stdout.write("server: %(requests)s requests, %(ok)s ok, %(not_modified)s not modified, "
+                          "%(errors)s errors" % server.stats)
+        self.report("initial poll", initial)
+        self.report("later polls", steady)
+
+    def poll(self, stats: PassStats, competition_id: int, stream: bool) -> None:
+        client = FDDOApiClient(fetch_mode=FDDO_FETCH_MODE_FULL, stream=stream, competition_id=competition_id)
+        started = time.perf_counter()
+        with connection.execute_wrapper(stats.queries):
+            succeeded = client.request()
+        stats.seconds += time.perf_counter() - started
+        stats.requests += 1
+        if not succeeded:
+            stats.failures += 1
+        if client.ingestor is not None:
+            stats.matches += client.ingestor.seen
+            stats.changed += client.ingestor.changed
+
+    def report(self, label: str, stats: PassStats) -> None:
+        if stats.requests == 0:
+            return
+        matches_per_second = stats.matches / stats.seconds if stats.seconds else 0.0
+        queries_per_match = "%.3f" % (stats.queries.count / stats.matches) if stats.matches else "n/a"
+        self.stdout.write("%s: %s requests (%s failed) in %.3fs, %s matches (%s changed), %.0f matches/sec, "
+                          "%s queries/match, %s queries in %.3fs"
+                          % (label, stats.requests, stats.failures, stats.seconds, stats.matches, stats.changed,
+                             matches_per_second, queries_per_match, stats.queries.count, stats.queries.seconds))
@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from home.constants import FDDO_FETCH_MODE_FULL
+from home.metrics import RATE_LIMITER_WAIT_SECONDS
+from home.services import FDDOApiClient
+from home.singleflight import refresh_flights
+
+
+class Command(BaseCommand):
+    help = "Fetches the full season from football-data.org and reconciles it with the stored fixtures"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attempts', type=int, default=5,
+                            help="How many times to wait for the rate limit or a running refresh before giving up")
+
+    def handle(self, *args, **options):
+        for _ in range(options['attempts']):
+            # The whole season is by far the largest payload, so it's parsed as it streams in
+            client = FDDOApiClient(fetch_mode=FDDO_FETCH_MODE_FULL, stream=True)
+
+            # The regular worker shares the rate limit and refresh lease, so wait our turn rather than skip
+            api = client.request_type.api
+            wait_seconds = api.seconds_until_request_allowed()
+            if wait_seconds > 0:
+                RATE_LIMITER_WAIT_SECONDS.observe(wait_seconds, api=api.name)
+                self.stdout.write("Waiting %.1f seconds for the API rate limit" % wait_seconds)
+                time.sleep(wait_seconds)
+
+            result = refresh_flights.run(client.request_type.id, client.request, wait=True)
+            if result is None or (result and client.response is None):
+                # Another process was refreshing, or the worker took the request slot first
+                continue
+            if not result:
+                raise CommandError("Full season reconciliation failed")
+            self.stdout.write("Full season reconciliation complete")
+            return
+
+        raise CommandError("Couldn't get a request slot for the full season reconciliation")
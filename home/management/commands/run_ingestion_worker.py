@@ -0,0 +1,31 @@
+import signal
+from django.core.management.base import BaseCommand
+from home.worker import IngestionWorker
+
+
+class Command(BaseCommand):
+    help = "Runs the fixture ingestion worker, refreshing every configured API client on its own schedule"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help="Fixed seconds between polls, overriding the fixture driven schedule")
+        parser.add_argument('--once', action='store_true', help="Run a single refresh of every client and exit")
+
+    def handle(self, *args, **options):
+        worker = IngestionWorker(poll_interval_seconds=options['interval'])
+
+        if options['once']:
+            if not worker.run_once():
+                self.stderr.write("One or more refreshes failed")
+            return
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        if worker.poll_interval_seconds is None:
+            self.stdout.write("Ingestion worker started, polling on the fixture driven schedule")
+        else:
+            self.stdout.write("Ingestion worker started, polling every %s seconds" % worker.poll_interval_seconds)
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
+        self.stdout.write("Ingestion worker stopped")
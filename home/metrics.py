@@ -0,0 +1,62 @@
+from typing import List
+from sportsfeed import metrics
+from .http import connection_stats
+
+OUTBOUND_REQUEST_SECONDS = metrics.histogram('sportsfeed_outbound_request_duration_seconds',
+                                             "Time until an external API answered, by Api", ['api'],
+                                             buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+RATE_LIMITER_WAIT_SECONDS = metrics.histogram('sportsfeed_rate_limiter_wait_seconds',
+                                              "Time spent waiting for an Api's rate limiter to allow a request",
+                                              ['api'], buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+RATE_LIMITER_DENIALS = metrics.counter('sportsfeed_rate_limiter_denials_total',
+                                       "Requests not sent because the Api's rate limiter had no slot free", ['api'])
+
+
+@metrics.registry.register_collector
+def collect_cache_metrics() -> List[metrics.Metric]:
+    from .feed import get_feed_cache
+
+    hits = metrics.Counter('sportsfeed_cache_hits_total', "Cache lookups that found an entry", ['cache'])
+    misses = metrics.Counter('sportsfeed_cache_misses_total', "Cache lookups that found nothing", ['cache'])
+    evictions = metrics.Counter('sportsfeed_cache_evictions_total', "Entries evicted to make room", ['cache'])
+    entries = metrics.Gauge('sportsfeed_cache_entries', "Entries currently cached", ['cache'])
+    hit_ratio = metrics.Gauge('sportsfeed_cache_hit_ratio', "Hits over lookups since the process started", ['cache'])
+    for cache_name, cache in [('feed', get_feed_cache())]:
+        stats = cache.stats()
+        hits.inc(stats['hits'], cache=cache_name)
+        misses.inc(stats['misses'], cache=cache_name)
+        evictions.inc(stats['evictions'], cache=cache_name)
+        entries.set(stats['entries'], cache=cache_name)
+        hit_ratio.set(stats['hit_ratio'], cache=cache_name)
+    return [hits, misses, evictions, entries, hit_ratio]
+
+
+@metrics.registry.register_collector
+def collect_connection_metrics() -> List[metrics.Metric]:
+    # From the shared API session's connection pools, so they start again from zero if the session is reset
+    sent = metrics.Counter('sportsfeed_outbound_requests_total', "Requests sent over the shared API session, by host",
+                           ['host'])
+    opened = metrics.Counter('sportsfeed_outbound_connections_opened_total',
+                             "Connections the shared API session opened, by host", ['host'])
+    reused = metrics.Counter('sportsfeed_outbound_connections_reused_total',
+                             "Requests sent over an already open connection, by host", ['host'])
+    for host, host_stats in connection_stats().items():
+        sent.inc(host_stats['requests'], host=host)
+        opened.inc(host_stats['connections'], host=host)
+        reused.inc(host_stats['reused'], host=host)
+    return [sent, opened, reused]
+
+
+@metrics.registry.register_collector
+def collect_ingestion_lag_metrics() -> List[metrics.Metric]:
+    # One indexed query per request type, only when scraped
+    from .models import RequestType
+    from .refresh import get_data_age_seconds
+
+    lag = metrics.Gauge('sportsfeed_ingestion_lag_seconds',
+                        "Seconds since the last successful request, by request type", ['request_type'])
+    for request_type_id, description in RequestType.objects.values_list('id', 'description'):
+        data_age_seconds = get_data_age_seconds(request_type_id)
+        if data_age_seconds is not None:
+            lag.set(data_age_seconds, request_type=description)
+    return [lag]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:39
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0003_refreshlease'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='fixturemapping',
+            unique_together={('api', 'numeric_external_identifier'), ('api', 'string_external_identifier')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='fixturestatusmapping',
+            unique_together={('api', 'numeric_external_identifier'), ('api', 'string_external_identifier')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='teammapping',
+            unique_together={('api', 'numeric_external_identifier'), ('api', 'string_external_identifier')},
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0004_unique_external_identifiers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requesttype',
+            name='etag',
+            field=models.CharField(default=None, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name='requesttype',
+            name='last_modified',
+            field=models.CharField(default=None, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='requesttype',
+            name='validated_url',
+            field=models.CharField(default=None, max_length=300, null=True),
+        ),
+    ]
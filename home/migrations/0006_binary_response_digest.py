@@ -0,0 +1,27 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0005_requesttype_validators'),
+    ]
+
+    # The old hex md5 digests can never match the new binary blake2b ones, so they're dropped rather than converted
+    operations = [
+        migrations.RemoveField(
+            model_name='requestaudit',
+            name='hashed_response',
+        ),
+        migrations.AddField(
+            model_name='requestaudit',
+            name='hashed_response',
+            field=models.BinaryField(max_length=16, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='requestaudit',
+            index=models.Index(fields=['request_type', 'hashed_response', 'successful'], name='requestaudit_dedup_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0006_binary_response_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiRateLimitState',
+            fields=[
+                ('api', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='home.Api')),
+                ('tokens', models.FloatField()),
+                ('refilled_at', models.DateTimeField()),
+                ('version', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
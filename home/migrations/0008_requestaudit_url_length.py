@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0007_apiratelimitstate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='requestaudit',
+            name='url',
+            field=models.CharField(max_length=300),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0008_requestaudit_url_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fixture',
+            name='source_fingerprint',
+            field=models.BinaryField(default=None, max_length=8, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0009_fixture_source_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('response_code', models.IntegerField(default=None, null=True)),
+                ('fetch_latency_ms', models.FloatField(default=None, null=True)),
+                ('bytes_received', models.IntegerField(default=None, null=True)),
+                ('decode_ms', models.FloatField(default=None, null=True)),
+                ('db_ms', models.FloatField(default=None, null=True)),
+                ('matches_seen', models.IntegerField(default=0)),
+                ('matches_created', models.IntegerField(default=0)),
+                ('matches_updated', models.IntegerField(default=0)),
+                ('matches_skipped', models.IntegerField(default=0)),
+                ('matches_invalid', models.IntegerField(default=0)),
+                ('successful', models.BooleanField()),
+                ('failure_reason', models.CharField(default=None, max_length=200, null=True)),
+                ('api', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.Api')),
+                ('request_audit', models.OneToOneField(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='home.RequestAudit')),
+                ('request_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.RequestType')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ingestionrun',
+            index=models.Index(fields=['started_at'], name='ingestionrun_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingestionrun',
+            index=models.Index(fields=['request_type', 'started_at'], name='ingestionrun_type_started_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0010_ingestionrun'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='requestaudit',
+            index=models.Index(fields=['request_type', 'successful', 'request_time'], name='requestaudit_latest_idx'),
+        ),
+    ]
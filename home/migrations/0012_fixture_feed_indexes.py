@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0011_requestaudit_latest_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fixture',
+            index=models.Index(fields=['home_team', 'kickoff_time_utc'], name='fixture_home_kickoff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fixture',
+            index=models.Index(fields=['away_team', 'kickoff_time_utc'], name='fixture_away_kickoff_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0012_fixture_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Gameweek',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('competition_external_id', models.IntegerField()),
+                ('number', models.IntegerField()),
+                ('starts_at', models.DateTimeField(default=None, null=True)),
+                ('ends_at', models.DateTimeField(default=None, null=True)),
+                ('is_current', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='gameweek',
+            name='api',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.Api'),
+        ),
+        migrations.AddField(
+            model_name='fixture',
+            name='gameweek',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to='home.Gameweek'),
+        ),
+        migrations.AddIndex(
+            model_name='fixture',
+            index=models.Index(fields=['gameweek', 'home_team'], name='fixture_gameweek_home_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fixture',
+            index=models.Index(fields=['gameweek', 'away_team'], name='fixture_gameweek_away_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gameweek',
+            index=models.Index(fields=['is_current'], name='gameweek_current_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='gameweek',
+            unique_together={('api', 'competition_external_id', 'number')},
+        ),
+    ]
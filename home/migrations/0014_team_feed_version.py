@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0013_gameweek'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='feed_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0014_team_feed_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FixtureChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('home_score', models.IntegerField(default=None, null=True)),
+                ('away_score', models.IntegerField(default=None, null=True)),
+                ('kickoff_time_utc', models.DateTimeField()),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+                ('away_team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='home.Team')),
+                ('fixture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.Fixture')),
+                ('home_team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='home.Team')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='home.FixtureStatus')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='fixturechange',
+            index=models.Index(fields=['home_team', 'id'], name='fixturechange_home_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fixturechange',
+            index=models.Index(fields=['away_team', 'id'], name='fixturechange_away_seq_idx'),
+        ),
+    ]
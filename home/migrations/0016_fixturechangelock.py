@@ -0,0 +1,25 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+
+def create_lock(apps, schema_editor):
+    FixtureChangeLock = apps.get_model('home', 'FixtureChangeLock')
+    FixtureChangeLock.objects.get_or_create(id=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0015_fixturechange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FixtureChangeLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.RunPython(create_lock, migrations.RunPython.noop),
+    ]
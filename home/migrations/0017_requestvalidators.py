@@ -0,0 +1,50 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_validators(apps, schema_editor):
+    RequestType = apps.get_model('home', 'RequestType')
+    RequestValidators = apps.get_model('home', 'RequestValidators')
+    RequestValidators.objects.bulk_create([
+        RequestValidators(request_type_id=request_type.id, url=request_type.validated_url, etag=request_type.etag,
+                          last_modified=request_type.last_modified)
+        for request_type in RequestType.objects.filter(validated_url__isnull=False)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0016_fixturechangelock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestValidators',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=300)),
+                ('etag', models.CharField(default=None, max_length=200, null=True)),
+                ('last_modified', models.CharField(default=None, max_length=100, null=True)),
+                ('request_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='home.RequestType')),
+            ],
+            options={
+                'unique_together': {('request_type', 'url')},
+            },
+        ),
+        migrations.RunPython(copy_validators, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='requesttype',
+            name='etag',
+        ),
+        migrations.RemoveField(
+            model_name='requesttype',
+            name='last_modified',
+        ),
+        migrations.RemoveField(
+            model_name='requesttype',
+            name='validated_url',
+        ),
+    ]
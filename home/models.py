@@ -1,20 +1,35 @@
+import math
 import re
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from django.db import models
-from django.db.models import Max, Count
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, F, Max, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from .enums import ExternalIdentifierType
-from typing import Union
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+from urllib.parse import urlencode
 from . import constants
+from .metrics import RATE_LIMITER_DENIALS
 
 
 class Team(models.Model):
     name = models.CharField(max_length=100)
     is_active = models.BooleanField(default=True)
+    # Bumped whenever one of the team's fixtures changes, so cached feeds built from the old version stop matching
+    feed_version = models.PositiveIntegerField(default=0)
 
     @classmethod
     def get_active_teams(cls):
         return Team.objects.filter(is_active=True)
 
+    @classmethod
+    def bump_feed_versions(cls, team_ids: Union[Iterable[int], models.QuerySet]) -> None:
+        cls.objects.filter(id__in=team_ids).update(feed_version=F('feed_version') + 1)
+
 
 class RequestLimitType(models.Model):
     description = models.CharField(max_length=200)
@@ -27,35 +42,165 @@ class Api(models.Model):
     request_interval_ms = models.IntegerField(null=True)
 
     def is_in_cooldown(self) -> bool:
-        if self.request_limit_type.id == constants.REQUEST_LIMIT_TYPE_STAGGERED:
-            last_request_time_dict = RequestAudit.objects.filter(api=self).aggregate(Max('request_time'))
-            last_request_time = last_request_time_dict['request_time__max']
-            if last_request_time is None:
-                return False
-            elif (datetime.utcnow() - last_request_time.replace(tzinfo=None)) < timedelta(
-                    seconds=self.request_interval_seconds):
-                return True
-            else:
-                return False
-        elif self.request_limit_type.id == constants.REQUEST_LIMIT_TYPE_PER_MINUTE:
-            one_minute_ago = datetime.now() - timedelta(minutes=1)
-            requests_last_minute_dict = RequestAudit.objects.filter(request_time__gte=one_minute_ago).aggregate(
-                Count('id'))
-            requests_last_minute = requests_last_minute_dict['id__count']
-            if requests_last_minute >= self.requests_per_minute:
-                return True
-            else:
-                return False
+        # Reserves a request slot when one is free, so a False return is permission to make the request now
+        if not self.is_rate_limited:
+            return False
+        if ApiRateLimitState.try_acquire(self):
+            return False
+        RATE_LIMITER_DENIALS.inc(api=self.name)
+        return True
+
+    def seconds_until_request_allowed(self) -> float:
+        if not self.is_rate_limited:
+            return 0.0
+        return ApiRateLimitState.seconds_until_available(self)
+
+    @property
+    def is_rate_limited(self) -> bool:
+        return self.request_limit_type_id in (constants.REQUEST_LIMIT_TYPE_STAGGERED,
+                                              constants.REQUEST_LIMIT_TYPE_PER_MINUTE)
 
     @property
     def request_interval_seconds(self) -> float:
         return self.request_interval_ms / 1000
 
+    @property
+    def bucket_capacity(self) -> float:
+        # Staggered APIs are a bucket of one, refilled once per interval; per minute APIs allow a full minute's burst
+        if self.request_limit_type_id == constants.REQUEST_LIMIT_TYPE_PER_MINUTE:
+            return float(self.requests_per_minute)
+        return 1.0
+
+    @property
+    def refill_per_second(self) -> float:
+        if self.request_limit_type_id == constants.REQUEST_LIMIT_TYPE_PER_MINUTE:
+            return self.requests_per_minute / 60
+        return 1 / self.request_interval_seconds
+
+
+class ApiRateLimitState(models.Model):
+    # Token bucket for an Api, shared by every process.  Updates are compare-and-set on 'version', so no row locks
+    # or table scans are needed.
+    api = models.OneToOneField(to=Api, on_delete=models.CASCADE, primary_key=True)
+    tokens = models.FloatField()
+    refilled_at = models.DateTimeField()
+    version = models.IntegerField(default=0)
+
+    MAX_ATTEMPTS = 5
+
+    @classmethod
+    def try_acquire(cls, api: Api) -> bool:
+        for _ in range(cls.MAX_ATTEMPTS):
+            state = cls._get_state(api)
+            now = timezone.now()
+            tokens = state.get_tokens(api, now)
+            if tokens < 1:
+                return False
+            updated = cls.objects.filter(api_id=api.id, version=state.version).update(
+                tokens=tokens - 1, refilled_at=now, version=state.version + 1)
+            if updated == 1:
+                return True
+        # Lost every race to other processes, which means they're using up the tokens anyway
+        return False
+
+    @classmethod
+    def seconds_until_available(cls, api: Api) -> float:
+        tokens = cls._get_state(api).get_tokens(api, timezone.now())
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / api.refill_per_second
+
+    @classmethod
+    def _get_state(cls, api: Api) -> 'ApiRateLimitState':
+        state, _ = cls.objects.get_or_create(api_id=api.id, defaults={'tokens': api.bucket_capacity,
+                                                                      'refilled_at': timezone.now()})
+        return state
+
+    def get_tokens(self, api: Api, now: datetime) -> float:
+        elapsed_seconds = max((now - self.refilled_at).total_seconds(), 0)
+        return min(api.bucket_capacity, self.tokens + elapsed_seconds * api.refill_per_second)
+
 
 class FixtureStatus(models.Model):
     description = models.CharField(max_length=30)
 
 
+class Gameweek(models.Model):
+    # A round of fixtures in one competition, numbered by the API's matchday.  The kickoff bounds and which round is
+    # current are worked out whenever the competition is ingested, so the feed never has to.
+    api = models.ForeignKey(to=Api, on_delete=models.CASCADE)
+    competition_external_id = models.IntegerField()
+    number = models.IntegerField()
+    starts_at = models.DateTimeField(null=True, default=None)
+    ends_at = models.DateTimeField(null=True, default=None)
+    is_current = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = [('api', 'competition_external_id', 'number')]
+        indexes = [
+            models.Index(fields=['is_current'], name='gameweek_current_idx'),
+        ]
+
+    @classmethod
+    def get_ids(cls, api_id: int, competition_external_id: int) -> Dict[int, int]:
+        return dict(cls.objects.filter(api_id=api_id, competition_external_id=competition_external_id)
+                    .values_list('number', 'id'))
+
+    @classmethod
+    def refresh(cls, api_id: int, competition_external_id: int, bounds_changed: bool = True,
+                now: datetime = None) -> Union['Gameweek', None]:
+        # Recomputes the kickoff bounds when fixtures changed, then marks the earliest round that hasn't finished
+        # yet as current, or the last round once the season is over.  The bounds only cover the bulk of a round's
+        # kickoffs, so a match postponed or rescheduled weeks away doesn't keep its round current until then.
+        if now is None:
+            now = timezone.now()
+        gameweeks = list(cls.objects.filter(api_id=api_id, competition_external_id=competition_external_id)
+                         .order_by('number'))
+        if bounds_changed and gameweeks:
+            kickoffs = {}
+            for gameweek_id, kickoff_time_utc in Fixture.objects.filter(gameweek__in=gameweeks) \
+                    .values_list('gameweek_id', 'kickoff_time_utc'):
+                kickoffs.setdefault(gameweek_id, []).append(kickoff_time_utc)
+            moved = []
+            for gameweek in gameweeks:
+                starts_at, ends_at = cls._get_bounds(kickoffs.get(gameweek.id, []))
+                if (starts_at, ends_at) != (gameweek.starts_at, gameweek.ends_at):
+                    gameweek.starts_at, gameweek.ends_at = starts_at, ends_at
+                    moved.append(gameweek)
+            if moved:
+                cls.objects.bulk_update(moved, ['starts_at', 'ends_at'])
+
+        finished_before = now - timedelta(seconds=settings.INGESTION_MATCH_DURATION_SECONDS)
+        scheduled = [gameweek for gameweek in gameweeks if gameweek.ends_at is not None]
+        current = next((gameweek for gameweek in scheduled if gameweek.ends_at > finished_before),
+                       scheduled[-1] if scheduled else None)
+        if current is not None and not current.is_current:
+            with transaction.atomic():
+                # Feeds opening on the old or the new current gameweek change with it
+                rolled_over = cls.objects.filter(Q(id=current.id) | Q(api_id=api_id,
+                                                                      competition_external_id=competition_external_id,
+                                                                      is_current=True))
+                Team.bump_feed_versions(Team.objects.filter(Q(fixture_home_team__gameweek__in=rolled_over) |
+                                                            Q(fixture_away_team__gameweek__in=rolled_over))
+                                        .values('id'))
+                cls.objects.filter(api_id=api_id, competition_external_id=competition_external_id,
+                                   is_current=True).update(is_current=False)
+                cls.objects.filter(id=current.id).update(is_current=True)
+            current.is_current = True
+        return current
+
+    @classmethod
+    def _get_bounds(cls, kickoffs: List[datetime]) -> Tuple[Union[datetime, None], Union[datetime, None]]:
+        # The first and last kickoffs within GAMEWEEK_MAX_DAYS_FROM_MEDIAN_KICKOFF of the median one
+        if not kickoffs:
+            return None, None
+        kickoffs = sorted(kickoffs)
+        median = kickoffs[(len(kickoffs) - 1) // 2]
+        max_distance = timedelta(days=settings.GAMEWEEK_MAX_DAYS_FROM_MEDIAN_KICKOFF)
+        bulk = [kickoff for kickoff in kickoffs if abs(kickoff - median) <= max_distance]
+        return bulk[0], bulk[-1]
+
+
 class Fixture(models.Model):
     home_team = models.ForeignKey(to=Team, on_delete=models.CASCADE, related_name="fixture_home_team")
     away_team = models.ForeignKey(to=Team, on_delete=models.CASCADE, related_name="fixture_away_team")
@@ -63,6 +208,83 @@ class Fixture(models.Model):
     away_score = models.IntegerField(null=True, default=None)
     kickoff_time_utc = models.DateTimeField()
     status = models.ForeignKey(to=FixtureStatus, on_delete=models.CASCADE)
+    # Digest of the upstream record this fixture was last written from, so unchanged matches can be skipped
+    source_fingerprint = models.BinaryField(max_length=8, null=True, default=None)
+    gameweek = models.ForeignKey(to=Gameweek, on_delete=models.SET_NULL, null=True, default=None)
+
+    class Meta:
+        indexes = [
+            # One index range per followed team and side, already in kickoff order, for get_feed
+            models.Index(fields=['home_team', 'kickoff_time_utc'], name='fixture_home_kickoff_idx'),
+            models.Index(fields=['away_team', 'kickoff_time_utc'], name='fixture_away_kickoff_idx'),
+            # Point lookups of one gameweek's fixtures per followed team, for get_current_gameweek_feed
+            models.Index(fields=['gameweek', 'home_team'], name='fixture_gameweek_home_idx'),
+            models.Index(fields=['gameweek', 'away_team'], name='fixture_gameweek_away_idx'),
+        ]
+
+    @classmethod
+    def get_feed(cls, team_ids: Union[Iterable[int], models.QuerySet]) -> models.QuerySet:
+        # Every fixture involving any of the teams, latest kickoff first, with everything the feed shows joined in.
+        # team_ids may itself be a queryset of ids, which runs as a subquery of the same single query.
+        return cls.objects.filter(Q(home_team_id__in=team_ids) | Q(away_team_id__in=team_ids)) \
+            .select_related('home_team', 'away_team', 'status').order_by('-kickoff_time_utc', '-id')
+
+    @classmethod
+    def get_current_gameweek_feed(cls, team_ids: Union[Iterable[int], models.QuerySet]) -> models.QuerySet:
+        # The teams' fixtures in every competition's current gameweek, in kickoff order
+        return cls.get_feed(team_ids).filter(gameweek__is_current=True).order_by('kickoff_time_utc', 'id')
+
+
+class FixtureChangeLock(models.Model):
+    # A single row every writer to the change log locks first, so appends commit one at a time in sequence order.
+    # Otherwise a later append could commit first and a client syncing past its id would never see the earlier one.
+
+    @classmethod
+    def acquire(cls) -> None:
+        # Held until the surrounding transaction ends.  The row is created by the migration that adds the table.
+        cls.objects.select_for_update().get_or_create(id=1)
+
+
+class FixtureChange(models.Model):
+    # Append-only log of fixtures ingestion created or changed the status, score or kickoff of, each row holding the
+    # fixture's new state.  The id is the sequence number clients sync from.
+    fixture = models.ForeignKey(to=Fixture, on_delete=models.CASCADE)
+    home_team = models.ForeignKey(to=Team, on_delete=models.CASCADE, related_name='+')
+    away_team = models.ForeignKey(to=Team, on_delete=models.CASCADE, related_name='+')
+    home_score = models.IntegerField(null=True, default=None)
+    away_score = models.IntegerField(null=True, default=None)
+    kickoff_time_utc = models.DateTimeField()
+    status = models.ForeignKey(to=FixtureStatus, on_delete=models.CASCADE, related_name='+')
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # One index range per followed team and side, starting after the client's sequence number
+            models.Index(fields=['home_team', 'id'], name='fixturechange_home_seq_idx'),
+            models.Index(fields=['away_team', 'id'], name='fixturechange_away_seq_idx'),
+        ]
+
+    @classmethod
+    def for_fixture(cls, fixture: Fixture) -> 'FixtureChange':
+        return cls(fixture_id=fixture.id, home_team_id=fixture.home_team_id, away_team_id=fixture.away_team_id,
+                   home_score=fixture.home_score, away_score=fixture.away_score,
+                   kickoff_time_utc=fixture.kickoff_time_utc, status_id=fixture.status_id)
+
+    @classmethod
+    def append(cls, fixtures: Iterable[Fixture]) -> None:
+        with transaction.atomic(savepoint=False):
+            FixtureChangeLock.acquire()
+            cls.objects.bulk_create([cls.for_fixture(fixture) for fixture in fixtures])
+
+    @classmethod
+    def get_since(cls, team_ids: Union[Iterable[int], models.QuerySet], sequence: int) -> models.QuerySet:
+        # Changes to fixtures involving any of the teams after the sequence number, oldest first
+        return cls.objects.filter(Q(home_team_id__in=team_ids) | Q(away_team_id__in=team_ids), id__gt=sequence) \
+            .select_related('home_team', 'away_team', 'status').order_by('id')
+
+    @classmethod
+    def get_latest_sequence(cls) -> int:
+        return cls.objects.aggregate(sequence=Max('id'))['sequence'] or 0
 
 
 class RequestType(models.Model):
@@ -71,24 +293,135 @@ class RequestType(models.Model):
     description = models.CharField(max_length=200)
     current_version_iter = models.IntegerField()
 
-    def get_url(self, *args) -> Union[str, None]:
+    def get_url(self, *args, **query_params) -> Union[str, None]:
         url = self.base_url
         if url is None:
             return None
         for arg in args:
             url = re.sub('[\[].*?[\]]', arg, url, 1)
+
+        # Sorted so the same parameters always produce the same url, which keeps validators and audits comparable
+        query = urlencode(sorted((key, value) for key, value in query_params.items() if value is not None))
+        if query:
+            url += ('&' if '?' in url else '?') + query
         return url
 
+    def get_validators(self, url: str) -> Union['RequestValidators', None]:
+        return RequestValidators.objects.filter(request_type=self, url=url).first()
+
+    def store_validators(self, url: str, etag: Union[str, None], last_modified: Union[str, None]) -> None:
+        RequestValidators.objects.update_or_create(request_type=self, url=url,
+                                                   defaults={'etag': etag, 'last_modified': last_modified})
+
+
+class RequestValidators(models.Model):
+    # Conditional request validators from the last fully handled response for one url.  Kept per url rather than per
+    # request type, since e.g. every competition's matches are fetched through the same request type
+    request_type = models.ForeignKey(to=RequestType, on_delete=models.CASCADE)
+    url = models.CharField(max_length=300)
+    etag = models.CharField(max_length=200, null=True, default=None)
+    last_modified = models.CharField(max_length=100, null=True, default=None)
+
+    class Meta:
+        unique_together = [('request_type', 'url')]
+
+
+class RefreshLease(models.Model):
+    # One row per RequestType, held by whichever process is currently refreshing it
+    request_type = models.OneToOneField(to=RequestType, on_delete=models.CASCADE, primary_key=True)
+    owner = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+
+    @classmethod
+    def acquire(cls, request_type_id: int, owner: str, duration: timedelta) -> bool:
+        now = timezone.now()
+        cls.objects.get_or_create(request_type_id=request_type_id, defaults={'owner': '', 'expires_at': now})
+        # Compare-and-set, so only one of any number of concurrent callers can take an expired lease
+        acquired = cls.objects.filter(Q(expires_at__lte=now) | Q(owner=owner),
+                                      request_type_id=request_type_id).update(owner=owner, expires_at=now + duration)
+        return acquired == 1
+
+    @classmethod
+    def release(cls, request_type_id: int, owner: str) -> None:
+        cls.objects.filter(request_type_id=request_type_id, owner=owner).update(expires_at=timezone.now())
+
+    @classmethod
+    def is_held(cls, request_type_id: int) -> bool:
+        return cls.objects.filter(request_type_id=request_type_id, expires_at__gt=timezone.now()).exists()
+
 
 class RequestAudit(models.Model):
     api = models.ForeignKey(to=Api, on_delete=models.CASCADE)
-    url = models.CharField(max_length=100)
+    url = models.CharField(max_length=300)
     request_type = models.ForeignKey(to=RequestType, on_delete=models.CASCADE)
     request_time = models.DateTimeField()
-    hashed_response = models.CharField(max_length=100, null=True)
+    hashed_response = models.BinaryField(max_length=16, null=True)
     response_code = models.IntegerField()
     successful = models.BooleanField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['request_type', 'hashed_response', 'successful'], name='requestaudit_dedup_idx'),
+            # Latest successful request per request type, for the feed's data age and the ingestion lag metric
+            models.Index(fields=['request_type', 'successful', 'request_time'], name='requestaudit_latest_idx'),
+        ]
+
+
+class IngestionRun(models.Model):
+    # Telemetry for one request sent by an ApiGetClient, successful or not
+    api = models.ForeignKey(to=Api, on_delete=models.CASCADE)
+    request_type = models.ForeignKey(to=RequestType, on_delete=models.CASCADE)
+    request_audit = models.OneToOneField(to=RequestAudit, on_delete=models.SET_NULL, null=True, default=None)
+    started_at = models.DateTimeField()
+    response_code = models.IntegerField(null=True, default=None)
+    # Time to the response headers when streaming, since the body is only read while it's handled
+    fetch_latency_ms = models.FloatField(null=True, default=None)
+    bytes_received = models.IntegerField(null=True, default=None)
+    # Not measured for streamed responses, where decoding is interleaved with ingestion
+    decode_ms = models.FloatField(null=True, default=None)
+    db_ms = models.FloatField(null=True, default=None)
+    matches_seen = models.IntegerField(default=0)
+    matches_created = models.IntegerField(default=0)
+    matches_updated = models.IntegerField(default=0)
+    matches_skipped = models.IntegerField(default=0)
+    matches_invalid = models.IntegerField(default=0)
+    successful = models.BooleanField()
+    failure_reason = models.CharField(max_length=200, null=True, default=None)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['started_at'], name='ingestionrun_started_idx'),
+            models.Index(fields=['request_type', 'started_at'], name='ingestionrun_type_started_idx'),
+        ]
+
+    @classmethod
+    def get_recent(cls, window: timedelta = None, **filters) -> models.QuerySet:
+        if window is None:
+            window = timedelta(hours=1)
+        return cls.objects.filter(started_at__gte=timezone.now() - window, **filters)
+
+    @classmethod
+    def get_percentiles(cls, field_name: str, percentiles: Iterable[float] = (50, 95), window: timedelta = None,
+                        **filters) -> Dict[float, Union[float, None]]:
+        # e.g. get_percentiles('fetch_latency_ms', window=timedelta(hours=1), api_id=1) for p50 and p95.  At most a
+        # few hundred runs an hour, so the values are sorted here rather than with database specific SQL.
+        values = list(cls.get_recent(window, **filters).filter(**{field_name + '__isnull': False})
+                      .order_by(field_name).values_list(field_name, flat=True))
+        return {percentile: cls._get_nearest_rank(values, percentile) for percentile in percentiles}
+
+    @classmethod
+    def get_failure_counts(cls, window: timedelta = None, **filters) -> Dict[str, int]:
+        failures = cls.get_recent(window, successful=False, **filters).values('failure_reason') \
+            .annotate(count=Count('pk'))
+        return {failure['failure_reason']: failure['count'] for failure in failures}
+
+    @classmethod
+    def _get_nearest_rank(cls, sorted_values: List[float], percentile: float) -> Union[float, None]:
+        if not sorted_values:
+            return None
+        rank = math.ceil(percentile / 100 * len(sorted_values))
+        return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
 
 class MappingModel(models.Model):
     value = None
@@ -99,32 +432,36 @@ class MappingModel(models.Model):
 
     class Meta:
         abstract = True
+        unique_together = [('api', 'numeric_external_identifier'), ('api', 'string_external_identifier')]
 
     @classmethod
     def get_model_from_external_id(cls, external_identifier_type: ExternalIdentifierType,
                                    external_identifier: Union[int, str],
                                    api_id: int) -> Union[models.ForeignKey, None]:
-        try:
-            api = Api.objects.get(id=api_id)
-        except Api.DoesNotExist:
+        value_id = cls.get_value_id_from_external_id(external_identifier_type, external_identifier, api_id)
+        if value_id is None:
             return None
+
+        return cls._meta.get_field('value').related_model.objects.filter(id=value_id).first()
+
+    @classmethod
+    def get_value_id_from_external_id(cls, external_identifier_type: ExternalIdentifierType,
+                                      external_identifier: Union[int, str],
+                                      api_id: int) -> Union[int, None]:
+        if external_identifier_type == ExternalIdentifierType.NUMERIC:
+            identifier_field = 'numeric_external_identifier'
+        elif external_identifier_type == ExternalIdentifierType.STRING:
+            identifier_field = 'string_external_identifier'
+        else:
+            raise ValueError("Invalid ExternalIdentifierType enum")
+
         try:
-            if external_identifier_type == ExternalIdentifierType.NUMERIC:
-                mapping = cls.objects.get(api=api,
-                                          numeric_external_identifier=external_identifier)
-            elif external_identifier_type == ExternalIdentifierType.STRING:
-                mapping = cls.objects.get(api=api,
-                                          string_external_identifier=external_identifier)
-            else:
-                raise ValueError("Invalid ExternalIdentifierType enum")
+            return cls.objects.values_list('value_id', flat=True).get(api_id=api_id,
+                                                                      **{identifier_field: external_identifier})
         except cls.DoesNotExist:
             return None
         except cls.MultipleObjectsReturned as e:
             raise e
-        if not mapping:
-            return None
-
-        return mapping.value
 
 
 class FixtureStatusMapping(MappingModel):
@@ -137,3 +474,25 @@ class TeamMapping(MappingModel):
 
 class FixtureMapping(MappingModel):
     value = models.ForeignKey(Fixture, on_delete=models.deletion.CASCADE)
+
+
+_feed_invalidation = threading.local()
+
+
+@contextmanager
+def feed_versions_bumped_in_bulk() -> Iterator[None]:
+    # For writers that bump every team they touch in one go, like FixtureIngestor, so saving fixtures one at a time
+    # doesn't add an update per fixture as well
+    _feed_invalidation.suppressed = getattr(_feed_invalidation, 'suppressed', 0) + 1
+    try:
+        yield
+    finally:
+        _feed_invalidation.suppressed -= 1
+
+
+@receiver([post_save, post_delete], sender=Fixture)
+def invalidate_cached_feeds(sender, instance, **kwargs):
+    # Covers fixtures edited one at a time, outside of any bulk writer
+    if getattr(_feed_invalidation, 'suppressed', 0):
+        return
+    Team.bump_feed_versions([instance.home_team_id, instance.away_team_id])
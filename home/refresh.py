@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Union
+from django.conf import settings
+from django.db.models import Max
+from .constants import FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE
+from .models import RequestAudit
+from .worker import get_ingestion_client_factories, refresh_clients
+
+REFRESH_MODE_WORKER = 'worker'
+REFRESH_MODE_STALE_WHILE_REVALIDATE = 'stale_while_revalidate'
+
+_executor = None
+_executor_lock = threading.Lock()
+_refresh_pending = False
+
+
+def get_last_refresh_time(request_type_id: int = FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE) -> Union[datetime, None]:
+    last_refresh_dict = RequestAudit.objects.filter(request_type_id=request_type_id,
+                                                    successful=True).aggregate(Max('request_time'))
+    return last_refresh_dict['request_time__max']
+
+
+def get_data_age_seconds(request_type_id: int = FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE) -> Union[float, None]:
+    last_refresh_time = get_last_refresh_time(request_type_id)
+    if last_refresh_time is None:
+        return None
+    return (datetime.now(timezone.utc) - last_refresh_time.replace(tzinfo=timezone.utc)).total_seconds()
+
+
+def is_stale(data_age_seconds: Union[float, None]) -> bool:
+    return data_age_seconds is None or data_age_seconds > settings.HOME_FEED_FRESHNESS_SECONDS
+
+
+def revalidate_if_stale(data_age_seconds: Union[float, None]) -> bool:
+    # Returns immediately; the refresh itself runs on the background pool so the caller never waits on the API
+    if settings.HOME_FEED_REFRESH_MODE != REFRESH_MODE_STALE_WHILE_REVALIDATE:
+        return False
+    if not is_stale(data_age_seconds):
+        return False
+
+    return _schedule_refresh()
+
+
+def _schedule_refresh() -> bool:
+    global _refresh_pending
+    with _executor_lock:
+        # One queued refresh is plenty, further stale page loads just serve what is stored
+        if _refresh_pending:
+            return False
+        _refresh_pending = True
+    try:
+        _get_executor().submit(_run_refresh)
+    except Exception:
+        with _executor_lock:
+            _refresh_pending = False
+        raise
+    return True
+
+
+def _run_refresh() -> bool:
+    global _refresh_pending
+    try:
+        return refresh_clients(get_ingestion_client_factories())
+    finally:
+        with _executor_lock:
+            _refresh_pending = False
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.HOME_FEED_REFRESH_THREADS,
+                                           thread_name_prefix='feed-refresh')
+        return _executor
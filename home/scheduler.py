@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+from typing import Iterable, Union
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .enums import FixtureStatusIds
+from .models import Api, Fixture
+
+LIVE_STATUS_IDS = [FixtureStatusIds.IN_PLAY.value, FixtureStatusIds.PAUSED.value]
+
+
+class PollScheduler:
+    # Picks the delay until the next poll from the stored fixtures: fast while anything is live, slower in the run
+    # up to a kickoff and close to idle between matchdays.  Never sooner than the polled APIs' limits allow.
+
+    def __init__(self, live_seconds: float = None, pre_kickoff_seconds: float = None,
+                 pre_kickoff_window_seconds: float = None, idle_seconds: float = None,
+                 match_duration_seconds: float = None):
+        self.live_seconds = self._get_setting(live_seconds, 'INGESTION_LIVE_POLL_SECONDS')
+        self.pre_kickoff_seconds = self._get_setting(pre_kickoff_seconds, 'INGESTION_PRE_KICKOFF_POLL_SECONDS')
+        self.pre_kickoff_window_seconds = self._get_setting(pre_kickoff_window_seconds,
+                                                            'INGESTION_PRE_KICKOFF_WINDOW_SECONDS')
+        self.idle_seconds = self._get_setting(idle_seconds, 'INGESTION_IDLE_POLL_SECONDS')
+        self.match_duration_seconds = self._get_setting(match_duration_seconds,
+                                                        'INGESTION_MATCH_DURATION_SECONDS')
+
+    def next_poll_delay(self, apis: Iterable[Api] = None, now: datetime = None) -> float:
+        if now is None:
+            now = timezone.now()
+        if apis is None:
+            apis = Api.objects.filter(requesttype__isnull=False).distinct()
+
+        delay = self.get_fixture_delay(now)
+        for api in apis:
+            delay = max(delay, self.get_min_api_delay(api))
+        return delay
+
+    def get_fixture_delay(self, now: datetime) -> float:
+        if self.is_any_fixture_live(now):
+            return self.live_seconds
+
+        next_kickoff = self.get_next_kickoff(now)
+        if next_kickoff is None:
+            return self.idle_seconds
+
+        seconds_until_window = (next_kickoff - now).total_seconds() - self.pre_kickoff_window_seconds
+        if seconds_until_window <= 0:
+            return self.pre_kickoff_seconds
+        # Sleep until the pre kickoff window opens, but still check in occasionally for rescheduled fixtures
+        return max(min(seconds_until_window, self.idle_seconds), self.pre_kickoff_seconds)
+
+    def is_any_fixture_live(self, now: datetime) -> bool:
+        # Fixtures past kickoff that upstream hasn't flipped to in-play yet are treated as live too
+        recent_kickoffs = Q(status_id=FixtureStatusIds.SCHEDULED.value,
+                            kickoff_time_utc__range=(now - timedelta(seconds=self.match_duration_seconds), now))
+        return Fixture.objects.filter(Q(status_id__in=LIVE_STATUS_IDS) | recent_kickoffs).exists()
+
+    def get_next_kickoff(self, now: datetime) -> Union[datetime, None]:
+        return Fixture.objects.filter(status_id=FixtureStatusIds.SCHEDULED.value, kickoff_time_utc__gt=now) \
+            .order_by('kickoff_time_utc').values_list('kickoff_time_utc', flat=True).first()
+
+    def get_min_api_delay(self, api: Api) -> float:
+        if not api.is_rate_limited:
+            return 0.0
+        return max(1 / api.refill_per_second, api.seconds_until_request_allowed())
+
+    def _get_setting(self, value: Union[float, None], setting_name: str) -> float:
+        if value is None:
+            return getattr(settings, setting_name)
+        return value
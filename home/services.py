@@ -1,21 +1,49 @@
-from hashlib import md5
+import logging
+import time
+from hashlib import blake2b
 from abc import ABC, abstractmethod
-from datetime import datetime
-from typing import Dict
-from requests import get, Response
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, Union
+from requests import RequestException
+from django.conf import settings
+from django.db import connection
 from django.db.models import Q
-from .enums import FixtureStatusIds
-from .models import (
-    RequestType, RequestAudit, FixtureMapping,
-    ExternalIdentifierType, Fixture, TeamMapping, 
-    FixtureStatus,FixtureStatusMapping
-                    )
-from .constants import FDDO_PREMIER_LEAGUE_ID, FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE
+from django.utils import timezone as django_timezone
+from sportsfeed import profiling
+from .decoders import Field, RecordDecoder, format_errors
+from .http import get
+from .ingestion import ExternalFixture, FixtureIngestor
+from .streaming import HashingChunks, JsonArrayStream
+from .telemetry import QueryCounter
+from .metrics import OUTBOUND_REQUEST_SECONDS
+from .models import IngestionRun, RequestType, RequestAudit
+from .constants import (
+    FDDO_PREMIER_LEAGUE_ID, FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE, FDDO_FETCH_MODES, FDDO_FETCH_MODE_WINDOW,
+    FDDO_FETCH_MODE_LIVE, FDDO_LIVE_STATUS_FILTER
+)
 try:
     from sportsfeed.local_settings import FOOTBALL_DATA_DOT_ORG_API_KEY
-except ImportError as e:
-    # No local_settings, can't access external API
-    raise e
+except ImportError:
+    # No local_settings, so only keyless stand ins like home.fakeserver can be used
+    FOOTBALL_DATA_DOT_ORG_API_KEY = None
+
+
+logger = logging.getLogger(__name__)
+
+HTTP_NOT_MODIFIED = 304
+RESPONSE_DIGEST_SIZE = 16
+FIXTURE_FINGERPRINT_SIZE = 8
+
+FDDO_MATCH_DECODER = RecordDecoder(ExternalFixture, [
+    Field('external_id', ('id',), int),
+    Field('home_team_external_id', ('homeTeam', 'id'), int),
+    Field('away_team_external_id', ('awayTeam', 'id'), int),
+    Field('status_external_id', ('status',), str),
+    Field('kickoff_time_utc', ('utcDate',), datetime),
+    Field('home_score', ('score', 'fullTime', 'homeTeam'), int, required=False),
+    Field('away_score', ('score', 'fullTime', 'awayTeam'), int, required=False),
+    Field('matchday', ('matchday',), int, required=False),
+])
 
 
 class UrlGenerationError(Exception):
@@ -23,77 +51,243 @@ class UrlGenerationError(Exception):
 
 
 class ApiGetClient(ABC):
+    # Clients that implement _handle_streamed_content opt in to streamed responses, everything else is buffered
+    supports_streaming = False
 
-    def __init__(self, request_type: RequestType, url: str = None):
+    def __init__(self, request_type: RequestType, url: str = None, stream: bool = None):
         self.request_type = request_type
         self.url = url
+        if stream is None:
+            stream = settings.API_CLIENT_STREAM_RESPONSES
+        self.stream = stream and self.supports_streaming
         self.response = None
         self.hashed_response = None
         self.request_time = None
+        self.request_headers = None
+        self.validators = None
+        self.ingestor = None
+        # Telemetry for the IngestionRun recorded once the response has been handled
+        self.started_at = None
+        self.fetch_seconds = None
+        self.bytes_received = None
+        self.decode_seconds = None
+        self.request_audit_id = None
+        self.failure_reason = None
 
     def request(self) -> bool:
-        if self.request_type.api.is_in_cooldown():
+        if not self.prepare_request():
             return True
+        self.send_request()
+        return self.handle_response()
+
+    # request() in three steps, so callers can run the network round trip elsewhere, e.g. on an executor thread
+    def prepare_request(self) -> bool:
+        # Returns False when the API is in cooldown and no request should be sent
+        if self.request_type.api.is_in_cooldown():
+            return False
         self.request_time = datetime.utcnow()
+        self.started_at = django_timezone.now()
         headers = self._get_headers()
         if self.url is None:
-            url = self.request_type.get_url(str(FDDO_PREMIER_LEAGUE_ID))
+            url = self._get_url()
             if url in("", None):
                 # TODO: Logging
                 print("Failed to generate URL")
                 raise UrlGenerationError()
             else:
                 self.url = url
-        self.response = get(url, headers=headers)
-        if self.response is None:
+        headers.update(self._get_conditional_headers())
+        self.request_headers = headers
+        return True
+
+    def send_request(self) -> bool:
+        # No database access, so it's safe to call from any thread
+        started = time.perf_counter()
+        try:
+            self.response = get(self.url, headers=self.request_headers, stream=self.stream)
+        except RequestException as e:
+            logger.exception("Request to %s failed", self.url)
+            self.failure_reason = "Request failed: %s" % type(e).__name__
             return False
-        return self._handle_response()
+        finally:
+            self.fetch_seconds = time.perf_counter() - started
+            profiling.record_outbound(self.fetch_seconds)
+        return self.response is not None
+
+    def _get_url(self) -> Union[str, None]:
+        return self.request_type.get_url()
+
+    def handle_response(self) -> bool:
+        # Handles whatever send_request got back, even nothing, and records how it went as an IngestionRun
+        query_counter = QueryCounter()
+        successful = False
+        try:
+            with connection.execute_wrapper(query_counter):
+                successful = self._handle_response()
+        except Exception as e:
+            self.failure_reason = "Unhandled %s" % type(e).__name__
+            raise
+        finally:
+            if not successful and self.failure_reason is None:
+                self.failure_reason = "Unknown"
+            if self.fetch_seconds is not None:
+                OUTBOUND_REQUEST_SECONDS.observe(self.fetch_seconds, api=self.request_type.api.name)
+            self._record_run(successful, query_counter.seconds)
+        return successful
 
     def _handle_response(self) -> bool:
-        if not self.response.ok or len(self.response.content) == 0:
+        if self.response is None:
+            if self.failure_reason is None:
+                self.failure_reason = "No response"
+            return False
+        if self.response.status_code == HTTP_NOT_MODIFIED:
+            # Our stored copy is still current, so there's nothing to hash, decode or ingest
+            self._audit_request(successful=True)
+            return True
+        if self.stream:
+            return self._handle_streamed_response()
+        if not self.response.ok:
+            self.failure_reason = "HTTP %s" % self.response.status_code
+            return False
+        self.bytes_received = len(self.response.content)
+        if self.bytes_received == 0:
+            self.failure_reason = "Empty response"
             return False
-        self.hashed_response = md5(str(self.response.content).encode('utf-8')).hexdigest()
+        self.hashed_response = self._hash_content(self.response.content)
         request_audit_id = self._audit_request()
 
         if self._identical_request_found(request_audit_id):
+            # Nothing changed upstream, but the stored data has still been confirmed as current
+            self._set_req_audit_successful(request_audit_id)
+            self._store_validators()
             return True
 
+        decode_started = time.perf_counter()
         json = self.response.json()
+        self.decode_seconds = time.perf_counter() - decode_started
 
         if not self._validate(json):
+            self.failure_reason = "Unexpected payload"
             return False
 
         if not self._handle_response_content(json):
+            self.failure_reason = "Invalid records"
             return False
 
         self._set_req_audit_successful(request_audit_id)
+        self._store_validators()
         return True
 
-    def _identical_request_found(self, request_audit_id: int) -> bool:
-        identical_requests = RequestAudit.objects.filter(Q(request_type_id=self.request_type.id),
-                                                         Q(hashed_response=self.hashed_response),
-                                                         ~Q(id=request_audit_id),
-                                                         Q(successful=True))
-        if len(identical_requests) > 0:
+    def _handle_streamed_response(self) -> bool:
+        # The body is hashed and parsed as it arrives, so memory use follows the size of a record rather than the
+        # payload.  The hash is only known once everything has been handled, so an identical response can't be
+        # skipped up front; it's still recorded for later and unchanged records are cheap to skip anyway.
+        try:
+            if not self.response.ok:
+                self.failure_reason = "HTTP %s" % self.response.status_code
+                return False
+            request_audit_id = self._audit_request()
+            hasher = blake2b(digest_size=RESPONSE_DIGEST_SIZE)
+            hashing_chunks = HashingChunks(
+                self.response.iter_content(chunk_size=settings.API_CLIENT_STREAM_CHUNK_SIZE), hasher)
+            chunks = iter(hashing_chunks)
+            try:
+                handled = self._handle_streamed_content(chunks)
+            except ValueError:
+                logger.exception("Couldn't parse the response from %s", self.url)
+                self.failure_reason = "Unparseable response"
+                return False
+            finally:
+                self.bytes_received = hashing_chunks.size
+            if not handled:
+                self.failure_reason = "Unexpected payload or invalid records"
+                return False
+
+            for _ in chunks:
+                # Drain anything after the parsed document so the hash covers the whole body
+                pass
+            self.bytes_received = hashing_chunks.size
+            self.hashed_response = hasher.digest()
+            RequestAudit.objects.filter(id=request_audit_id).update(hashed_response=self.hashed_response,
+                                                                    successful=True)
+            self._store_validators()
             return True
-        else:
-            return False
+        finally:
+            self.response.close()
 
-    def _audit_request(self) -> None:
+    def _record_run(self, successful: bool, db_seconds: float) -> None:
+        # Telemetry must never break ingestion itself
+        try:
+            ingestor = self.ingestor
+            IngestionRun.objects.create(
+                api_id=self.request_type.api.id, request_type_id=self.request_type.id,
+                request_audit_id=self.request_audit_id, started_at=self.started_at or django_timezone.now(),
+                response_code=getattr(self.response, 'status_code', None),
+                fetch_latency_ms=self._to_ms(self.fetch_seconds), bytes_received=self.bytes_received,
+                decode_ms=self._to_ms(self.decode_seconds), db_ms=self._to_ms(db_seconds),
+                matches_seen=ingestor.seen if ingestor else 0, matches_created=ingestor.created if ingestor else 0,
+                matches_updated=ingestor.updated if ingestor else 0,
+                matches_skipped=ingestor.unchanged if ingestor else 0,
+                matches_invalid=ingestor.invalid if ingestor else 0,
+                successful=successful, failure_reason=None if successful else self.failure_reason[:200])
+        except Exception:
+            logger.exception("Failed to record the ingestion run for %s", self.url)
+
+    def _to_ms(self, seconds: Union[float, None]) -> Union[float, None]:
+        if seconds is None:
+            return None
+        return seconds * 1000
+
+    def _get_conditional_headers(self) -> Dict:
+        conditional_headers = {}
+        # Validators are only meaningful for the exact resource they were issued for, so they're stored per url
+        self.validators = self.request_type.get_validators(self.url)
+        if self.validators is None:
+            return conditional_headers
+        if self.validators.etag:
+            conditional_headers['If-None-Match'] = self.validators.etag
+        if self.validators.last_modified:
+            conditional_headers['If-Modified-Since'] = self.validators.last_modified
+        return conditional_headers
+
+    def _store_validators(self) -> None:
+        # Only called once a response has been fully handled, so a failed ingestion is retried with a full fetch
+        etag = self.response.headers.get('ETag')
+        last_modified = self.response.headers.get('Last-Modified')
+        if self.validators is None:
+            if etag is None and last_modified is None:
+                return
+        elif (etag, last_modified) == (self.validators.etag, self.validators.last_modified):
+            return
+
+        self.request_type.store_validators(self.url, etag, last_modified)
+
+    def _hash_content(self, content: bytes) -> bytes:
+        return blake2b(content, digest_size=RESPONSE_DIGEST_SIZE).digest()
+
+    def _identical_request_found(self, request_audit_id: int) -> bool:
+        # Backed by the (request_type, hashed_response, successful) index, so this stays a single index probe
+        return RequestAudit.objects.filter(Q(request_type_id=self.request_type.id),
+                                           Q(hashed_response=self.hashed_response),
+                                           ~Q(id=request_audit_id),
+                                           Q(successful=True)).exists()
+
+    def _audit_request(self, successful: bool = False) -> None:
         if self.response is None or self.response.status_code is None:
             return
 
         request_audit = None
 
-        # only setting 'successful' to False for now, until we're finished processing fixtures
+        # 'successful' is normally False for now, until we're finished processing fixtures
         request_audit = RequestAudit(api_id=self.request_type.api.id,
                                      url=self.url,
                                      request_type_id=self.request_type.id,
                                      request_time=self.request_time, hashed_response=self.hashed_response,
                                      response_code=self.response.status_code,
-                                     successful=False)
+                                     successful=successful)
 
         request_audit.save()
+        self.request_audit_id = request_audit.id
         return request_audit.id
 
     def _set_req_audit_successful(self, request_audit_id: int) -> None:
@@ -124,8 +318,18 @@ class ApiGetClient(ABC):
 
 
 class FDDOApiClient(ApiGetClient):
+    supports_streaming = True
+
+    def __init__(self, fetch_mode: str = None, stream: bool = None, competition_id: int = None):
+        if competition_id is None:
+            competition_id = FDDO_PREMIER_LEAGUE_ID
+        self.competition_id = competition_id
+        if fetch_mode is None:
+            fetch_mode = settings.FDDO_FETCH_MODE
+        if fetch_mode not in FDDO_FETCH_MODES:
+            raise ValueError("Invalid FDDO fetch mode: %s" % fetch_mode)
+        self.fetch_mode = fetch_mode
 
-    def __init__(self):
         request_type = None
         try:
             request_type = RequestType.objects.get(id=FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE)
@@ -133,124 +337,97 @@ class FDDOApiClient(ApiGetClient):
             # TODO: logging
             raise e
 
-        super().__init__(request_type)
+        super().__init__(request_type, stream=stream)
 
-    def _handle_response_content(self, response_content: Dict) -> bool:
-        success = True
+    def _get_url(self) -> Union[str, None]:
+        return self.request_type.get_url(str(self.competition_id), **self._get_query_params())
 
-        for match in response_content['matches']:
-            success = success and self._handle_match(match)
+    def _get_query_params(self) -> Dict:
+        if self.fetch_mode == FDDO_FETCH_MODE_WINDOW:
+            today = django_timezone.now().date()
+            return {'dateFrom': (today - timedelta(days=settings.FDDO_WINDOW_PAST_DAYS)).isoformat(),
+                    'dateTo': (today + timedelta(days=settings.FDDO_WINDOW_FUTURE_DAYS)).isoformat()}
+        if self.fetch_mode == FDDO_FETCH_MODE_LIVE:
+            return {'status': FDDO_LIVE_STATUS_FILTER}
+        return {}
 
-        return success
+    def _handle_response_content(self, response_content: Dict) -> bool:
+        return self._ingest_matches(response_content['matches'])
 
-    def _handle_match(self, match_json: Dict) -> bool:
-        # TODO: log validation errors
-        if 'id' not in match_json:
+    def _handle_streamed_content(self, chunks: Iterator[bytes]) -> bool:
+        content = JsonArrayStream(chunks, 'matches')
+        # football-data.org sends the competition ahead of the matches, so it can be checked before ingesting any
+        if not content.read_until_array() or not self._validate_competition(content.members):
             return False
+        return self._ingest_matches(content.iter_items())
 
-        existing_fixture = FixtureMapping.get_model_from_external_id(ExternalIdentifierType.NUMERIC, match_json['id'],
-                                                                     self.request_type.api.id)
+    def _ingest_matches(self, matches: Iterable[Dict]) -> bool:
+        ingestor = FixtureIngestor(self.request_type.api.id, self.competition_id)
+        ingestor.load()
+        self.ingestor = ingestor
 
-        if existing_fixture is not None and not self._fixture_status_is_final(existing_fixture.status_id):
-            return True
-        return self._create_fixture(match_json, existing_fixture)
+        success = True
+        seen = 0
+        for match in matches:
+            seen += 1
+            fingerprint = self._fingerprint_match(match)
+            if 'id' in match and ingestor.is_unchanged(match['id'], fingerprint):
+                continue
+            external_fixture = self._parse_match(match)
+            if external_fixture is None:
+                ingestor.invalid += 1
+                success = False
+                continue
+            success = ingestor.add(external_fixture, fingerprint) and success
+            if ingestor.pending >= settings.INGESTION_BATCH_SIZE:
+                ingestor.flush()
+
+        ingestor.flush()
+        ingestor.refresh_gameweeks()
+        logger.info("Ingested %s matches from %s: %s changed (%s created, %s updated), %s unchanged, %s invalid",
+                    seen, self.url, ingestor.changed, ingestor.created, ingestor.updated,
+                    ingestor.unchanged, ingestor.invalid)
+        return success
 
-    def _fixture_status_is_final(self, status_id: int) -> bool:
-        if status_id in (FixtureStatusIds.FINISHED, FixtureStatusIds.AWARDED,
-                         FixtureStatusIds.CANCELED):
-            return True
-        else:
-            return False
+    def _fingerprint_match(self, match_json: Dict) -> bytes:
+        # Covers everything we store for a fixture, taken straight from the raw record so it's cheap to compute
+        score = match_json.get('score') or {}
+        full_time = score.get('fullTime') or {}
+        home_team = match_json.get('homeTeam') or {}
+        away_team = match_json.get('awayTeam') or {}
+        fingerprint_source = repr((match_json.get('status'), match_json.get('utcDate'), home_team.get('id'),
+                                   away_team.get('id'), full_time.get('homeTeam'), full_time.get('awayTeam'),
+                                   match_json.get('matchday')))
+        return blake2b(fingerprint_source.encode('utf-8'), digest_size=FIXTURE_FINGERPRINT_SIZE).digest()
+
+    def _parse_match(self, match_json: Dict) -> Union[ExternalFixture, None]:
+        external_fixture, errors = FDDO_MATCH_DECODER.decode(match_json)
+        if errors:
+            logger.warning("Skipping invalid match %s from %s: %s", match_json.get('id'), self.url,
+                           format_errors(errors))
+        return external_fixture
 
-    def _create_fixture(self, match_json: dict, existing_fixture: Fixture = None) -> Fixture:
-        status = None
-        utc_date = None
-        home_team_ext_id = None
-        away_team_ext_id = None
-        home_score = None
-        away_score = None
-
-        if 'status' in match_json:
-            status = match_json['status']
-        if 'utcDate' in match_json:
-            utc_date = match_json['utcDate']
-        if 'homeTeam' in match_json:
-            if 'id' in match_json['homeTeam']:
-                home_team_ext_id = match_json['homeTeam']['id']
-        if 'awayTeam' in match_json:
-            if 'id' in match_json['homeTeam']:
-                away_team_ext_id = match_json['awayTeam']['id']
-        if 'score' in match_json:
-            if 'fullTime' in match_json['score']:
-                if 'homeTeam' in match_json['score']['fullTime']:
-                    home_score = match_json['score']['fullTime']['homeTeam']
-                if 'awayTeam' in match_json['score']['fullTime']:
-                    away_score = match_json['score']['fullTime']['awayTeam']
-        
-        if any(var is None for var in [status, utc_date, home_team_ext_id,
-                                       away_team_ext_id]):
-            return False
+    def _get_headers(self, **kwargs: Dict) -> Dict:
+        if FOOTBALL_DATA_DOT_ORG_API_KEY is None:
+            return {}
+        return {'X-Auth-Token': FOOTBALL_DATA_DOT_ORG_API_KEY}
 
-        home_team_internal = TeamMapping.get_model_from_external_id(ExternalIdentifierType.NUMERIC, home_team_ext_id,
-                                                                    self.request_type.api.id)
-        away_team_internal = TeamMapping.get_model_from_external_id(ExternalIdentifierType.NUMERIC, away_team_ext_id,
-                                                                    self.request_type.api.id) 
-        if home_team_internal is None or away_team_internal is None:
-            breakpoint()
+    def _validate(self, json: dict) -> bool:
+        if not self._validate_competition(json):
             return False
 
-        fixture_dt = datetime.strptime(utc_date, "%Y-%m-%dT%H:%M:%SZ")
-        if fixture_dt is None:
-            breakpoint()
+        if 'matches' not in json:
             return False
-       
-        internal_status = self._get_status(status)
-        if internal_status is None:
-            breakpoint()
-            return False 
-
-        if existing_fixture is not None:
-            existing_fixture.home_team = home_team_internal
-            existing_fixture.away_team = away_team_internal
-            existing_fixture.home_score = home_score
-            existing_fixture.away_score = away_score
-            existing_fixture.kickoff_time_utc = fixture_dt
-            existing_fixture.is_ongoing = is_ongoing
-            existing_fixture.save()
-        else:
-            fixture = Fixture(home_team=home_team_internal, away_team=away_team_internal, home_score=home_score,
-                              away_score=away_score,
-                              kickoff_time_utc=fixture_dt,
-                              status=internal_status)
-            fixture.save()
-            fixture_mapping = FixtureMapping(value_id=fixture.id,
-                                             api_id=self.request_type.api.id,
-                                             numeric_external_identifier=match_json['id'])
-            fixture_mapping.save()
-        return True
 
-    def _get_status(self, status: str) -> FixtureStatus:
-        fixture_status = FixtureStatusMapping.get_model_from_external_id(ExternalIdentifierType.STRING,
-                                                                         status,
-                                                                         self.request_type.api.id)
-        return fixture_status
-
-    def _status_is_ongoing(self, status: str) -> bool:
-        return not (status == "FINISHED")
-
-    def _get_headers(self, **kwargs: Dict) -> Dict:
-        return {'X-Auth-Token': FOOTBALL_DATA_DOT_ORG_API_KEY}
+        return True
 
-    def _validate(self, json: dict) -> bool:
+    def _validate_competition(self, json: dict) -> bool:
         if 'competition' not in json:
             return False
         if 'id' not in json['competition']:
             return False
-        if not json['competition']['id'] == FDDO_PREMIER_LEAGUE_ID:
+        if not json['competition']['id'] == self.competition_id:
             return False
-    
-        if 'matches' not in json:
-            return False
-    
+
         return True
 
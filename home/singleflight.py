@@ -0,0 +1,97 @@
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, Union
+from uuid import uuid4
+from django.conf import settings
+from .models import RefreshLease
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    # Coalesces refreshes per RequestType: one in flight per process (threads share the leader's result) and one
+    # across processes via a RefreshLease row.  Callers that lose either race wait for the winner or skip.
+
+    def __init__(self, lease_seconds: float = None, poll_interval_seconds: float = 0.5):
+        self.lease_seconds = lease_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self._lock = threading.Lock()
+        self._flights: Dict[int, _Flight] = {}
+
+    def run(self, request_type_id: int, fn: Callable[[], Any], wait: bool = True,
+            timeout: Union[float, None] = None) -> Any:
+        # Returns fn's result, the in-process leader's result when coalesced, or None when another process
+        # holds the lease
+        with self._lock:
+            flight = self._flights.get(request_type_id)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._flights[request_type_id] = flight
+
+        if not is_leader:
+            if wait and flight.done.wait(timeout):
+                return flight.result
+            return None
+
+        try:
+            flight.result = self._run_leased(request_type_id, fn, wait, timeout)
+            return flight.result
+        finally:
+            with self._lock:
+                del self._flights[request_type_id]
+            flight.done.set()
+
+    def is_in_flight(self, request_type_id: int) -> bool:
+        with self._lock:
+            return request_type_id in self._flights
+
+    def acquire_lease(self, request_type_id: int) -> Union[str, None]:
+        # Just the cross process half, for callers managing their own concurrency.  Returns the owner to release
+        # the lease with, or None when another process holds it.
+        owner = self._get_owner()
+        if not RefreshLease.acquire(request_type_id, owner, self._get_lease_duration()):
+            return None
+        return owner
+
+    def release_lease(self, request_type_id: int, owner: str) -> None:
+        RefreshLease.release(request_type_id, owner)
+
+    def _run_leased(self, request_type_id: int, fn: Callable[[], Any], wait: bool,
+                    timeout: Union[float, None]) -> Any:
+        owner = self.acquire_lease(request_type_id)
+        if owner is None:
+            if wait:
+                self._wait_for_release(request_type_id, timeout)
+            return None
+        try:
+            return fn()
+        finally:
+            self.release_lease(request_type_id, owner)
+
+    def _wait_for_release(self, request_type_id: int, timeout: Union[float, None]) -> None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while RefreshLease.is_held(request_type_id):
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            time.sleep(self.poll_interval_seconds)
+
+    def _get_lease_duration(self) -> timedelta:
+        lease_seconds = self.lease_seconds
+        if lease_seconds is None:
+            lease_seconds = settings.INGESTION_LEASE_SECONDS
+        return timedelta(seconds=lease_seconds)
+
+    def _get_owner(self) -> str:
+        return "%s:%s:%s" % (socket.gethostname()[:60], os.getpid(), uuid4().hex[:12])
+
+
+refresh_flights = SingleFlight()
@@ -0,0 +1,143 @@
+import codecs
+from json import JSONDecodeError, JSONDecoder
+from typing import Any, Dict, Iterable, Iterator
+
+JSON_WHITESPACE = ' \t\n\r'
+COMPACT_THRESHOLD = 64 * 1024
+
+
+class HashingChunks:
+    # Passes byte chunks through unchanged, feeding each one to the hasher on the way
+
+    def __init__(self, chunks: Iterable[bytes], hasher):
+        self.chunks = chunks
+        self.hasher = hasher
+        self.size = 0
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self.chunks:
+            self.hasher.update(chunk)
+            self.size += len(chunk)
+            yield chunk
+
+
+class JsonArrayStream:
+    # Incrementally parses a top level JSON object from byte chunks.  Every member is decoded as usual into
+    # self.members except the array under array_key, whose items are decoded and yielded one at a time, so only the
+    # current item and the unparsed tail of the latest chunk are ever held in memory.
+
+    def __init__(self, chunks: Iterable[bytes], array_key: str):
+        self.array_key = array_key
+        self.members: Dict[str, Any] = {}
+        self.has_array = False
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._exhausted = False
+        self._started = False
+        self._finished = False
+        self._array_done = False
+
+    def read_until_array(self) -> bool:
+        # Decodes the members ahead of the array, so they can be checked before any item is handled
+        if self.has_array:
+            return True
+        if self._finished:
+            return False
+        if not self._started:
+            if self._next_char() != '{':
+                raise self._error("Expecting '{'")
+            self._pos += 1
+            self._started = True
+        return self._read_members()
+
+    def iter_items(self) -> Iterator[Any]:
+        if not self.read_until_array() or self._array_done:
+            return
+
+        while True:
+            char = self._next_char()
+            if char == ']':
+                self._pos += 1
+                break
+            if char == ',':
+                self._pos += 1
+                continue
+            yield self._decode_value()
+
+        # Anything after the array still has to be read, both for its members and so the whole body gets hashed
+        self._array_done = True
+        self._read_members()
+
+    def _read_members(self) -> bool:
+        while True:
+            char = self._next_char()
+            if char == '}':
+                self._pos += 1
+                self._finished = True
+                return False
+            if char == ',':
+                self._pos += 1
+                continue
+            if char != '"':
+                raise self._error("Expecting property name")
+
+            key = self._decode_value()
+            if self._next_char() != ':':
+                raise self._error("Expecting ':'")
+            self._pos += 1
+
+            if key == self.array_key and not self.has_array and self._next_char() == '[':
+                self._pos += 1
+                self.has_array = True
+                return True
+            self.members[key] = self._decode_value()
+
+    def _decode_value(self) -> Any:
+        # raw_decode doesn't skip leading whitespace itself
+        self._next_char()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, self._pos)
+            except JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+            if end == len(self._buffer) and self._read_more():
+                # A number cut off at the end of a chunk still decodes, just wrongly, so try again with more data
+                continue
+            self._pos = end
+            self._compact()
+            return value
+
+    def _next_char(self) -> str:
+        while True:
+            buffer_length = len(self._buffer)
+            while self._pos < buffer_length and self._buffer[self._pos] in JSON_WHITESPACE:
+                self._pos += 1
+            if self._pos < buffer_length:
+                return self._buffer[self._pos]
+            if not self._read_more():
+                raise self._error("Unexpected end of data")
+
+    def _read_more(self) -> bool:
+        if self._exhausted:
+            return False
+        for chunk in self._chunks:
+            text = self._text_decoder.decode(chunk)
+            if text:
+                self._buffer += text
+                return True
+        self._exhausted = True
+        self._buffer += self._text_decoder.decode(b'', final=True)
+        return False
+
+    def _compact(self) -> None:
+        if self._pos > COMPACT_THRESHOLD:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+
+    def _error(self, message: str) -> JSONDecodeError:
+        return JSONDecodeError(message, self._buffer, self._pos)
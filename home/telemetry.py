@@ -0,0 +1,18 @@
+import time
+
+
+class QueryCounter:
+    # Database execute wrapper counting queries and the time spent in them, install with
+    # connection.execute_wrapper(counter)
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
@@ -1,22 +1,187 @@
-from datetime import datetime
+import base64
+import threading
+import time
+from hashlib import blake2b
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta, timezone
 import json
-from unittest.mock import patch
-from django.test import TestCase
+from unittest.mock import ANY, patch, MagicMock
+from requests import Timeout
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from preferences.models import TeamPreference
+from sportsfeed import metrics, profiling
 from .models import (
                     TeamMapping, Team, Api, RequestType, RequestLimitType,
-                    RequestAudit, Fixture, FixtureMapping
+                    RequestAudit, Fixture, FixtureMapping, RefreshLease,
+                    FixtureStatus, FixtureStatusMapping, ApiRateLimitState, IngestionRun,
+                    Gameweek, FixtureChange, FixtureChangeLock
                     )
 from .enums import ExternalIdentifierType
+from .constants import (
+                        FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE, REQUEST_LIMIT_TYPE_STAGGERED,
+                        REQUEST_LIMIT_TYPE_PER_MINUTE, FDDO_FETCH_MODE_FULL, FDDO_FETCH_MODE_WINDOW,
+                        FDDO_FETCH_MODE_LIVE, FDDO_PREMIER_LEAGUE_ID
+                        )
 #from .constants import get_fantasy_epl_api_id
-from .services import FDDOApiClient, UrlGenerationError
+from .services import ApiGetClient, FDDOApiClient, UrlGenerationError, FDDO_MATCH_DECODER
+from .worker import IngestionWorker
+from .singleflight import SingleFlight
+from .cache import LRUCache
+from .scheduler import PollScheduler
+from .enums import FixtureStatusIds
+from .decoders import FieldError, MISSING_VALUE
+from .streaming import JsonArrayStream
+from .fetcher import AsyncFetcher, get_competition_client_factories
+from .fakeserver import FakeFootballDataServer
+from .loadtest import StageTimer, set_up_fake_fddo_api
+from .telemetry import QueryCounter
+from .feed import (
+    DIRECTION_EARLIER, DIRECTION_LATER, FeedCursor, InvalidCursor, get_cached_page, get_feed_cache, get_feed_page,
+    get_first_page
+)
+from .changes import get_changes_since
+from .ingestion import ExternalFixture, FixtureIngestor
+from . import http
+from . import metrics as home_metrics
+from . import refresh
 
 
 class HomeTest(TestCase):
 
+    def setUp(self):
+        get_feed_cache().clear()
+
     def test_home_renders_correct_template(self):
         response = self.client.get('/home/')
         self.assertTemplateUsed(response, 'home.html')
 
+    @patch('home.services.FDDOApiClient.request')
+    def test_home__does_not_refresh_fixtures(self, request_mock):
+        self.client.get('/home/')
+        request_mock.assert_not_called()
+
+    def test_home__user_following_every_team__constant_query_count(self):
+        user = User.objects.create_user('fan', password='password')
+        teams = [Team.objects.create(name='Team %s' % i) for i in range(20)]
+        TeamPreference.objects.bulk_create([TeamPreference(user=user, team=team, is_preference=True)
+                                            for team in teams])
+        fixtures = self.create_fixtures(teams, 100)
+        self.client.force_login(user)
+
+        # Session, user, data age, preferred teams, the (empty) current gameweek, the page, then whether there's
+        # anything earlier
+        with self.assertNumQueries(7):
+            response = self.client.get('/home/')
+        self.assertEqual(response.context['fixtures'], fixtures[:10])
+
+    def test_home__user_preferences__only_their_teams_fixtures(self):
+        user = User.objects.create_user('fan', password='password')
+        teams = [Team.objects.create(name='Team %s' % i) for i in range(4)]
+        TeamPreference.objects.create(user=user, team=teams[0], is_preference=True)
+        TeamPreference.objects.create(user=user, team=teams[1], is_preference=False)
+        fixtures = self.create_fixtures(teams, 4)
+        self.client.force_login(user)
+
+        response = self.client.get('/home/')
+
+        # Fixtures 0 and 3 involve team 0 at home and away
+        self.assertEqual(response.context['fixtures'], [fixtures[0], fixtures[3]])
+
+    def test_home__anonymous__active_teams_fixtures(self):
+        teams = [Team.objects.create(name='Team %s' % i, is_active=i < 2) for i in range(4)]
+        fixtures = self.create_fixtures(teams, 4)
+
+        response = self.client.get('/home/')
+
+        self.assertEqual(response.context['fixtures'], [fixtures[0], fixtures[1], fixtures[3]])
+
+    @classmethod
+    def create_fixtures(cls, teams, count, first_kickoff=None):
+        # Fixture i is teams i and i + 1 in a cycle, a day after fixture i - 1
+        status = FixtureStatus.objects.get_or_create(description='Scheduled')[0]
+        if first_kickoff is None:
+            first_kickoff = datetime.now(timezone.utc) + timedelta(days=1)
+        return [Fixture.objects.create(home_team=teams[i % len(teams)], away_team=teams[(i + 1) % len(teams)],
+                                       kickoff_time_utc=first_kickoff + timedelta(days=i), status=status)
+                for i in range(count)]
+
+
+class FeedPaginationTest(TestCase):
+
+    def setUp(self):
+        get_feed_cache().clear()
+        self.teams = [Team.objects.create(name='Team %s' % i) for i in range(4)]
+        self.team_ids = [team.id for team in self.teams]
+        # Ten played and ten upcoming fixtures, a day apart
+        self.fixtures = HomeTest.create_fixtures(self.teams, 20,
+                                                 datetime.now(timezone.utc) - timedelta(days=10, hours=-1))
+
+    def test_get_feed_page__no_cursor__starts_at_next_kickoff(self):
+        page = get_feed_page(self.team_ids, page_size=4)
+
+        self.assertEqual(page.fixtures, self.fixtures[10:14])
+        self.assertEqual(page.earlier_cursor, FeedCursor.for_fixture(self.fixtures[10]))
+        self.assertEqual(page.later_cursor, FeedCursor.for_fixture(self.fixtures[13]))
+
+    def test_get_feed_page__walk_both_ways__every_fixture_once(self):
+        first_page = get_feed_page(self.team_ids, page_size=4)
+
+        later = []
+        page = first_page
+        while page.later_cursor is not None:
+            page = get_feed_page(self.team_ids, page.later_cursor, DIRECTION_LATER, page_size=4)
+            later.extend(page.fixtures)
+        earlier = []
+        page = first_page
+        while page.earlier_cursor is not None:
+            page = get_feed_page(self.team_ids, page.earlier_cursor, DIRECTION_EARLIER, page_size=4)
+            earlier = page.fixtures + earlier
+
+        self.assertEqual(earlier + first_page.fixtures + later, self.fixtures)
+        self.assertEqual(len(page.fixtures), 2)
+
+    def test_get_feed_page__same_kickoff__ordered_by_id(self):
+        kickoff = datetime.now(timezone.utc) + timedelta(days=30)
+        same_kickoff = HomeTest.create_fixtures(self.teams, 3, kickoff)
+        Fixture.objects.filter(id__in=[fixture.id for fixture in same_kickoff]).update(kickoff_time_utc=kickoff)
+
+        page = get_feed_page(self.team_ids, FeedCursor(kickoff, same_kickoff[0].id), DIRECTION_LATER)
+
+        self.assertEqual([fixture.id for fixture in page.fixtures], [fixture.id for fixture in same_kickoff[1:]])
+
+    def test_get_feed_page__bounded_queries(self):
+        cursor = FeedCursor.for_fixture(self.fixtures[15])
+
+        with self.assertNumQueries(2):
+            page = get_feed_page(self.team_ids, cursor, DIRECTION_EARLIER, page_size=3)
+        self.assertEqual(page.fixtures, self.fixtures[12:15])
+
+    def test_cursor__round_trips(self):
+        cursor = FeedCursor.for_fixture(self.fixtures[3])
+        self.assertEqual(FeedCursor.decode(cursor.encode()), cursor)
+
+    def test_cursor__garbage__raises_error(self):
+        for encoded in ['', 'not a cursor', base64.urlsafe_b64encode(b'2020-01-01T00:00:00|1').decode('ascii')]:
+            self.assertRaises(InvalidCursor, FeedCursor.decode, encoded)
+
+    def test_feed__returns_json_page(self):
+        with override_settings(HOME_FEED_PAGE_SIZE=2):
+            response = self.client.get('/home/feed/')
+            later = self.client.get('/home/feed/', {'cursor': response.json()['later_cursor'], 'direction': 'later'})
+
+        self.assertEqual([fixture['id'] for fixture in response.json()['fixtures']],
+                         [fixture.id for fixture in self.fixtures[10:12]])
+        self.assertEqual(response.json()['fixtures'][0]['home_team'], {'id': self.teams[2].id, 'name': 'Team 2'})
+        self.assertEqual([fixture['id'] for fixture in later.json()['fixtures']],
+                         [fixture.id for fixture in self.fixtures[12:14]])
+
+    def test_feed__invalid_cursor__bad_request(self):
+        self.assertEqual(self.client.get('/home/feed/', {'cursor': 'nonsense'}).status_code, 400)
+        self.assertEqual(self.client.get('/home/', {'direction': 'sideways'}).status_code, 400)
+
     #def test_get_team_from_external_id__numeric_id_present__returns_team(self):
     #    external_identifier = 99999
     #    team_id = 1
@@ -148,7 +313,7 @@ class ApiClientTest(TestCase):
     def test_request__request_valid_unsuccessful__returns_false_and_unsuccessful_request_audit(self, req_type_objects_mock, get_mock, is_in_cooldown_mock, get_url_mock):
         self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
         get_mock.return_value.ok = True
-        get_mock.return_value.content = 'Not blank'
+        get_mock.return_value.content = b'Not blank'
         get_mock.return_value.status_code = 200
         req_audit_result = None
         api_client = FDDOApiClient()
@@ -174,7 +339,7 @@ class ApiClientTest(TestCase):
     def test_request__no_competition_key__returns_false(self, req_type_objects_mock, get_mock, is_in_cooldown_mock, get_url_mock):
         self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
         get_mock.return_value.ok = True
-        get_mock.return_value.content = 'Not blank'
+        get_mock.return_value.content = b'Not blank'
         get_mock.return_value.status_code = 200
         
         json = self.get_json_dict()
@@ -193,7 +358,7 @@ class ApiClientTest(TestCase):
     def test_request__no_competition_id_key__returns_false(self, req_type_objects_mock, get_mock, is_in_cooldown_mock, get_url_mock):
         self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
         get_mock.return_value.ok = True
-        get_mock.return_value.content = 'Not blank'
+        get_mock.return_value.content = b'Not blank'
         get_mock.return_value.status_code = 200
         
         json = self.get_json_dict()
@@ -212,7 +377,7 @@ class ApiClientTest(TestCase):
     def test_request__incorrect_competition_id_key__returns_false(self, req_type_objects_mock, get_mock, is_in_cooldown_mock, get_url_mock):
         self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
         get_mock.return_value.ok = True
-        get_mock.return_value.content = 'Not blank'
+        get_mock.return_value.content = b'Not blank'
         get_mock.return_value.status_code = 200
 
         json = self.get_json_dict()
@@ -231,7 +396,7 @@ class ApiClientTest(TestCase):
     def test_request__no_matches_key__returns_false(self, req_type_objects_mock, get_mock, is_in_cooldown_mock, get_url_mock):
         self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
         get_mock.return_value.ok = True
-        get_mock.return_value.content = 'Not blank'
+        get_mock.return_value.content = b'Not blank'
         get_mock.return_value.status_code = 200
 
         json = self.get_json_dict()
@@ -251,7 +416,7 @@ class ApiClientTest(TestCase):
     def test_request__no_matches_id_key__returns_false(self, req_type_objects_mock, get_mock, is_in_cooldown_mock, get_url_mock):
         self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
         get_mock.return_value.ok = True
-        get_mock.return_value.content = 'Not blank'
+        get_mock.return_value.content = b'Not blank'
         get_mock.return_value.status_code = 200
 
         json = self.get_json_dict()
@@ -263,50 +428,50 @@ class ApiClientTest(TestCase):
         self.assertFalse(ret_val)
 
     # Test existing fixture completed
-    @patch('home.services.FDDOApiClient._create_fixture')
     @patch('home.models.RequestType.get_url')
     @patch('home.models.Api.is_in_cooldown')
     @patch('home.services.get')
     @patch('home.services.RequestType.objects')
-    def test_request__existing_fixture_completed__returns_true_and_no_new_fixture(self, req_type_objects_mock, get_mock, is_in_cooldown_mock, get_url_mock, create_fixture_mock):
+    def test_request__existing_fixture_completed__returns_true_and_no_new_fixture(self, req_type_objects_mock, get_mock, is_in_cooldown_mock, get_url_mock):
         self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
         get_mock.return_value.ok = True
         get_mock.return_value.status_code = 200
-        get_mock.return_value.content = self.get_json_string()
+        get_mock.return_value.headers = {}
+        get_mock.return_value.content = self.get_json_string().encode('utf-8')
 
         json = self.get_json_dict()
 
         del json['matches'][1]
         self.create_teams()
-        self.create_existing_fixture(json['matches'][0]['id'])
+        self.create_existing_fixture(json['matches'][0]['id'], finished=True)
 
         get_mock.return_value.json.return_value = json
 
         api_client = FDDOApiClient()
-        ret_val = api_client.request()
+        with patch.object(Fixture.objects, 'bulk_update') as bulk_update_mock:
+            ret_val = api_client.request()
         self.assertTrue(ret_val)
         self.assertLess(Fixture.objects.count(), 2)
-        create_fixture_mock.assert_not_called()
+        # Only the missing fingerprint is written
+        bulk_update_mock.assert_called_once_with(ANY, ['source_fingerprint'])
 
     # Test existing fixutre not completed
-    @patch('home.models.TeamMapping.get_model_from_external_id')
     @patch('home.models.RequestType.get_url')
     @patch('home.models.Api.is_in_cooldown')
     @patch('home.services.get')
     @patch('home.services.RequestType.objects')
     def test_request__existing_fixture_not_completed__returns_true_and_updates(self, req_type_objects_mock, get_mock,
-                                                                               is_in_cooldown_mock, get_url_mock,
-                                                                               get_model_from_external_id_mock):
+                                                                               is_in_cooldown_mock, get_url_mock):
         self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
         get_mock.return_value.ok = True
         get_mock.return_value.status_code = 200
-        get_mock.return_value.content = self.get_json_string()
+        get_mock.return_value.headers = {}
+        get_mock.return_value.content = self.get_json_string().encode('utf-8')
         json = self.get_json_dict()
 
         del json['matches'][1]
         self.create_teams()
-        self.create_existing_fixture(json['matches'][0]['id'], True)
-        get_model_from_external_id_mock.side_effect = [self.home_team, self.away_team]
+        self.create_existing_fixture(json['matches'][0]['id'])
 
         get_mock.return_value.json.return_value = json
 
@@ -322,26 +487,24 @@ class ApiClientTest(TestCase):
         expected_dt = datetime.strptime(json['matches'][0]['utcDate'], "%Y-%m-%dT%H:%M:%SZ")
 
         self.assertEqual(result_fixture.kickoff_time_utc.replace(tzinfo=None), expected_dt)
-        self.assertFalse(result_fixture.is_ongoing)
+        self.assertEqual(result_fixture.status_id, self.finished_status.id)
 
     # Test no existing fixture (and full fixture data)
-    @patch('home.models.TeamMapping.get_model_from_external_id')
     @patch('home.models.RequestType.get_url')
     @patch('home.models.Api.is_in_cooldown')
     @patch('home.services.get')
     @patch('home.services.RequestType.objects')
     def test_request__no_existing_fixture__returns_true_and_creates(self, req_type_objects_mock, get_mock,
-                                                                    is_in_cooldown_mock, get_url_mock,
-                                                                    get_model_from_external_id_mock):
+                                                                    is_in_cooldown_mock, get_url_mock):
         self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
         get_mock.return_value.ok = True
         get_mock.return_value.status_code = 200
-        get_mock.return_value.content = self.get_json_string()
+        get_mock.return_value.headers = {}
+        get_mock.return_value.content = self.get_json_string().encode('utf-8')
         json = self.get_json_dict()
 
         del json['matches'][1]
         self.create_teams()
-        get_model_from_external_id_mock.side_effect = [self.home_team, self.away_team]
 
         get_mock.return_value.json.return_value = json
 
@@ -357,7 +520,308 @@ class ApiClientTest(TestCase):
         expected_dt = datetime.strptime(json['matches'][0]['utcDate'], "%Y-%m-%dT%H:%M:%SZ")
 
         self.assertEqual(result_fixture.kickoff_time_utc.replace(tzinfo=None), expected_dt)
-        self.assertFalse(result_fixture.is_ongoing)
+        self.assertEqual(result_fixture.status_id, self.finished_status.id)
+        self.assertEqual(FixtureMapping.objects.get(value=result_fixture).numeric_external_identifier,
+                         json['matches'][0]['id'])
+
+    @patch('home.models.RequestType.get_url')
+    @patch('home.models.Api.is_in_cooldown')
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    def test_request__many_matches__constant_query_count(self, req_type_objects_mock, get_mock,
+                                                         is_in_cooldown_mock, get_url_mock):
+        self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
+        get_mock.return_value.ok = True
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.headers = {}
+        get_mock.return_value.content = self.get_json_string().encode('utf-8')
+        json = self.get_json_dict()
+        self.create_teams()
+
+        match = json['matches'][0]
+        json['matches'] = []
+        for i in range(50):
+            json['matches'].append(dict(match, id=match['id'] + i))
+            self.create_existing_fixture(match['id'] + i)
+        get_mock.return_value.json.return_value = json
+
+        api_client = FDDOApiClient()
+        # Validators, audit, dedup, 4 mapping and gameweek preloads, savepoint + bulk update + feed versions + change
+        # log lock and append + release, 3 to load and rebound the gameweeks, 5 to mark one current, mark audit
+        # successful, record the run
+        with self.assertNumQueries(24):
+            ret_val = api_client.request()
+        self.assertTrue(ret_val)
+        self.assertEqual(Fixture.objects.filter(home_score=4, away_score=1).count(), 50)
+
+    @patch('home.models.RequestType.get_url')
+    @patch('home.models.Api.is_in_cooldown')
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    def test_request__response_has_validators__sent_on_next_request(self, req_type_objects_mock, get_mock,
+                                                                    is_in_cooldown_mock, get_url_mock):
+        self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
+        get_mock.return_value.ok = True
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.headers = {'ETag': '"abc"', 'Last-Modified': 'Sat, 15 Mar 2020 00:00:51 GMT'}
+        get_mock.return_value.content = self.get_json_string().encode('utf-8')
+        json = self.get_json_dict()
+        del json['matches'][1]
+        self.create_teams()
+        get_mock.return_value.json.return_value = json
+
+        self.assertTrue(FDDOApiClient().request())
+        self.assertEqual(self.request_type.get_validators('testurl.com').etag, '"abc"')
+
+        FDDOApiClient().request()
+        sent_headers = get_mock.call_args[1]['headers']
+        self.assertEqual(sent_headers['If-None-Match'], '"abc"')
+        self.assertEqual(sent_headers['If-Modified-Since'], 'Sat, 15 Mar 2020 00:00:51 GMT')
+
+    @patch('home.services.FDDOApiClient._handle_response_content')
+    @patch('home.models.RequestType.get_url')
+    @patch('home.models.Api.is_in_cooldown')
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    def test_request__not_modified__returns_true_without_processing(self, req_type_objects_mock, get_mock,
+                                                                    is_in_cooldown_mock, get_url_mock,
+                                                                    handle_response_content_mock):
+        self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
+        get_mock.return_value.ok = True
+        get_mock.return_value.status_code = 304
+        get_mock.return_value.content = b''
+
+        api_client = FDDOApiClient()
+        self.assertTrue(api_client.request())
+        get_mock.return_value.json.assert_not_called()
+        handle_response_content_mock.assert_not_called()
+        self.assertIsNone(api_client.hashed_response)
+
+        req_audit_result = RequestAudit.objects.get(url=api_client.url)
+        self.assertEqual(req_audit_result.response_code, 304)
+        self.assertTrue(req_audit_result.successful)
+
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    @patch('home.models.RequestType', autospec=True)
+    @patch('home.models.Api', autospec=True)
+    def test_request__request_times_out__returns_false(self, api_mock, req_type_mock, req_type_objects_mock,
+                                                       get_mock):
+        self.set_up_mocked_models(api_mock, req_type_mock, req_type_objects_mock)
+        get_mock.side_effect = Timeout()
+        api_client = FDDOApiClient()
+        self.assertFalse(api_client.request())
+
+    @patch('home.models.RequestType.get_url')
+    @patch('home.models.Api.is_in_cooldown')
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    def test_request__successful__records_ingestion_run(self, req_type_objects_mock, get_mock, is_in_cooldown_mock,
+                                                        get_url_mock):
+        self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
+        get_mock.return_value.ok = True
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.headers = {}
+        get_mock.return_value.content = self.get_json_string().encode('utf-8')
+        json = self.get_json_dict()
+        del json['matches'][1]
+        self.create_teams()
+        get_mock.return_value.json.return_value = json
+
+        api_client = FDDOApiClient()
+        self.assertTrue(api_client.request())
+
+        run = IngestionRun.objects.get()
+        self.assertEqual(run.api_id, self.api.id)
+        self.assertEqual(run.request_type_id, self.request_type.id)
+        self.assertEqual(run.request_audit_id, RequestAudit.objects.get(url=api_client.url).id)
+        self.assertEqual(run.response_code, 200)
+        self.assertEqual(run.bytes_received, len(get_mock.return_value.content))
+        self.assertIsNotNone(run.fetch_latency_ms)
+        self.assertIsNotNone(run.decode_ms)
+        self.assertGreater(run.db_ms, 0)
+        self.assertEqual((run.matches_seen, run.matches_created, run.matches_updated), (1, 1, 0))
+        self.assertTrue(run.successful)
+        self.assertIsNone(run.failure_reason)
+
+    @patch('home.models.RequestType.get_url')
+    @patch('home.models.Api.is_in_cooldown')
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    def test_request__times_out__records_failed_ingestion_run(self, req_type_objects_mock, get_mock,
+                                                              is_in_cooldown_mock, get_url_mock):
+        self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
+        get_mock.side_effect = Timeout()
+
+        self.assertFalse(FDDOApiClient().request())
+
+        run = IngestionRun.objects.get()
+        self.assertFalse(run.successful)
+        self.assertEqual(run.failure_reason, "Request failed: Timeout")
+        self.assertIsNone(run.response_code)
+        self.assertIsNone(run.request_audit_id)
+
+    @patch('home.models.RequestType.get_url')
+    @patch('home.models.Api.is_in_cooldown')
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    def test_request__server_error__records_failed_ingestion_run(self, req_type_objects_mock, get_mock,
+                                                                 is_in_cooldown_mock, get_url_mock):
+        self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
+        get_mock.return_value.ok = False
+        get_mock.return_value.status_code = 500
+        get_mock.return_value.headers = {}
+
+        self.assertFalse(FDDOApiClient().request())
+
+        run = IngestionRun.objects.get()
+        self.assertFalse(run.successful)
+        self.assertEqual(run.response_code, 500)
+        self.assertEqual(run.failure_reason, "HTTP 500")
+
+    @patch('home.services.FDDOApiClient._handle_response_content')
+    @patch('home.models.RequestType.get_url')
+    @patch('home.models.Api.is_in_cooldown')
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    def test_request__identical_response_already_handled__skips_processing(self, req_type_objects_mock, get_mock,
+                                                                           is_in_cooldown_mock, get_url_mock,
+                                                                           handle_response_content_mock):
+        self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
+        get_mock.return_value.ok = True
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.headers = {}
+        get_mock.return_value.content = self.get_json_string().encode('utf-8')
+        get_mock.return_value.json.return_value = self.get_json_dict()
+        handle_response_content_mock.return_value = True
+
+        first_client = FDDOApiClient()
+        self.assertTrue(first_client.request())
+        self.assertTrue(FDDOApiClient().request())
+
+        self.assertEqual(handle_response_content_mock.call_count, 1)
+        self.assertEqual(len(first_client.hashed_response), 16)
+        self.assertEqual(RequestAudit.objects.filter(hashed_response=first_client.hashed_response).count(), 2)
+
+    @patch('home.models.RequestType.get_url')
+    @patch('home.models.Api.is_in_cooldown')
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    def test_request__streamed__ingests_matches_and_hashes_whole_body(self, req_type_objects_mock, get_mock,
+                                                                      is_in_cooldown_mock, get_url_mock):
+        self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
+        json_dict = self.get_json_dict()
+        del json_dict['matches'][1]
+        content = json.dumps(json_dict, indent=4).encode('utf-8')
+        get_mock.return_value.ok = True
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.headers = {}
+        get_mock.return_value.iter_content.return_value = [content[i:i + 7] for i in range(0, len(content), 7)]
+        self.create_teams()
+
+        api_client = FDDOApiClient(stream=True)
+        self.assertTrue(api_client.request())
+        self.assertTrue(get_mock.call_args[1]['stream'])
+        get_mock.return_value.json.assert_not_called()
+        self.assertEqual(api_client.ingestor.created, 1)
+        self.assertEqual(api_client.hashed_response, blake2b(content, digest_size=16).digest())
+        self.assertTrue(RequestAudit.objects.get(hashed_response=api_client.hashed_response).successful)
+
+    @override_settings(API_CLIENT_STREAM_RESPONSES=True)
+    def test_init__streaming_on__only_clients_supporting_it_stream(self):
+        self.assertFalse(_BufferedApiClient(None).stream)
+        self.assertFalse(_BufferedApiClient(None, stream=True).stream)
+
+    @patch('home.models.RequestType.get_url')
+    @patch('home.models.Api.is_in_cooldown')
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    def test_request__matches_unchanged_since_last_ingest__skipped(self, req_type_objects_mock, get_mock,
+                                                                   is_in_cooldown_mock, get_url_mock):
+        self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
+        get_mock.return_value.ok = True
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.headers = {}
+        json = self.get_json_dict()
+        del json['matches'][1]
+        self.create_teams()
+        get_mock.return_value.json.return_value = json
+
+        get_mock.return_value.content = b'first'
+        self.assertTrue(FDDOApiClient().request())
+
+        # The response as a whole differs (e.g. a different match moved), but this match didn't
+        get_mock.return_value.content = b'second'
+        api_client = FDDOApiClient()
+        with patch('home.ingestion.Fixture.objects.bulk_update') as bulk_update_mock, \
+                patch('home.services.FDDOApiClient._parse_match') as parse_match_mock:
+            self.assertTrue(api_client.request())
+        bulk_update_mock.assert_not_called()
+        parse_match_mock.assert_not_called()
+        self.assertEqual(api_client.ingestor.unchanged, 1)
+        self.assertEqual(api_client.ingestor.changed, 0)
+
+    @patch('home.models.RequestType.get_url')
+    @patch('home.models.Api.is_in_cooldown')
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    def test_request__unchanged_match_without_fingerprint__only_fingerprint_written(self, req_type_objects_mock,
+                                                                                    get_mock, is_in_cooldown_mock,
+                                                                                    get_url_mock):
+        self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
+        get_mock.return_value.ok = True
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.headers = {}
+        json = self.get_json_dict()
+        del json['matches'][1]
+        self.create_teams()
+        get_mock.return_value.json.return_value = json
+        get_mock.return_value.content = b'first'
+        self.assertTrue(FDDOApiClient().request())
+        # As stored before fingerprinting
+        Fixture.objects.update(source_fingerprint=None)
+        change_sequence = FixtureChange.get_latest_sequence()
+        feed_version = Team.objects.get(id=self.home_team.id).feed_version
+
+        get_mock.return_value.content = b'second'
+        api_client = FDDOApiClient()
+        self.assertTrue(api_client.request())
+
+        self.assertEqual(api_client.ingestor.changed, 0)
+        self.assertIsNotNone(Fixture.objects.get().source_fingerprint)
+        self.assertEqual(FixtureChange.get_latest_sequence(), change_sequence)
+        self.assertEqual(Team.objects.get(id=self.home_team.id).feed_version, feed_version)
+        get_mock.return_value.content = b'third'
+        with patch('home.services.FDDOApiClient._parse_match') as parse_match_mock:
+            self.assertTrue(FDDOApiClient().request())
+        parse_match_mock.assert_not_called()
+
+    @patch('home.models.RequestType.get_url')
+    @patch('home.models.Api.is_in_cooldown')
+    @patch('home.services.get')
+    @patch('home.services.RequestType.objects')
+    def test_request__one_match_score_changed__only_that_match_updated(self, req_type_objects_mock, get_mock,
+                                                                       is_in_cooldown_mock, get_url_mock):
+        self.set_up_real_models(req_type_objects_mock, is_in_cooldown_mock, get_url_mock)
+        get_mock.return_value.ok = True
+        get_mock.return_value.status_code = 200
+        get_mock.return_value.headers = {}
+        json = self.get_json_dict()
+        self.create_teams()
+        match = json['matches'][0]
+        json['matches'] = [dict(match, id=match['id'] + i) for i in range(3)]
+        get_mock.return_value.json.return_value = json
+
+        get_mock.return_value.content = b'first'
+        self.assertTrue(FDDOApiClient().request())
+
+        json['matches'][1] = dict(json['matches'][1], score={'fullTime': {'homeTeam': 5, 'awayTeam': 1}})
+        get_mock.return_value.content = b'second'
+        api_client = FDDOApiClient()
+        self.assertTrue(api_client.request())
+        self.assertEqual(api_client.ingestor.changed, 1)
+        self.assertEqual(api_client.ingestor.unchanged, 2)
+        self.assertEqual(Fixture.objects.filter(home_score=5).count(), 1)
 
     @classmethod
     def create_teams(cls):
@@ -365,11 +829,28 @@ class ApiClientTest(TestCase):
         cls.home_team.save()
         cls.away_team = Team(name='test_away', is_active=True)
         cls.away_team.save()
+        TeamMapping(value=cls.home_team, api=cls.api, numeric_external_identifier=64).save()
+        TeamMapping(value=cls.away_team, api=cls.api, numeric_external_identifier=68).save()
+
+        cls.finished_status = FixtureStatus(description='finished')
+        cls.finished_status.save()
+        cls.in_play_status = FixtureStatus(description='in-play')
+        cls.in_play_status.save()
+        FixtureStatusMapping(value=cls.finished_status, api=cls.api, string_external_identifier='FINISHED').save()
+        FixtureStatusMapping(value=cls.in_play_status, api=cls.api, string_external_identifier='IN_PLAY').save()
 
     @classmethod
-    def create_existing_fixture(cls, id, is_ongoing=False):
-        fixture = Fixture(home_team=cls.home_team, away_team=cls.away_team, home_score=1, away_score=2,
-                          kickoff_time_utc=datetime.utcnow(), is_ongoing=is_ongoing)
+    def create_existing_fixture(cls, id, finished=False):
+        if finished:
+            fixture = Fixture(home_team=cls.home_team, away_team=cls.away_team, home_score=4, away_score=1,
+                              kickoff_time_utc=datetime(2019, 8, 9, 19, tzinfo=timezone.utc),
+                              status=cls.finished_status)
+        else:
+            fixture = Fixture(home_team=cls.home_team, away_team=cls.away_team, home_score=1, away_score=2,
+                              kickoff_time_utc=datetime.now(timezone.utc), status=cls.in_play_status)
+        # Already ingested, so in the matchday's gameweek
+        fixture.gameweek = Gameweek.objects.get_or_create(api=cls.api, competition_external_id=FDDO_PREMIER_LEAGUE_ID,
+                                                          number=1)[0]
         fixture.save()
 
         FixtureMapping(value_id=fixture.id, api_id=cls.api.id,
@@ -566,3 +1047,1151 @@ class ApiClientTest(TestCase):
     ]
 }
 """
+
+
+@patch('home.worker.close_old_connections')
+class IngestionWorkerTest(TransactionTestCase):
+    # The clients are fetched with an AsyncFetcher, whose database thread only sees committed rows
+
+    def setUp(self):
+        api = Api(name='test_api')
+        api.save()
+        self.request_type = RequestType(api=api, base_url='testurl.com', description='test_req_type',
+                                        current_version_iter=0)
+        self.request_type.save()
+
+    def test_run_once__refreshes_every_client(self, close_old_connections_mock):
+        factories = [self.create_client_factory(), self.create_client_factory()]
+
+        worker = IngestionWorker(client_factories=factories, poll_interval_seconds=0)
+
+        self.assertTrue(worker.run_once())
+        for factory in factories:
+            factory.return_value.handle_response.assert_called_once()
+
+    def test_run_once__client_raises__other_clients_still_refreshed(self, close_old_connections_mock):
+        failing_factory = self.create_client_factory()
+        failing_factory.return_value.handle_response.side_effect = Exception("boom")
+        working_factory = self.create_client_factory()
+
+        worker = IngestionWorker(client_factories=[failing_factory, working_factory], poll_interval_seconds=0)
+
+        self.assertFalse(worker.run_once())
+        working_factory.return_value.handle_response.assert_called_once()
+
+    def test_run__max_iterations__stops(self, close_old_connections_mock):
+        factory = self.create_client_factory()
+
+        worker = IngestionWorker(client_factories=[factory], poll_interval_seconds=0)
+        worker.run(max_iterations=3)
+
+        self.assertEqual(factory.return_value.handle_response.call_count, 3)
+
+    def test_run_once__lease_held_by_other_process__skips_request(self, close_old_connections_mock):
+        factory = self.create_client_factory()
+        RefreshLease.acquire(self.request_type.id, 'other-process', timedelta(minutes=1))
+
+        worker = IngestionWorker(client_factories=[factory], poll_interval_seconds=0)
+
+        self.assertTrue(worker.run_once())
+        factory.return_value.send_request.assert_not_called()
+
+    @override_settings(FDDO_COMPETITION_IDS=[2021, 2001], INGESTION_CLIENTS=[])
+    def test_init__default_clients__every_configured_competition(self, close_old_connections_mock):
+        worker = IngestionWorker(poll_interval_seconds=0)
+
+        self.assertEqual([factory.keywords['competition_id'] for factory in worker.client_factories], [2021, 2001])
+
+    def create_client_factory(self):
+        factory = MagicMock()
+        factory.return_value.request_type = self.request_type
+        factory.return_value.prepare_request.return_value = True
+        factory.return_value.handle_response.return_value = True
+        return factory
+
+
+class StaleWhileRevalidateTest(TestCase):
+
+    def test_home__no_refresh_recorded__reports_stale(self):
+        response = self.client.get('/home/')
+        self.assertTrue(response.context['data_is_stale'])
+        self.assertIsNone(response.context['data_age_seconds'])
+        self.assertEqual(response['X-Feed-Stale'], '1')
+
+    def test_home__recent_refresh__reports_fresh(self):
+        self.create_request_audit(datetime.utcnow())
+        response = self.client.get('/home/')
+        self.assertFalse(response.context['data_is_stale'])
+        self.assertEqual(response['X-Feed-Stale'], '0')
+        self.assertIn('X-Feed-Age', response)
+
+    @override_settings(HOME_FEED_REFRESH_MODE=refresh.REFRESH_MODE_STALE_WHILE_REVALIDATE)
+    @patch('home.refresh._schedule_refresh')
+    def test_home__stale_while_revalidate_and_stale__schedules_refresh(self, schedule_refresh_mock):
+        self.create_request_audit(datetime(2019, 8, 9))
+        self.client.get('/home/')
+        schedule_refresh_mock.assert_called()
+
+    @override_settings(HOME_FEED_REFRESH_MODE=refresh.REFRESH_MODE_STALE_WHILE_REVALIDATE)
+    @patch('home.refresh._schedule_refresh')
+    def test_home__stale_while_revalidate_and_fresh__does_not_schedule_refresh(self, schedule_refresh_mock):
+        self.create_request_audit(datetime.utcnow())
+        self.client.get('/home/')
+        schedule_refresh_mock.assert_not_called()
+
+    @patch('home.refresh._schedule_refresh')
+    def test_home__worker_mode_and_stale__does_not_schedule_refresh(self, schedule_refresh_mock):
+        self.client.get('/home/')
+        schedule_refresh_mock.assert_not_called()
+
+    @classmethod
+    def create_request_audit(cls, request_time):
+        api = Api(name='test_api')
+        api.save()
+        request_type = RequestType(id=FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE, api=api, base_url='testurl.com',
+                                   description='test_req_type', current_version_iter=0)
+        request_type.save()
+        RequestAudit(api=api, url='testurl.com', request_type=request_type, request_time=request_time,
+                     response_code=200, successful=True).save()
+
+
+class SingleFlightTest(TestCase):
+
+    def setUp(self):
+        api = Api(name='test_api')
+        api.save()
+        self.request_type = RequestType(api=api, base_url='testurl.com', description='test_req_type',
+                                        current_version_iter=0)
+        self.request_type.save()
+
+    def test_run__lease_free__runs_and_releases(self):
+        single_flight = SingleFlight(lease_seconds=60)
+        self.assertTrue(single_flight.run(self.request_type.id, lambda: True))
+        self.assertFalse(RefreshLease.is_held(self.request_type.id))
+
+    def test_run__lease_held_elsewhere__skips(self):
+        fn = MagicMock()
+        RefreshLease.acquire(self.request_type.id, 'other-process', timedelta(minutes=1))
+
+        result = SingleFlight(lease_seconds=60).run(self.request_type.id, fn, wait=False)
+
+        self.assertIsNone(result)
+        fn.assert_not_called()
+
+    def test_run__lease_expired__takes_over(self):
+        RefreshLease.acquire(self.request_type.id, 'other-process', timedelta(minutes=-1))
+        self.assertTrue(SingleFlight(lease_seconds=60).run(self.request_type.id, lambda: True))
+
+    @patch('home.singleflight.RefreshLease')
+    def test_run__concurrent_callers__coalesced_into_one_call(self, refresh_lease_mock):
+        refresh_lease_mock.acquire.return_value = True
+        single_flight = SingleFlight(lease_seconds=60)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow_refresh():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return True
+
+        leader = threading.Thread(target=single_flight.run, args=(self.request_type.id, slow_refresh))
+        leader.start()
+        started.wait(5)
+
+        follower_results = []
+        follower = threading.Thread(target=lambda: follower_results.append(
+            single_flight.run(self.request_type.id, slow_refresh)))
+        follower.start()
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(follower_results, [True])
+
+
+class FixtureIngestorTest(TestCase):
+
+    def setUp(self):
+        self.api = Api.objects.create(name='test_api')
+        team = Team.objects.create(name='Team 0')
+        TeamMapping.objects.create(value=team, api=self.api, numeric_external_identifier=100)
+        status = FixtureStatus.objects.create(description='Scheduled')
+        FixtureStatusMapping.objects.create(value=status, api=self.api, string_external_identifier='SCHEDULED')
+
+    def test_add__unmapped_ids__logged_and_skipped(self):
+        ingestor = FixtureIngestor(self.api.id)
+
+        with self.assertLogs('home.ingestion', 'WARNING') as logs:
+            added = ingestor.add(ExternalFixture(external_id=7, home_team_external_id=100, away_team_external_id=999,
+                                                 status_external_id='ABANDONED',
+                                                 kickoff_time_utc=datetime(2020, 8, 8, 15, tzinfo=timezone.utc),
+                                                 home_score=None, away_score=None))
+
+        self.assertFalse(added)
+        self.assertEqual(ingestor.invalid, 1)
+        self.assertIn("Match 7 from Api %s has unmapped external ids: away team 999, status 'ABANDONED'" % self.api.id,
+                      logs.output[0])
+
+
+class GameweekTest(TestCase):
+
+    def setUp(self):
+        get_feed_cache().clear()
+        self.api = Api.objects.create(name='test_api')
+        self.teams = [Team.objects.create(name='Team %s' % i) for i in range(4)]
+        TeamMapping.objects.bulk_create([TeamMapping(value=team, api=self.api, numeric_external_identifier=100 + i)
+                                         for i, team in enumerate(self.teams)])
+        status = FixtureStatus.objects.create(description='Scheduled')
+        FixtureStatusMapping.objects.create(value=status, api=self.api, string_external_identifier='SCHEDULED')
+        self.first_kickoff = datetime(2020, 8, 8, 15, tzinfo=timezone.utc)
+
+    def test_ingest__matchdays__stored_as_gameweeks_with_bounds(self):
+        self.ingest(4)
+
+        gameweeks = list(Gameweek.objects.order_by('number'))
+        self.assertEqual([(gameweek.number, gameweek.starts_at, gameweek.ends_at) for gameweek in gameweeks], [
+            (1, self.first_kickoff, self.first_kickoff + timedelta(days=1)),
+            (2, self.first_kickoff + timedelta(days=7), self.first_kickoff + timedelta(days=8)),
+        ])
+        self.assertEqual(Fixture.objects.filter(gameweek=gameweeks[1]).count(), 2)
+
+    def test_ingest__moved_kickoff__bounds_follow(self):
+        self.ingest(4)
+        self.ingest(4, moved_kickoff=self.first_kickoff + timedelta(days=5))
+
+        self.assertEqual(Gameweek.objects.get(number=2).starts_at, self.first_kickoff + timedelta(days=5))
+
+    def test_refresh__postponed_match__round_not_kept_current(self):
+        # Gameweek 2's first match is rescheduled two months later
+        self.ingest(8, moved_kickoff=self.first_kickoff + timedelta(days=60))
+
+        gameweek = Gameweek.objects.get(number=2)
+        self.assertEqual((gameweek.starts_at, gameweek.ends_at), (self.first_kickoff + timedelta(days=8),) * 2)
+        after_gameweek_3 = self.first_kickoff + timedelta(days=20)
+        self.assertEqual(Gameweek.refresh(self.api.id, FDDO_PREMIER_LEAGUE_ID, now=after_gameweek_3).number, 4)
+
+    def test_refresh__current_is_first_unfinished_gameweek(self):
+        self.ingest(6)
+
+        before_season = self.first_kickoff - timedelta(days=30)
+        self.assertEqual(Gameweek.refresh(self.api.id, FDDO_PREMIER_LEAGUE_ID, now=before_season).number, 1)
+        # Gameweek 2's last match kicked off an hour ago, so it may still be playing
+        mid_match = self.first_kickoff + timedelta(days=8, hours=1)
+        self.assertEqual(Gameweek.refresh(self.api.id, FDDO_PREMIER_LEAGUE_ID, now=mid_match).number, 2)
+        after_season = self.first_kickoff + timedelta(days=100)
+        self.assertEqual(Gameweek.refresh(self.api.id, FDDO_PREMIER_LEAGUE_ID, now=after_season).number, 3)
+        self.assertEqual(list(Gameweek.objects.filter(is_current=True).values_list('number', flat=True)), [3])
+
+    def test_get_current_gameweek_feed__single_query(self):
+        self.ingest(6)
+        Gameweek.refresh(self.api.id, FDDO_PREMIER_LEAGUE_ID, now=self.first_kickoff + timedelta(days=5))
+
+        with self.assertNumQueries(1):
+            fixtures = list(Fixture.get_current_gameweek_feed([self.teams[0].id]))
+        self.assertEqual([(fixture.gameweek.number, fixture.home_team.name) for fixture in fixtures],
+                         [(2, 'Team 3')])
+
+    def test_get_first_page__current_gameweek_with_cursors_either_side(self):
+        self.ingest(6)
+        Gameweek.refresh(self.api.id, FDDO_PREMIER_LEAGUE_ID, now=self.first_kickoff + timedelta(days=5))
+        team_ids = [team.id for team in self.teams]
+
+        page = get_first_page(team_ids)
+
+        self.assertEqual([fixture.gameweek.number for fixture in page.fixtures], [2, 2])
+        self.assertEqual(get_feed_page(team_ids, page.earlier_cursor, DIRECTION_EARLIER).fixtures,
+                         list(Fixture.objects.filter(gameweek__number=1).order_by('kickoff_time_utc')))
+        self.assertEqual(get_feed_page(team_ids, page.later_cursor, DIRECTION_LATER).fixtures,
+                         list(Fixture.objects.filter(gameweek__number=3).order_by('kickoff_time_utc')))
+
+    def ingest(self, match_count, moved_kickoff=None):
+        # Two matches a gameweek, a day apart, with a week between gameweeks
+        ingestor = FixtureIngestor(self.api.id, FDDO_PREMIER_LEAGUE_ID)
+        for i in range(match_count):
+            kickoff = self.first_kickoff + timedelta(days=i // 2 * 7 + i % 2)
+            if i == 2 and moved_kickoff is not None:
+                kickoff = moved_kickoff
+            ingestor.add(ExternalFixture(external_id=i, home_team_external_id=100 + i % 4,
+                                         away_team_external_id=100 + (i + 1) % 4, status_external_id='SCHEDULED',
+                                         kickoff_time_utc=kickoff, home_score=None, away_score=None,
+                                         matchday=i // 2 + 1))
+        ingestor.flush()
+        ingestor.refresh_gameweeks()
+
+
+class FeedCacheTest(TestCase):
+
+    def setUp(self):
+        # A fresh cache each test, for its hit counts
+        feed_cache_patcher = patch('home.feed._feed_cache', LRUCache(100))
+        feed_cache_patcher.start()
+        self.addCleanup(feed_cache_patcher.stop)
+        self.api = Api.objects.create(name='test_api')
+        self.teams = [Team.objects.create(name='Team %s' % i) for i in range(4)]
+        TeamMapping.objects.bulk_create([TeamMapping(value=team, api=self.api, numeric_external_identifier=100 + i)
+                                         for i, team in enumerate(self.teams)])
+        status = FixtureStatus.objects.create(description='Scheduled')
+        FixtureStatusMapping.objects.create(value=status, api=self.api, string_external_identifier='SCHEDULED')
+        self.first_kickoff = datetime(2020, 8, 8, 15, tzinfo=timezone.utc)
+        self.ingest([(0, 1), (2, 3)])
+        Gameweek.refresh(self.api.id, FDDO_PREMIER_LEAGUE_ID, now=self.first_kickoff)
+
+    def test_home__same_teams__served_from_cache(self):
+        users = [self.create_user('fan %s' % i, self.teams[:2]) for i in range(2)]
+        self.client.force_login(users[0])
+        self.client.get('/home/')
+        self.client.force_login(users[1])
+
+        # Session, user, data age, then the preferred teams with their versions
+        with self.assertNumQueries(4):
+            response = self.client.get('/home/')
+        self.assertEqual([fixture.home_team for fixture in response.context['fixtures']], [self.teams[0]])
+        self.assertEqual(get_feed_cache().hits, 1)
+
+    def test_get_cached_page__followed_teams_fixture_changes__rebuilt(self):
+        get_cached_page(self.get_team_versions([0, 1]))
+
+        self.ingest([(0, 1), (2, 3)], home_score=1)
+
+        page = get_cached_page(self.get_team_versions([0, 1]))
+        self.assertEqual([fixture.home_score for fixture in page.fixtures], [1])
+        self.assertEqual(get_feed_cache().hits, 0)
+
+    def test_get_cached_page__other_teams_fixture_changes__still_cached(self):
+        get_cached_page(self.get_team_versions([0, 1]))
+
+        self.ingest([None, (2, 3)], home_score=1)
+
+        with self.assertNumQueries(1):
+            get_cached_page(self.get_team_versions([0, 1]))
+        self.assertEqual(get_feed_cache().hits, 1)
+
+    def test_ingest__new_fixtures__one_feed_version_update(self):
+        inserts = 1 if connection.features.can_return_rows_from_bulk_insert else 10
+
+        # 4 preloads, then savepoint, the fixtures, their mappings, feed versions, change log lock and append, and
+        # release
+        with self.assertNumQueries(4 + inserts + 6):
+            self.ingest([None, None] + [(0, 1)] * 10)
+        self.assertEqual(self.get_team_versions([0, 1, 2]), {self.teams[0].id: 3, self.teams[1].id: 3,
+                                                             self.teams[2].id: 2})
+
+    def test_fixture_saved_outside_ingestion__feed_versions_bumped(self):
+        fixture = Fixture.objects.get(home_team=self.teams[0])
+        fixture.home_score = 1
+        fixture.save()
+
+        self.assertEqual(self.get_team_versions([0, 1, 2]), {self.teams[0].id: 3, self.teams[1].id: 3,
+                                                             self.teams[2].id: 2})
+
+    def test_home__preferences_change__their_new_teams_fixtures(self):
+        user = self.create_user('fan', self.teams[:1])
+        self.client.force_login(user)
+        self.client.get('/home/')
+
+        TeamPreference.objects.filter(user=user).update(is_preference=False)
+        TeamPreference.objects.create(user=user, team=self.teams[2], is_preference=True)
+        response = self.client.get('/home/')
+
+        self.assertEqual([fixture.home_team for fixture in response.context['fixtures']], [self.teams[2]])
+
+    def test_gameweek_rolls_over__cached_first_page_rebuilt(self):
+        self.ingest([(0, 1), (2, 3), (0, 2), (1, 3)], days=[0, 0, 7, 7], matchdays=[1, 1, 2, 2])
+        get_cached_page(self.get_team_versions([0]))
+
+        Gameweek.refresh(self.api.id, FDDO_PREMIER_LEAGUE_ID, now=self.first_kickoff + timedelta(days=3))
+
+        page = get_cached_page(self.get_team_versions([0]))
+        self.assertEqual([fixture.gameweek.number for fixture in page.fixtures], [2])
+
+    def test_collect_cache_metrics__feed_hit_ratio(self):
+        team_versions = self.get_team_versions([0, 1])
+        get_cached_page(team_versions)
+        get_cached_page(team_versions)
+
+        cache_lines = [line for metric in home_metrics.collect_cache_metrics() for line in metric.collect()]
+        self.assertIn('sportsfeed_cache_hit_ratio{cache="feed"} 0.5', cache_lines)
+
+    def test_lru_cache__over_capacity__evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.evictions, 1)
+
+    def create_user(self, username, teams):
+        user = User.objects.create_user(username, password='password')
+        TeamPreference.objects.bulk_create([TeamPreference(user=user, team=team, is_preference=True)
+                                            for team in teams])
+        return user
+
+    def get_team_versions(self, team_indexes):
+        return dict(Team.objects.filter(id__in=[self.teams[i].id for i in team_indexes])
+                    .values_list('id', 'feed_version'))
+
+    def ingest(self, pairings, home_score=None, days=None, matchdays=None):
+        # Match i is between the given pair of team indexes, or left alone when None, all on the first kickoff and in
+        # gameweek 1 by default
+        ingestor = FixtureIngestor(self.api.id, FDDO_PREMIER_LEAGUE_ID)
+        for i, pairing in enumerate(pairings):
+            if pairing is None:
+                continue
+            home, away = pairing
+            ingestor.add(ExternalFixture(external_id=i, home_team_external_id=100 + home,
+                                         away_team_external_id=100 + away, status_external_id='SCHEDULED',
+                                         kickoff_time_utc=self.first_kickoff + timedelta(days=days[i] if days else 0),
+                                         home_score=home_score, away_score=None,
+                                         matchday=matchdays[i] if matchdays else 1))
+        ingestor.flush()
+
+
+class FixtureChangeTest(TestCase):
+
+    def setUp(self):
+        self.api = Api.objects.create(name='test_api')
+        self.teams = [Team.objects.create(name='Team %s' % i) for i in range(4)]
+        TeamMapping.objects.bulk_create([TeamMapping(value=team, api=self.api, numeric_external_identifier=100 + i)
+                                         for i, team in enumerate(self.teams)])
+        for description in ['Scheduled', 'In play']:
+            status = FixtureStatus.objects.create(description=description)
+            FixtureStatusMapping.objects.create(value=status, api=self.api,
+                                                string_external_identifier=description.upper().replace(' ', '_'))
+        self.kickoff = datetime(2020, 8, 8, 15, tzinfo=timezone.utc)
+        self.ingest([self.match(0, 0, 1), self.match(1, 2, 3)])
+
+    def test_ingest__new_fixtures__logged(self):
+        self.assertEqual([(change.fixture.home_team, change.status.description) for change in
+                          FixtureChange.objects.order_by('id')],
+                         [(self.teams[0], 'Scheduled'), (self.teams[2], 'Scheduled')])
+
+    def test_ingest__score_status_and_kickoff_changes__logged_in_sequence(self):
+        cursor = FixtureChange.get_latest_sequence()
+
+        self.ingest([self.match(0, 0, 1, status='IN_PLAY', home_score=1, away_score=0),
+                     self.match(1, 2, 3, kickoff=self.kickoff + timedelta(days=1))])
+        self.ingest([self.match(0, 0, 1, status='IN_PLAY', home_score=2, away_score=0)])
+
+        changes = list(FixtureChange.get_since([team.id for team in self.teams], cursor))
+        self.assertEqual([(change.home_team, change.home_score, change.kickoff_time_utc) for change in changes], [
+            (self.teams[0], 1, self.kickoff),
+            (self.teams[2], None, self.kickoff + timedelta(days=1)),
+            (self.teams[0], 2, self.kickoff),
+        ])
+        self.assertEqual(changes, sorted(changes, key=lambda change: change.id))
+
+    def test_ingest__changes__appended_under_the_change_log_lock(self):
+        with patch('home.models.FixtureChangeLock.acquire') as acquire_mock:
+            self.ingest([self.match(0, 0, 1, home_score=1)])
+
+        acquire_mock.assert_called_once_with()
+        self.assertTrue(FixtureChangeLock.objects.filter(id=1).exists())
+
+    def test_ingest__unchanged__not_logged(self):
+        cursor = FixtureChange.get_latest_sequence()
+
+        self.ingest([self.match(0, 0, 1), self.match(1, 2, 3)])
+
+        self.assertEqual(FixtureChange.get_latest_sequence(), cursor)
+
+    def test_get_changes_since__more_than_a_page__pages_on_from_cursor(self):
+        for score in range(1, 4):
+            self.ingest([self.match(0, 0, 1, home_score=score)])
+        team_ids = [self.teams[0].id]
+
+        first_page = get_changes_since(team_ids, 0, page_size=2)
+        second_page = get_changes_since(team_ids, first_page.cursor, page_size=2)
+
+        self.assertEqual([change.home_score for change in first_page.changes], [None, 1])
+        self.assertTrue(first_page.has_more)
+        self.assertEqual([change.home_score for change in second_page.changes], [2, 3])
+        self.assertFalse(second_page.has_more)
+        self.assertEqual(get_changes_since(team_ids, second_page.cursor), ([], second_page.cursor, False))
+
+    def test_changes__user_teams_changes_since_cursor(self):
+        user = User.objects.create_user('fan', password='password')
+        TeamPreference.objects.create(user=user, team=self.teams[3], is_preference=True)
+        self.client.force_login(user)
+        cursor = self.client.get('/home/changes/').json()['cursor']
+        self.ingest([self.match(0, 0, 1, home_score=1), self.match(1, 2, 3, away_score=2)])
+
+        # Session, user, preferred teams, then the changes
+        with self.assertNumQueries(4):
+            response = self.client.get('/home/changes/', {'since': cursor})
+
+        self.assertEqual(response.json(), {
+            'changes': [{'sequence': cursor + 2, 'fixture_id': Fixture.objects.get(home_team=self.teams[2]).id,
+                         'kickoff_time_utc': self.kickoff.isoformat(), 'status': 'Scheduled',
+                         'home_team': {'id': self.teams[2].id, 'name': 'Team 2'},
+                         'away_team': {'id': self.teams[3].id, 'name': 'Team 3'},
+                         'home_score': None, 'away_score': 2}],
+            'cursor': cursor + 2,
+            'has_more': False,
+        })
+
+    def test_changes__invalid_since__bad_request(self):
+        for since in ['nonsense', '-1']:
+            self.assertEqual(self.client.get('/home/changes/', {'since': since}).status_code, 400)
+
+    def test_feed__includes_changes_cursor(self):
+        response = self.client.get('/home/feed/')
+
+        self.assertEqual(response.json()['changes_cursor'], FixtureChange.get_latest_sequence())
+
+    def match(self, external_id, home, away, status='SCHEDULED', kickoff=None, home_score=None, away_score=None):
+        return ExternalFixture(external_id=external_id, home_team_external_id=100 + home,
+                               away_team_external_id=100 + away, status_external_id=status,
+                               kickoff_time_utc=kickoff or self.kickoff, home_score=home_score,
+                               away_score=away_score)
+
+    def ingest(self, external_fixtures):
+        ingestor = FixtureIngestor(self.api.id)
+        for external_fixture in external_fixtures:
+            ingestor.add(external_fixture)
+        ingestor.flush()
+
+
+class MappingModelTest(TestCase):
+
+    def setUp(self):
+        self.api = Api(name='test_api')
+        self.api.save()
+        self.team = Team(name='test_team')
+        self.team.save()
+        self.team_mapping = TeamMapping(value=self.team, api=self.api, numeric_external_identifier=99999)
+        self.team_mapping.save()
+
+    def test_get_value_id_from_external_id__present__one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_team_id(99999), self.team.id)
+
+    def test_get_model_from_external_id__string_id__returns_team(self):
+        TeamMapping(value=self.team, api=self.api, string_external_identifier='ASDF').save()
+        team_found = TeamMapping.get_model_from_external_id(ExternalIdentifierType.STRING, 'ASDF', self.api.id)
+        self.assertEqual(team_found.id, self.team.id)
+
+    def test_get_model_from_external_id__not_present__returns_none(self):
+        self.assertIsNone(TeamMapping.get_model_from_external_id(ExternalIdentifierType.NUMERIC, 88888,
+                                                                 self.api.id))
+
+    def get_team_id(self, external_identifier):
+        return TeamMapping.get_value_id_from_external_id(ExternalIdentifierType.NUMERIC, external_identifier,
+                                                         self.api.id)
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledSessionTest(TestCase):
+
+    def setUp(self):
+        http.reset_session()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%s/v2/competitions/2021/matches' % self.server.server_port
+
+    def tearDown(self):
+        http.reset_session()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get__repeated_requests__reuse_connection(self):
+        for _ in range(3):
+            self.assertEqual(http.get(self.url).status_code, 200)
+
+        stats = http.connection_stats()['127.0.0.1']
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 2)
+
+    def test_metrics_view__reports_connection_reuse_per_host(self):
+        for _ in range(3):
+            http.get(self.url)
+
+        content = self.client.get('/metrics').content.decode('utf-8')
+        self.assertIn('sportsfeed_outbound_requests_total{host="127.0.0.1"} 3', content)
+        self.assertIn('sportsfeed_outbound_connections_opened_total{host="127.0.0.1"} 1', content)
+        self.assertIn('sportsfeed_outbound_connections_reused_total{host="127.0.0.1"} 2', content)
+
+    def test_get__sets_timeout(self):
+        with patch.object(http.get_session(), 'get') as session_get_mock:
+            http.get(self.url)
+        self.assertIn('timeout', session_get_mock.call_args[1])
+
+
+class _CompetitionsHandler(BaseHTTPRequestHandler):
+    # Serves one finished match per competition, /v2/competitions/<id>/matches, after a delay
+    protocol_version = 'HTTP/1.1'
+    delay_seconds = 0.3
+
+    def do_GET(self):
+        time.sleep(self.delay_seconds)
+        competition_id = int(self.path.split('/')[3])
+        body = json.dumps({'competition': {'id': competition_id}, 'matches': [{
+            'id': competition_id * 1000, 'status': 'FINISHED', 'utcDate': '2019-08-09T19:00:00Z',
+            'homeTeam': {'id': 64}, 'awayTeam': {'id': 68}, 'score': {'fullTime': {'homeTeam': 4, 'awayTeam': 1}},
+        }]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AsyncFetcherTest(TransactionTestCase):
+    # The fetcher does its database work on its own thread, so the fixtures have to be committed for it to see them
+
+    def setUp(self):
+        http.reset_session()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _CompetitionsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        RequestLimitType(id=REQUEST_LIMIT_TYPE_PER_MINUTE, description='per minute').save()
+        self.api = Api(name='test_api', request_limit_type_id=REQUEST_LIMIT_TYPE_PER_MINUTE, requests_per_minute=10)
+        self.api.save()
+        RequestType(id=FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE, api=self.api,
+                    base_url='http://127.0.0.1:%s/v2/competitions/[Match ID]/matches' % self.server.server_port,
+                    description='test_req_type', current_version_iter=0).save()
+        home_team = Team(name='test_home')
+        home_team.save()
+        away_team = Team(name='test_away')
+        away_team.save()
+        TeamMapping(value=home_team, api=self.api, numeric_external_identifier=64).save()
+        TeamMapping(value=away_team, api=self.api, numeric_external_identifier=68).save()
+        finished_status = FixtureStatus(id=FixtureStatusIds.FINISHED.value, description='Finished')
+        finished_status.save()
+        FixtureStatusMapping(value=finished_status, api=self.api, string_external_identifier='FINISHED').save()
+
+    def tearDown(self):
+        http.reset_session()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_run__many_competitions__fetched_concurrently_and_ingested(self):
+        fetcher = AsyncFetcher(get_competition_client_factories([2021, 2014, 2002], FDDO_FETCH_MODE_FULL))
+        started = time.monotonic()
+        self.assertTrue(fetcher.run())
+
+        # Three 0.3s responses, so sequential fetching would take at least 0.9s
+        self.assertLess(time.monotonic() - started, 0.8)
+        self.assertEqual(sorted(FixtureMapping.objects.values_list('numeric_external_identifier', flat=True)),
+                         [2002000, 2014000, 2021000])
+        self.assertFalse(RefreshLease.is_held(FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE))
+
+    def test_run__rate_limit_exhausted__waits_for_request_slot(self):
+        self.api.requests_per_minute = 60
+        self.api.save()
+        ApiRateLimitState.objects.create(api=self.api, tokens=0, refilled_at=datetime.now(timezone.utc))
+        fetcher = AsyncFetcher(get_competition_client_factories([2021], FDDO_FETCH_MODE_FULL))
+        started = time.monotonic()
+        self.assertTrue(fetcher.run())
+        # One token per second, on top of the response delay
+        self.assertGreaterEqual(time.monotonic() - started, 1.0)
+        self.assertEqual(Fixture.objects.count(), 1)
+
+    def test_fetch_all__request_type_leased_elsewhere__skipped(self):
+        RefreshLease.acquire(FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE, 'other-process', timedelta(minutes=1))
+        fetcher = AsyncFetcher(get_competition_client_factories([2021], FDDO_FETCH_MODE_FULL))
+        self.assertTrue(fetcher.run())
+        self.assertEqual(Fixture.objects.count(), 0)
+
+
+class FakeFootballDataServerTest(TestCase):
+
+    def setUp(self):
+        http.reset_session()
+        self.addCleanup(http.reset_session)
+
+    def start_server(self, **kwargs):
+        server = FakeFootballDataServer(match_count=40, seed=1, **kwargs).start()
+        self.addCleanup(server.stop)
+        set_up_fake_fddo_api(server.matches_url, server.team_ids)
+        return server
+
+    def request(self, competition_id=2021):
+        client = FDDOApiClient(fetch_mode=FDDO_FETCH_MODE_FULL, competition_id=competition_id)
+        self.assertTrue(client.request())
+        return client
+
+    def test_request__fake_server__every_match_ingested(self):
+        self.start_server()
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            client = self.request()
+        self.assertEqual(client.ingestor.created, 40)
+        self.assertEqual(Fixture.objects.count(), 40)
+        self.assertGreater(counter.count, 0)
+
+    def test_request__unchanged_with_etags__not_modified(self):
+        server = self.start_server()
+        self.request()
+        self.assertIsNone(self.request().ingestor)
+        self.assertEqual(server.stats['not_modified'], 1)
+
+    def test_request__two_competitions_unchanged__each_sends_its_own_etag(self):
+        server = self.start_server()
+        for competition_id in [2021, 2001]:
+            self.request(competition_id)
+
+        second_clients = [self.request(competition_id) for competition_id in [2021, 2001]]
+
+        self.assertEqual([client.request_headers.get('If-None-Match') for client in second_clients],
+                         [server.get_competition(2021).etag, server.get_competition(2001).etag])
+        self.assertEqual(server.stats['not_modified'], 2)
+
+    def test_request__churn__changed_matches_updated(self):
+        server = self.start_server(churn_rate=0.1, etags=False)
+        self.request()
+        client = self.request()
+        self.assertEqual(client.ingestor.updated, 4)
+        self.assertEqual(client.ingestor.unchanged, 36)
+        self.assertEqual(server.get_competition(2021).version, 2)
+
+
+class _TimedStages:
+
+    def count_teams(self):
+        return Team.objects.count()
+
+    def build_list(self):
+        return [0] * 100000
+
+
+class StageTimerTest(TestCase):
+
+    def test_measure__instrumented_methods__queries_and_memory_attributed_to_stage(self):
+        timer = StageTimer()
+        stages = _TimedStages()
+        count_teams = _TimedStages.count_teams
+        with timer.measure([(_TimedStages, 'count_teams', 'counting'), (_TimedStages, 'build_list', 'building')]):
+            stages.count_teams()
+            stages.count_teams()
+            stages.build_list()
+            Team.objects.exists()
+
+        results = timer.as_dict()
+        self.assertEqual(results['stages']['counting']['calls'], 2)
+        self.assertEqual(results['stages']['counting']['queries'], 2)
+        self.assertEqual(results['stages']['building']['queries'], 0)
+        self.assertGreaterEqual(results['stages']['building']['peak_memory_bytes'], 800000)
+        self.assertEqual(results['total']['queries'], 3)
+        self.assertIs(_TimedStages.count_teams, count_teams)
+
+
+class IngestionRunTest(TestCase):
+
+    def setUp(self):
+        self.api = Api(name='test_api', request_limit_type=RequestLimitType.objects.create(description='staggered'))
+        self.api.save()
+        self.request_type = RequestType.objects.create(api=self.api, base_url='testurl.com',
+                                                       description='test_req_type', current_version_iter=0)
+
+    def test_get_percentiles__nearest_rank_over_recent_runs(self):
+        for latency in range(1, 101):
+            self.create_run(fetch_latency_ms=latency)
+        self.create_run(fetch_latency_ms=None)
+        self.create_run(fetch_latency_ms=5000, started_at=datetime.now(timezone.utc) - timedelta(hours=2))
+
+        self.assertEqual(IngestionRun.get_percentiles('fetch_latency_ms', (50, 95, 100)), {50: 50, 95: 95, 100: 100})
+
+    def test_get_percentiles__no_runs__none(self):
+        self.assertEqual(IngestionRun.get_percentiles('db_ms'), {50: None, 95: None})
+
+    def test_get_failure_counts__grouped_by_reason(self):
+        self.create_run(successful=True)
+        self.create_run(successful=False, failure_reason="HTTP 500")
+        self.create_run(successful=False, failure_reason="HTTP 500")
+        self.create_run(successful=False, failure_reason="Request failed: Timeout")
+
+        self.assertEqual(IngestionRun.get_failure_counts(request_type=self.request_type),
+                         {"HTTP 500": 2, "Request failed: Timeout": 1})
+
+    def create_run(self, started_at=None, successful=True, **kwargs):
+        return IngestionRun.objects.create(api=self.api, request_type=self.request_type,
+                                           started_at=started_at or datetime.now(timezone.utc),
+                                           successful=successful, **kwargs)
+
+
+class MetricsTest(TestCase):
+
+    def test_histogram__renders_cumulative_buckets(self):
+        histogram = metrics.Histogram('test_seconds', "Test", ['view'], buckets=(0.1, 1.0))
+        histogram.observe(0.05, view='a')
+        histogram.observe(0.5, view='a')
+        histogram.observe(5, view='a')
+
+        self.assertEqual(histogram.collect(), [
+            '# HELP test_seconds Test',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{view="a",le="0.1"} 1',
+            'test_seconds_bucket{view="a",le="1"} 2',
+            'test_seconds_bucket{view="a",le="+Inf"} 3',
+            'test_seconds_sum{view="a"} 5.55',
+            'test_seconds_count{view="a"} 3',
+        ])
+
+    def test_counter__escapes_label_values(self):
+        counter = metrics.Counter('test_total', "Test", ['name'])
+        counter.inc(name='say "hi"\n')
+        counter.inc(2, name='say "hi"\n')
+
+        self.assertEqual(counter.collect()[2], 'test_total{name="say \\"hi\\"\\n"} 3')
+
+    def test_counter__wrong_labels__raises_error(self):
+        counter = metrics.Counter('test_total', "Test", ['name'])
+        self.assertRaises(ValueError, counter.inc, other='a')
+
+    def test_registry__failing_collector__left_out(self):
+        registry = metrics.MetricsRegistry()
+        registry.register(metrics.Gauge('test_gauge', "Test")).set(2)
+        registry.register_collector(lambda: 1 / 0)
+
+        self.assertEqual(registry.render(), '# HELP test_gauge Test\n# TYPE test_gauge gauge\ntest_gauge 2\n')
+
+    def test_metrics_view__reports_home_requests(self):
+        self.client.get('/home/')
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        content = response.content.decode('utf-8')
+        self.assertIn('sportsfeed_http_request_duration_seconds_count{view="home.views.home"}', content)
+        self.assertIn('sportsfeed_http_request_db_queries_count{view="home.views.home"}', content)
+        self.assertIn('sportsfeed_http_responses_total{view="home.views.home",status="200"}', content)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_metrics_view__disabled__not_found(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_collectors__report_ingestion_lag_and_cache_ratios(self):
+        api = Api.objects.create(name='test_api')
+        request_type = RequestType.objects.create(api=api, base_url='testurl.com', description='test_req_type',
+                                                  current_version_iter=0)
+        RequestAudit.objects.create(api=api, url='testurl.com', request_type=request_type, response_code=200,
+                                    request_time=datetime.now(timezone.utc) - timedelta(minutes=5), successful=True)
+        cache = LRUCache(10)
+        cache.get('key')
+        cache.set('key', 1)
+        cache.get('key')
+
+        lag_name, lag_value = home_metrics.collect_ingestion_lag_metrics()[0].collect()[2].split(' ')
+        self.assertEqual(lag_name, 'sportsfeed_ingestion_lag_seconds{request_type="test_req_type"}')
+        self.assertAlmostEqual(float(lag_value), 300, delta=5)
+        with patch('home.feed._feed_cache', cache):
+            cache_lines = [line for metric in home_metrics.collect_cache_metrics()
+                           for line in metric.collect()]
+        self.assertIn('sportsfeed_cache_hit_ratio{cache="feed"} 0.5', cache_lines)
+        self.assertIn('sportsfeed_cache_entries{cache="feed"} 1', cache_lines)
+
+
+class _BufferedApiClient(ApiGetClient):
+
+    def _handle_response_content(self, response_content):
+        return True
+
+    def _get_headers(self, **kwargs):
+        return {}
+
+    def _validate(self, json):
+        return True
+
+
+def _run_queries(request, count):
+    for _ in range(count):
+        Team.objects.exists()
+    return HttpResponse()
+
+
+class ProfilingTest(TestCase):
+
+    def test_query_budget__over_budget_in_tests__raises(self):
+        # Turned on by QueryBudgetTestRunner, it's off by default
+        view = profiling.query_budget(2)(_run_queries)
+
+        view(None, 2)
+        self.assertRaises(profiling.QueryBudgetExceeded, view, None, 3)
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    def test_query_budget__over_budget_elsewhere__logs_error(self):
+        view = profiling.query_budget(2)(_run_queries)
+
+        with self.assertLogs('sportsfeed.profiling', 'ERROR') as logs:
+            self.assertEqual(view(None, 3).status_code, 200)
+        self.assertIn("home.tests._run_queries ran 3 queries, over its budget of 2", logs.output[0])
+
+    def test_middleware__staff__sets_server_timing(self):
+        user = User.objects.create_user('staff', password='password', is_staff=True)
+        self.client.force_login(user)
+
+        response = self.client.get('/home/')
+
+        server_timing = response['Server-Timing']
+        self.assertRegex(server_timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertRegex(server_timing, r'tpl;dur=[\d.]+')
+        self.assertIn('api;dur=0.0;desc="0 calls"', server_timing)
+        self.assertRegex(server_timing, r'total;dur=[\d.]+')
+
+    def test_middleware__anonymous__no_server_timing(self):
+        response = self.client.get('/home/')
+
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(DEBUG=True)
+    def test_middleware__debug__sets_server_timing(self):
+        response = self.client.get('/home/')
+
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    def test_middleware__records_outbound_calls(self):
+        profile = profiling.RequestProfile()
+        profiling.set_current_profile(profile)
+        try:
+            profiling.record_outbound(0.25)
+            profiling.record_outbound(0.5)
+        finally:
+            profiling.set_current_profile(None)
+        profiling.record_outbound(1)
+
+        self.assertEqual((profile.outbound_count, profile.outbound_seconds), (2, 0.75))
+
+    def test_middleware__staff_profile_header__returns_cprofile_stats(self):
+        user = User.objects.create_user('staff', password='password', is_staff=True)
+        self.client.force_login(user)
+
+        response = self.client.get('/home/', HTTP_X_PROFILE='1')
+
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertIn(b'cumulative', response.content)
+        self.assertIn(b'views.py', response.content)
+
+    def test_middleware__profile_header_not_staff__returns_page(self):
+        user = User.objects.create_user('not_staff', password='password')
+        self.client.force_login(user)
+
+        response = self.client.get('/home/', HTTP_X_PROFILE='1')
+
+        self.assertTemplateUsed(response, 'home/home.html')
+
+
+class RateLimiterTest(TestCase):
+
+    def setUp(self):
+        RequestLimitType(id=REQUEST_LIMIT_TYPE_STAGGERED, description='staggered').save()
+        RequestLimitType(id=REQUEST_LIMIT_TYPE_PER_MINUTE, description='per minute').save()
+        self.now = datetime(2020, 5, 2, 12, tzinfo=timezone.utc)
+        now_patcher = patch('home.models.timezone.now', side_effect=lambda: self.now)
+        now_patcher.start()
+        self.addCleanup(now_patcher.stop)
+
+    def test_is_in_cooldown__staggered__one_request_per_interval(self):
+        api = self.create_api(REQUEST_LIMIT_TYPE_STAGGERED, request_interval_ms=10000)
+
+        self.assertFalse(api.is_in_cooldown())
+        self.assertTrue(api.is_in_cooldown())
+        self.assertAlmostEqual(api.seconds_until_request_allowed(), 10)
+
+        self.now += timedelta(seconds=10)
+        self.assertFalse(api.is_in_cooldown())
+
+    def test_is_in_cooldown__per_minute__allows_burst_then_refills(self):
+        api = self.create_api(REQUEST_LIMIT_TYPE_PER_MINUTE, requests_per_minute=10)
+
+        for _ in range(10):
+            self.assertFalse(api.is_in_cooldown())
+        self.assertTrue(api.is_in_cooldown())
+
+        self.now += timedelta(seconds=6)
+        self.assertFalse(api.is_in_cooldown())
+        self.assertTrue(api.is_in_cooldown())
+
+    def test_is_in_cooldown__per_minute__other_apis_not_counted(self):
+        api = self.create_api(REQUEST_LIMIT_TYPE_PER_MINUTE, requests_per_minute=1)
+        other_api = self.create_api(REQUEST_LIMIT_TYPE_PER_MINUTE, requests_per_minute=1)
+
+        self.assertFalse(other_api.is_in_cooldown())
+        self.assertFalse(api.is_in_cooldown())
+
+    def test_is_in_cooldown__audit_history__constant_query_count(self):
+        api = self.create_api(REQUEST_LIMIT_TYPE_STAGGERED, request_interval_ms=1000)
+        request_type = RequestType(api=api, base_url='testurl.com', description='test_req_type',
+                                   current_version_iter=0)
+        request_type.save()
+        RequestAudit.objects.bulk_create([RequestAudit(api=api, url='testurl.com', request_type=request_type,
+                                                       request_time=self.now, response_code=200, successful=True)
+                                          for _ in range(100)])
+        api.is_in_cooldown()
+
+        self.now += timedelta(seconds=1)
+        with self.assertNumQueries(2):
+            self.assertFalse(api.is_in_cooldown())
+
+    @classmethod
+    def create_api(cls, request_limit_type_id, **kwargs):
+        api = Api(name='test_api', request_limit_type_id=request_limit_type_id, **kwargs)
+        api.save()
+        return api
+
+
+class PollSchedulerTest(TestCase):
+
+    def setUp(self):
+        self.now = datetime(2020, 5, 2, 12, tzinfo=timezone.utc)
+        self.scheduler = PollScheduler(live_seconds=15, pre_kickoff_seconds=300, pre_kickoff_window_seconds=3600,
+                                       idle_seconds=21600, match_duration_seconds=10800)
+        self.home_team = Team(name='test_home')
+        self.home_team.save()
+        self.away_team = Team(name='test_away')
+        self.away_team.save()
+        for status in (FixtureStatusIds.FINISHED, FixtureStatusIds.IN_PLAY, FixtureStatusIds.SCHEDULED):
+            FixtureStatus(id=status.value, description=status.name).save()
+
+    def test_next_poll_delay__no_fixtures__idle(self):
+        self.assertEqual(self.scheduler.next_poll_delay(apis=[], now=self.now), 21600)
+
+    def test_next_poll_delay__fixture_in_play__live(self):
+        self.create_fixture(FixtureStatusIds.IN_PLAY, timedelta(minutes=-30))
+        self.assertEqual(self.scheduler.next_poll_delay(apis=[], now=self.now), 15)
+
+    def test_next_poll_delay__past_kickoff_still_scheduled__live(self):
+        self.create_fixture(FixtureStatusIds.SCHEDULED, timedelta(minutes=-5))
+        self.assertEqual(self.scheduler.next_poll_delay(apis=[], now=self.now), 15)
+
+    def test_next_poll_delay__kickoff_within_window__pre_kickoff(self):
+        self.create_fixture(FixtureStatusIds.FINISHED, timedelta(days=-1))
+        self.create_fixture(FixtureStatusIds.SCHEDULED, timedelta(minutes=30))
+        self.assertEqual(self.scheduler.next_poll_delay(apis=[], now=self.now), 300)
+
+    def test_next_poll_delay__kickoff_hours_away__sleeps_until_window(self):
+        self.create_fixture(FixtureStatusIds.SCHEDULED, timedelta(hours=3))
+        self.assertEqual(self.scheduler.next_poll_delay(apis=[], now=self.now), 2 * 60 * 60)
+
+    def test_next_poll_delay__api_limit_slower_than_schedule__api_limit(self):
+        RequestLimitType(id=REQUEST_LIMIT_TYPE_STAGGERED, description='staggered').save()
+        api = Api(name='test_api', request_limit_type_id=REQUEST_LIMIT_TYPE_STAGGERED, request_interval_ms=60000)
+        api.save()
+        self.create_fixture(FixtureStatusIds.IN_PLAY, timedelta(minutes=-30))
+        self.assertGreaterEqual(self.scheduler.next_poll_delay(apis=[api], now=self.now), 60)
+
+    def create_fixture(self, status, kickoff_offset):
+        Fixture(home_team=self.home_team, away_team=self.away_team, kickoff_time_utc=self.now + kickoff_offset,
+                status_id=status.value).save()
+
+
+class RequestUrlTest(TestCase):
+
+    def setUp(self):
+        api = Api(name='test_api')
+        api.save()
+        self.request_type = RequestType(id=FOOTBALL_DATA_DOT_ORG_GET_MATCHES_REQ_TYPE, api=api,
+                                        base_url='https://api.football-data.org/v2/competitions/[Match ID]/matches',
+                                        description='test_req_type', current_version_iter=0)
+        self.request_type.save()
+
+    def test_get_url__query_params__appended_sorted_without_none(self):
+        url = self.request_type.get_url('2021', status='LIVE', dateFrom='2020-05-01', dateTo=None)
+        self.assertEqual(url, 'https://api.football-data.org/v2/competitions/2021/matches'
+                              '?dateFrom=2020-05-01&status=LIVE')
+
+    def test_get_url__no_query_params__unchanged(self):
+        self.assertEqual(self.request_type.get_url('2021'),
+                         'https://api.football-data.org/v2/competitions/2021/matches')
+
+    @override_settings(FDDO_WINDOW_PAST_DAYS=2, FDDO_WINDOW_FUTURE_DAYS=7)
+    @patch('home.services.django_timezone.now')
+    def test_fddo_get_url__window_mode__requests_date_range(self, now_mock):
+        now_mock.return_value = datetime(2020, 5, 2, 12, tzinfo=timezone.utc)
+        url = FDDOApiClient(fetch_mode=FDDO_FETCH_MODE_WINDOW)._get_url()
+        self.assertEqual(url, 'https://api.football-data.org/v2/competitions/2021/matches'
+                              '?dateFrom=2020-04-30&dateTo=2020-05-09')
+
+    def test_fddo_get_url__live_mode__requests_live_statuses(self):
+        url = FDDOApiClient(fetch_mode=FDDO_FETCH_MODE_LIVE)._get_url()
+        self.assertTrue(url.endswith('/2021/matches?status=LIVE'))
+
+    def test_fddo_get_url__full_mode__requests_whole_season(self):
+        url = FDDOApiClient(fetch_mode=FDDO_FETCH_MODE_FULL)._get_url()
+        self.assertTrue(url.endswith('/2021/matches'))
+
+    def test_fddo_init__unknown_mode__raises(self):
+        self.assertRaises(ValueError, FDDOApiClient, fetch_mode='everything')
+
+
+class MatchDecoderTest(TestCase):
+
+    def get_match(self, **overrides):
+        match = {'id': 264341, 'status': 'FINISHED', 'utcDate': '2019-08-09T19:00:00Z',
+                 'homeTeam': {'id': 64, 'name': 'Liverpool FC'}, 'awayTeam': {'id': 68, 'name': 'Norwich City FC'},
+                 'score': {'fullTime': {'homeTeam': 4, 'awayTeam': 1}}}
+        match.update(overrides)
+        return match
+
+    def test_decode__valid_match__returns_record(self):
+        record, errors = FDDO_MATCH_DECODER.decode(self.get_match())
+        self.assertEqual(errors, ())
+        self.assertEqual(record.external_id, 264341)
+        self.assertEqual(record.home_team_external_id, 64)
+        self.assertEqual(record.away_team_external_id, 68)
+        self.assertEqual(record.status_external_id, 'FINISHED')
+        self.assertEqual(record.kickoff_time_utc, datetime(2019, 8, 9, 19, tzinfo=timezone.utc))
+        self.assertEqual((record.home_score, record.away_score), (4, 1))
+
+    def test_decode__not_started__scores_optional(self):
+        record, errors = FDDO_MATCH_DECODER.decode(self.get_match(score={'fullTime': {'homeTeam': None,
+                                                                                      'awayTeam': None}}))
+        self.assertEqual(errors, ())
+        self.assertIsNone(record.home_score)
+
+    def test_decode__invalid_fields__every_error_reported(self):
+        record, errors = FDDO_MATCH_DECODER.decode(self.get_match(homeTeam={'name': 'Liverpool FC'},
+                                                                  utcDate='9th August', status=3))
+        self.assertIsNone(record)
+        self.assertEqual([error.field for error in errors],
+                         ['home_team_external_id', 'status_external_id', 'kickoff_time_utc'])
+        self.assertEqual(errors[0], FieldError('home_team_external_id', MISSING_VALUE))
+
+
+class JsonArrayStreamTest(TestCase):
+
+    def get_chunks(self, content, size):
+        content = content.encode('utf-8')
+        return [content[i:i + size] for i in range(0, len(content), size)]
+
+    def test_iter_items__split_across_chunks__items_and_members_decoded(self):
+        content = '{"count": 12345, "competition": {"id": 2021}, "matches": [{"id": 1001, "name": "Café"}, ' \
+                  '{"id": 1002}, 31415], "filters": {}}'
+        for size in (1, 3, 64):
+            stream = JsonArrayStream(self.get_chunks(content, size), 'matches')
+            self.assertTrue(stream.read_until_array())
+            self.assertEqual(stream.members, {'count': 12345, 'competition': {'id': 2021}})
+            self.assertEqual(list(stream.iter_items()), [{'id': 1001, 'name': 'Café'}, {'id': 1002}, 31415])
+            self.assertEqual(stream.members['filters'], {})
+
+    def test_read_until_array__no_array__returns_false(self):
+        stream = JsonArrayStream(self.get_chunks('{"count": 0}', 4), 'matches')
+        self.assertFalse(stream.read_until_array())
+        self.assertEqual(list(stream.iter_items()), [])
+
+    def test_iter_items__truncated__raises(self):
+        stream = JsonArrayStream(self.get_chunks('{"matches": [{"id": 1}, {"id": ', 4), 'matches')
+        with self.assertRaises(ValueError):
+            list(stream.iter_items())
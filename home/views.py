@@ -1,38 +1,96 @@
+from django.http import HttpRequest, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render
-from django.db.models import Q
 from django.views.decorators.csrf import csrf_exempt
 from preferences.models import TeamPreference
-from .models import Fixture, Team
-from .services import FDDOApiClient
+from sportsfeed.profiling import query_budget
+from .changes import get_changes_since, serialize_change
+from .feed import (
+    DIRECTION_EARLIER, DIRECTION_LATER, FeedCursor, InvalidCursor, get_cached_page, serialize_fixture
+)
+from .models import Team
+from .refresh import get_data_age_seconds, is_stale, revalidate_if_stale
 
 @csrf_exempt
+@query_budget(10)
 def home(request):
-    fixtures = set()
-    # Get user
-    user = request.user
+    # Serve whatever is stored, kicking off a background refresh first if we're configured to and it's stale
+    data_age_seconds = get_data_age_seconds()
+    revalidate_if_stale(data_age_seconds)
 
-    if not refresh_fixtures():
-        # TODO: logging
-        pass
+    # TODO: Handle seasons
+    try:
+        page = _get_requested_feed_page(request)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor")
+    data_is_stale = is_stale(data_age_seconds)
+    response = render(request, 'home/home.html', context={'fixtures': page.fixtures,
+                                                          'earlier_cursor': _encode(page.earlier_cursor),
+                                                          'later_cursor': _encode(page.later_cursor),
+                                                          'data_age_seconds': data_age_seconds,
+                                                          'data_is_stale': data_is_stale})
+    if data_age_seconds is not None:
+        response['X-Feed-Age'] = str(int(data_age_seconds))
+    response['X-Feed-Stale'] = '1' if data_is_stale else '0'
+    return response
 
-    # Pull preferences
-    preferred_teams = TeamPreference.get_user_preferred_teams(user)
-    if preferred_teams is None:
-        preferred_teams = Team.objects.filter(is_active=True)
 
-    # TODO: Handle seasons
-    for team in preferred_teams:
-        fixtures_for_team = Fixture.objects.filter(Q(home_team=team) | Q(away_team=team))
-        fixtures = fixtures.union(set(fixtures_for_team))
+@query_budget(10)
+def feed(request: HttpRequest) -> JsonResponse:
+    # The home feed's pages as JSON, for loading more fixtures without reloading the page.  The changes cursor is read
+    # first, so syncing from it can't miss a change made while the page was built.
+    changes_cursor = get_changes_since(None).cursor
+    try:
+        page = _get_requested_feed_page(request)
+    except InvalidCursor:
+        return JsonResponse({'error': "Invalid cursor"}, status=400)
+    return JsonResponse({'fixtures': [serialize_fixture(fixture) for fixture in page.fixtures],
+                         'earlier_cursor': _encode(page.earlier_cursor),
+                         'later_cursor': _encode(page.later_cursor),
+                         'changes_cursor': changes_cursor})
+
+
+@query_budget(10)
+def changes(request: HttpRequest) -> JsonResponse:
+    # ?since=<sequence>, the changes to the feed's fixtures after that sequence number, so a client that already
+    # has the feed only transfers what changed.  Without since it returns the cursor to start syncing from.
+    since = request.GET.get('since')
+    if not since:
+        page = get_changes_since(None)
+    else:
+        try:
+            sequence = int(since)
+        except ValueError:
+            return JsonResponse({'error': "Invalid sequence number"}, status=400)
+        if sequence < 0:
+            return JsonResponse({'error': "Invalid sequence number"}, status=400)
+        page = get_changes_since(list(_get_feed_team_versions(request.user)), sequence)
+    return JsonResponse({'changes': [serialize_change(change) for change in page.changes],
+                         'cursor': page.cursor,
+                         'has_more': page.has_more})
+
+
+def _get_requested_feed_page(request: HttpRequest):
+    # ?cursor=<cursor>&direction=earlier|later, starting from the current gameweek without a cursor
+    cursor = request.GET.get('cursor')
+    direction = request.GET.get('direction', DIRECTION_LATER)
+    if direction not in (DIRECTION_EARLIER, DIRECTION_LATER):
+        raise InvalidCursor("Unknown direction %r" % direction)
+    team_versions = _get_feed_team_versions(request.user)
+    if not cursor:
+        return get_cached_page(team_versions)
+    return get_cached_page(team_versions, FeedCursor.decode(cursor), direction)
+
 
-    # DEBUG:
-    for fixture in fixtures:
-        print(fixture.__dict__)
-    
-    fixtures = sorted(fixtures, reverse=True,
-                                key=lambda x: x.kickoff_time_utc.timestamp())
-    return render(request, 'home/home.html', context={'fixtures': fixtures})
+def _get_feed_team_versions(user):
+    # The user's preferred teams and their feed versions, falling back to every active team for anonymous users and
+    # users who haven't picked any
+    team_versions = None
+    if user.is_authenticated:
+        team_versions = dict(TeamPreference.get_user_preferred_teams(user).values_list('id', 'feed_version'))
+    if not team_versions:
+        team_versions = dict(Team.get_active_teams().values_list('id', 'feed_version'))
+    return team_versions
 
 
-def refresh_fixtures() -> bool:
-    return FDDOApiClient().request()
+def _encode(cursor):
+    return cursor.encode() if cursor is not None else None
@@ -0,0 +1,70 @@
+import logging
+import threading
+from typing import Callable, List, Union
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+from .fetcher import AsyncFetcher, get_competition_client_factories
+from .scheduler import PollScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionWorker:
+    # Owns every outbound ApiGetClient refresh so that request handling only ever reads from the database.
+
+    def __init__(self, client_factories: List[Callable] = None, poll_interval_seconds: float = None,
+                 scheduler: PollScheduler = None):
+        if client_factories is None:
+            client_factories = get_ingestion_client_factories()
+        if poll_interval_seconds is None:
+            poll_interval_seconds = settings.INGESTION_POLL_INTERVAL_SECONDS
+        if scheduler is None:
+            scheduler = PollScheduler()
+        self.client_factories = client_factories
+        # A fixed interval overrides the adaptive schedule
+        self.poll_interval_seconds = poll_interval_seconds
+        self.scheduler = scheduler
+        self._stop_event = threading.Event()
+
+    def run(self, max_iterations: Union[int, None] = None) -> None:
+        iterations = 0
+        while not self._stop_event.is_set():
+            self.run_once()
+            iterations += 1
+            if max_iterations is not None and iterations >= max_iterations:
+                break
+            self._stop_event.wait(self.get_next_poll_delay())
+
+    def get_next_poll_delay(self) -> float:
+        if self.poll_interval_seconds is not None:
+            return self.poll_interval_seconds
+        try:
+            return self.scheduler.next_poll_delay()
+        except Exception:
+            logger.exception("Failed to schedule the next poll, falling back to the live interval")
+            return self.scheduler.live_seconds
+
+    def run_once(self) -> bool:
+        return refresh_clients(self.client_factories)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+def get_ingestion_client_factories() -> List[Callable]:
+    # Every FDDO_COMPETITION_IDS competition, plus any other clients configured in INGESTION_CLIENTS
+    return get_competition_client_factories() + [import_string(path) for path in settings.INGESTION_CLIENTS]
+
+
+def refresh_clients(client_factories: List[Callable]) -> bool:
+    # Runs outside of the request cycle, so drop any connections the database has timed out between refreshes
+    close_old_connections()
+    try:
+        # Fetched concurrently, skipping request types whose lease is held elsewhere
+        return AsyncFetcher(client_factories).run()
+    except Exception:
+        logger.exception("Unhandled error refreshing %s", client_factories)
+    finally:
+        close_old_connections()
+    return False
@@ -1,8 +1,10 @@
+from typing import Dict
 from django import forms 
 from home.models import Team
 from .models import TeamPreference
 from django.forms import formset_factory
-from django.forms.models import modelformset_factory
+from django.core.exceptions import ValidationError
+from django.forms.models import BaseModelFormSet, modelformset_factory
 
 class TeamPreferenceForm(forms.ModelForm):
     
@@ -14,7 +16,49 @@ class TeamPreferenceForm(forms.ModelForm):
         super(TeamPreferenceForm, self).__init__(*args, **kwargs) 
         self.fields['is_preference'].label = self.instance.team.name
 
+
+class ExistingPreferenceField(forms.ModelChoiceField):
+    # Resolves a posted id to one of the preferences the formset already loaded, where ModelChoiceField would run a
+    # query per form
+
+    def __init__(self, formset: 'BaseTeamPreferenceFormSet', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.formset = formset
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            pk = self.queryset.model._meta.pk.to_python(value)
+        except ValidationError:
+            pk = None
+        instance = self.formset.get_existing_preferences().get(pk)
+        if instance is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return instance
+
+
+class BaseTeamPreferenceFormSet(BaseModelFormSet):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._existing_preferences = None
+
+    def get_existing_preferences(self) -> Dict[int, TeamPreference]:
+        # Built once, from the queryset the formset already evaluated for its forms
+        if self._existing_preferences is None:
+            self._existing_preferences = {preference.pk: preference for preference in self.get_queryset()}
+        return self._existing_preferences
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        pk_name = self.model._meta.pk.name
+        id_field = form.fields[pk_name]
+        form.fields[pk_name] = ExistingPreferenceField(self, id_field.queryset, initial=id_field.initial,
+                                                       required=False, widget=id_field.widget)
+
+
 TeamPreferenceFormSet = modelformset_factory(TeamPreference, 
-                                             form=TeamPreferenceForm, extra=0)
+                                             form=TeamPreferenceForm, formset=BaseTeamPreferenceFormSet, extra=0)
                                             
    
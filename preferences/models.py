@@ -11,8 +11,8 @@ class TeamPreference(models.Model):
 
     @classmethod
     def get_user_preferred_teams(self, user: User):
-        preferred_prefs = self.objects.filter(user=user, is_active=True, is_preference=True)
-        teams = [pref.team for pref in preferred_prefs]
+        return Team.objects.filter(teampreference__user=user, teampreference__is_active=True,
+                                   teampreference__is_preference=True)
 
     @classmethod
     def get_user_team_preferences(self, user: User):
@@ -26,7 +26,7 @@ class TeamPreference(models.Model):
    
     @classmethod
     def _get_user_team_preferences(self, user:User):
-        return self.objects.filter(user=user, is_active=True)
+        return self.objects.filter(user=user, is_active=True).select_related('team')
 
     @classmethod
     def create_new_active_teams(self, user: User):
@@ -45,12 +45,11 @@ class TeamPreference(models.Model):
         new_prefs = list(map(lambda x: TeamPreference(user=user, team=x),
                         teams_without_prefs))
         
-        for pref in new_prefs:
-            pref.save()
-        
+        self.objects.bulk_create(new_prefs)
+
         for pref in new_inactive_prefs:
             pref.is_active = False
-            pref.save()
+        self.objects.bulk_update(new_inactive_prefs, ['is_active'])
 
 
                                         
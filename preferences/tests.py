@@ -1,11 +1,12 @@
 from django.test import TestCase
 from django.test.utils import setup_test_environment
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.urls import resolve
 from home.models import Team
 from .models import TeamPreference
 from .views import user_preferences
-from .forms import TeamPreferenceForm
+from .forms import TeamPreferenceForm, TeamPreferenceFormSet
 
 
 class PreferencesTest(TestCase):
@@ -91,20 +92,56 @@ class PreferencesTest(TestCase):
         self.assertFalse(found_inactive_team)
         self.assertTrue(found_new_active_team)
 
+    def test_preferences__get__many_teams__constant_query_count(self):
+        user = self.create_user()
+        for i in range(0, 20):
+            self.create_team(team_name="test_team" + str(i))
+
+        # User, active teams, existing preferences, creating the missing ones, then the formset's preferences
+        with self.assertNumQueries(5):
+            response = self.client.get('/user-preferences/' + str(user.id) + '/')
+        self.assertContains(response, 'test_team19')
+
     def test_preferences__post__sets_correct_state(self):
         user = self.create_user()
-        num_teams = 5
         teams = []
 
-        for i in range(0, 5):
+        for i in range(0, 20):
             teams.append(self.create_team(team_name="test_team" + str(i)))
-        
-#        self.client.post('/user-preferences/' + str(user.id) + '/', data={
+        self.create_preference(user, teams[0], is_preference=True)
+        self.client.get('/user-preferences/' + str(user.id) + '/')
+        prefs = list(TeamPreference.objects.filter(user=user).order_by('id'))
+        # Team 0 unticked, teams 1 to 10 ticked
+        data = {'form-TOTAL_FORMS': len(prefs), 'form-INITIAL_FORMS': len(prefs)}
+        for i, pref in enumerate(prefs):
+            data['form-%s-id' % i] = pref.id
+            if 1 <= i <= 10:
+                data['form-%s-is_preference' % i] = 'on'
+
+        # User, the formset's preferences, then one update for every changed preference
+        with self.assertNumQueries(3):
+            response = self.client.post('/user-preferences/' + str(user.id) + '/', data=data)
+
+        self.assertRedirects(response, '/home/', fetch_redirect_response=False)
+        self.assertEqual(list(TeamPreference.get_user_preferred_teams(user).order_by('id')), teams[1:11])
+
+    def test_formset__id_field__resolves_only_loaded_preferences(self):
+        user = self.create_user()
+        other_user = User.objects.create(username='other_username', password='other_password')
+        team = self.create_team(team_name='test_team')
+        pref = self.create_preference(user, team)
+        other_pref = self.create_preference(other_user, team)
+        formset = TeamPreferenceFormSet(queryset=TeamPreference.objects.filter(user=user).select_related('team'))
+        id_field = formset.forms[0].fields['id']
+
+        with self.assertNumQueries(0):
+            self.assertEqual(id_field.to_python(str(pref.id)), pref)
+        self.assertRaises(ValidationError, id_field.to_python, str(other_pref.id))
 
     
     @staticmethod
-    def create_preference(user: User, team: Team) -> TeamPreference:
-        pref = TeamPreference(user=user, team=team)
+    def create_preference(user: User, team: Team, is_preference: bool=False) -> TeamPreference:
+        pref = TeamPreference(user=user, team=team, is_preference=is_preference)
         pref.save()
         return pref
 
@@ -2,26 +2,34 @@ from typing import List
 from django.shortcuts import render, redirect
 from django.http import HttpRequest, HttpResponse
 from home.models import Team
+from sportsfeed.profiling import query_budget
 from django.contrib.auth.models import User
 from .models import TeamPreference
 from .forms import TeamPreferenceFormSet
 
 
+@query_budget(10)
 def user_preferences(request: HttpRequest, user_id: int) -> HttpResponse:
     user = User.objects.get(id=user_id)
     if user is None:
         return HttpResponse(status=500)
 
     if request.method == "POST":
-        formset = TeamPreferenceFormSet(request.POST)
+        formset = TeamPreferenceFormSet(request.POST,
+                                        queryset=TeamPreference.objects.filter(user=user, is_active=True)
+                                        .select_related('team'))
         if formset.is_valid():
-            formset.save()
+            # Only the changed preferences, in one update however many teams there are
+            changed_prefs = formset.save(commit=False)
+            if changed_prefs:
+                TeamPreference.objects.bulk_update(changed_prefs, ['is_preference'])
         return redirect('/home/') 
     else: 
         active_teams = Team.get_active_teams()
         TeamPreference.reset_user_teams(user, active_teams)
         formset = TeamPreferenceFormSet(queryset=TeamPreference.objects.filter(user=user,
-                                                                               is_active=True))
+                                                                               is_active=True)
+                                        .select_related('team'))
         return render(request, 'preferences/user_preferences.html', context={'formset':
                                                                               formset,
                                                                              'user_id':
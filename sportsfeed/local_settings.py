@@ -0,0 +1 @@
+FOOTBALL_DATA_DOT_ORG_API_KEY = "dummy"
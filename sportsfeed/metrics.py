@@ -0,0 +1,182 @@
+import bisect
+import logging
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+from django.conf import settings
+from django.http import Http404, HttpRequest, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    # One metric family in the Prometheus text format, with a value per combination of label values.  Updates take
+    # a per metric lock and a dict lookup, so they are cheap enough for every request.
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def collect(self) -> List[str]:
+        lines = ['# HELP %s %s' % (self.name, self.documentation.replace('\\', r'\\').replace('\n', r'\n')),
+                 '# TYPE %s %s' % (self.name, self.type_name)]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.extend(self._collect_value(dict(zip(self.label_names, label_values)), value))
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def _get_key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        try:
+            key = tuple(str(labels[label_name]) for label_name in self.label_names)
+        except KeyError:
+            key = None
+        if key is None or len(labels) != len(self.label_names):
+            raise ValueError("%s takes the labels %s, got %s" % (self.name, self.label_names, sorted(labels)))
+        return key
+
+    def _collect_value(self, labels: Dict[str, str], value) -> List[str]:
+        return [format_sample(self.name, labels, value)]
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    # Cumulative buckets are only summed up when scraped, an observation just bumps one bucket
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._get_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Counts per bucket with a last one for +Inf, then the sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _collect_value(self, labels: Dict[str, str], value) -> List[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            lines.append(format_sample(self.name + '_bucket', dict(labels, le=format_value(upper_bound)),
+                                       cumulative))
+        lines.append(format_sample(self.name + '_sum', labels, total))
+        lines.append(format_sample(self.name + '_count', labels, cumulative))
+        return lines
+
+
+class MetricsRegistry:
+    # Metrics updated as things happen, plus collectors called at scrape time for values that are cheaper to read
+    # on demand than to keep up to date.  A collector returns freshly built metrics, and one that fails is logged
+    # and left out of that scrape.
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Metric]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError("A metric named %s is already registered" % metric.name)
+            self._metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Metric]]) -> Callable[[], Iterable[Metric]]:
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                metrics.extend(collector())
+            except Exception:
+                logger.exception("Metrics collector %s failed", getattr(collector, '__name__', collector))
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def counter(name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, label_names))
+
+
+def gauge(name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, documentation, label_names))
+
+
+def histogram(name: str, documentation: str, label_names: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, documentation, label_names, buckets))
+
+
+def format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if not labels:
+        return '%s %s' % (name, format_value(value))
+    label_text = ','.join('%s="%s"' % (label_name, escape_label_value(label_value))
+                          for label_name, label_value in labels.items())
+    return '%s{%s} %s' % (name, label_text, format_value(value))
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    if not settings.METRICS_ENABLED:
+        raise Http404()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
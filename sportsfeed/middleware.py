@@ -0,0 +1,113 @@
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from home.telemetry import QueryCounter
+from . import metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+REQUEST_SECONDS = metrics.histogram('sportsfeed_http_request_duration_seconds',
+                                    "Time to build the response, by view", ['view'])
+REQUEST_QUERIES = metrics.histogram('sportsfeed_http_request_db_queries', "Database queries per request, by view",
+                                    ['view'], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+REQUEST_QUERY_SECONDS = metrics.histogram('sportsfeed_http_request_db_seconds',
+                                          "Time spent in database queries per request, by view", ['view'])
+RESPONSES = metrics.counter('sportsfeed_http_responses_total', "Responses sent, by view and status code",
+                            ['view', 'status'])
+
+
+class MetricsMiddleware:
+    # Times every request and counts its queries.  Labelled by the resolved view rather than the path, so there's
+    # one series per view however many users and ids are in the URLs.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        query_counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(query_counter):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        view = self._get_view_name(request)
+        REQUEST_SECONDS.observe(elapsed, view=view)
+        REQUEST_QUERIES.observe(query_counter.count, view=view)
+        REQUEST_QUERY_SECONDS.observe(query_counter.seconds, view=view)
+        RESPONSES.inc(view=view, status=response.status_code)
+        return response
+
+    def _get_view_name(self, request) -> str:
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None:
+            return 'unresolved'
+        return resolver_match.view_name
+
+
+class ProfilingMiddleware:
+    # Records wall time, queries, template rendering and outbound API time for every request and logs it when slow.
+    # The breakdown is only sent back, in a Server-Timing header, to staff users or when DEBUG is on.  A staff user
+    # sending the PROFILING_HEADER gets the request's cProfile stats instead of the page.  Goes after
+    # AuthenticationMiddleware, which it needs for the staff checks.
+
+    _profiler_lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        profiling.install_template_timing()
+
+    def __call__(self, request):
+        if not settings.PROFILING_ENABLED:
+            return self.get_response(request)
+
+        profile = profiling.RequestProfile()
+        profiling.set_current_profile(profile)
+        try:
+            started = time.perf_counter()
+            with connection.execute_wrapper(profile.queries):
+                if self._wants_cprofile(request):
+                    response = self._get_cprofile_response(request)
+                else:
+                    response = self.get_response(request)
+            profile.wall_seconds = time.perf_counter() - started
+        finally:
+            profiling.set_current_profile(None)
+
+        if settings.DEBUG or self._is_staff(request):
+            response['Server-Timing'] = profile.get_server_timing()
+        log_level = logging.WARNING if profile.wall_seconds > settings.PROFILING_SLOW_REQUEST_SECONDS else logging.DEBUG
+        logger.log(log_level, "%s %s: %.1fms, %s queries in %.1fms, templates %.1fms, %s API calls in %.1fms",
+                   request.method, request.path, profile.wall_seconds * 1000, profile.queries.count,
+                   profile.queries.seconds * 1000, profile.template_seconds * 1000, profile.outbound_count,
+                   profile.outbound_seconds * 1000)
+        return response
+
+    def _wants_cprofile(self, request) -> bool:
+        return settings.PROFILING_HEADER in request.META and self._is_staff(request)
+
+    def _is_staff(self, request) -> bool:
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+    def _get_cprofile_response(self, request) -> HttpResponse:
+        # Only one profiler can be active in the process, so concurrent requests go unprofiled
+        if not self._profiler_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            profiler.runcall(self.get_response, request)
+        finally:
+            self._profiler_lock.release()
+
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(settings.PROFILING_STATS_LIMIT)
+        return HttpResponse(output.getvalue(), content_type='text/plain; charset=utf-8')
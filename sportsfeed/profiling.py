@@ -0,0 +1,106 @@
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Union
+from django.conf import settings
+from django.db import connection
+from django.template.backends.django import Template
+from home.telemetry import QueryCounter
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_install_lock = threading.Lock()
+_template_timing_installed = False
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestProfile:
+    # Where one request spent its time, filled in by ProfilingMiddleware and the hooks below while it's current
+
+    def __init__(self):
+        self.wall_seconds = 0.0
+        self.queries = QueryCounter()
+        self.template_seconds = 0.0
+        self.outbound_seconds = 0.0
+        self.outbound_count = 0
+        self._template_depth = 0
+
+    def get_server_timing(self) -> str:
+        # For the Server-Timing header, so the breakdown shows up in the browser's network panel
+        return ', '.join([
+            'db;dur=%.1f;desc="%s queries"' % (self.queries.seconds * 1000, self.queries.count),
+            'tpl;dur=%.1f' % (self.template_seconds * 1000),
+            'api;dur=%.1f;desc="%s calls"' % (self.outbound_seconds * 1000, self.outbound_count),
+            'total;dur=%.1f' % (self.wall_seconds * 1000),
+        ])
+
+
+def get_current_profile() -> Union[RequestProfile, None]:
+    return getattr(_local, 'profile', None)
+
+
+def set_current_profile(profile: Union[RequestProfile, None]) -> None:
+    _local.profile = profile
+
+
+def record_outbound(seconds: float) -> None:
+    # Called by ApiGetClient for every request it sends; a no-op outside a profiled request's thread
+    profile = get_current_profile()
+    if profile is not None:
+        profile.outbound_seconds += seconds
+        profile.outbound_count += 1
+
+
+def install_template_timing() -> None:
+    # Django has no hook around template rendering outside tests, so the backend's render is wrapped once.  Form
+    # widgets render through the same backend, so only the outermost render is timed.
+    global _template_timing_installed
+    with _install_lock:
+        if _template_timing_installed:
+            return
+        render = Template.render
+
+        @functools.wraps(render)
+        def timed_render(self, context=None, request=None):
+            profile = get_current_profile()
+            if profile is None:
+                return render(self, context, request)
+            profile._template_depth += 1
+            started = time.perf_counter()
+            try:
+                return render(self, context, request)
+            finally:
+                profile._template_depth -= 1
+                if profile._template_depth == 0:
+                    profile.template_seconds += time.perf_counter() - started
+
+        Template.render = timed_render
+        _template_timing_installed = True
+
+
+def query_budget(max_queries: int) -> Callable:
+    # Declares how many queries a view may run.  Going over fails loudly in tests, so an N+1 can't slip in
+    # unnoticed, and is logged as an error anywhere else.
+    def decorator(view: Callable) -> Callable:
+        view_name = '%s.%s' % (view.__module__, view.__qualname__)
+
+        @functools.wraps(view)
+        def wrapped_view(request, *args, **kwargs):
+            query_counter = QueryCounter()
+            with connection.execute_wrapper(query_counter):
+                response = view(request, *args, **kwargs)
+            if query_counter.count > max_queries:
+                message = "%s ran %s queries, over its budget of %s" % (view_name, query_counter.count, max_queries)
+                if settings.QUERY_BUDGET_RAISE:
+                    raise QueryBudgetExceeded(message)
+                logger.error(message)
+            return response
+
+        wrapped_view.query_budget = max_queries
+        return wrapped_view
+    return decorator
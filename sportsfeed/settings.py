@@ -43,11 +43,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'sportsfeed.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'sportsfeed.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -124,3 +126,84 @@ STATIC_URL = '/static/'
 # STATICFILES_DIRS = [
 #    os.path.join(BASE_DIR, 'static')
 # ]
+
+
+# Fixture ingestion
+# Outbound API refreshes are owned by the worker started with `manage.py run_ingestion_worker`.  It fetches every
+# FDDO_COMPETITION_IDS competition, along with any other ApiGetClients listed here
+INGESTION_CLIENTS = []
+# Fixed number of seconds between polls, or None to poll on the fixture driven schedule below
+INGESTION_POLL_INTERVAL_SECONDS = None
+# Poll every INGESTION_LIVE_POLL_SECONDS while a fixture is live (or within INGESTION_MATCH_DURATION_SECONDS of
+# kickoff), every INGESTION_PRE_KICKOFF_POLL_SECONDS in the window before a kickoff and at most every
+# INGESTION_IDLE_POLL_SECONDS otherwise.  Each API's own request limits always take precedence.
+INGESTION_LIVE_POLL_SECONDS = 15
+INGESTION_PRE_KICKOFF_POLL_SECONDS = 300
+INGESTION_PRE_KICKOFF_WINDOW_SECONDS = 60 * 60
+INGESTION_IDLE_POLL_SECONDS = 6 * 60 * 60
+INGESTION_MATCH_DURATION_SECONDS = 3 * 60 * 60
+# A gameweek's bounds leave out kickoffs more than this many days from its median kickoff, which are matches
+# postponed or rescheduled out of the round
+GAMEWEEK_MAX_DAYS_FROM_MEDIAN_KICKOFF = 4
+
+# 'worker' leaves every refresh to the ingestion worker, 'stale_while_revalidate' additionally lets the home view
+# schedule a background refresh when the stored fixtures are older than HOME_FEED_FRESHNESS_SECONDS
+HOME_FEED_REFRESH_MODE = 'worker'
+HOME_FEED_FRESHNESS_SECONDS = 120
+HOME_FEED_REFRESH_THREADS = 2
+# Fixtures per page of the home feed, a full gameweek when following every team
+HOME_FEED_PAGE_SIZE = 10
+# Feed pages kept in memory, one per followed set of teams and page, evicting the least recently used
+HOME_FEED_CACHE_MAX_ENTRIES = 1000
+# Most fixture changes returned by one call to the changes endpoint, the client asks again when there are more
+FIXTURE_CHANGES_PAGE_SIZE = 100
+
+# How long a process may hold the refresh lease for a request type before another process can take it over
+INGESTION_LEASE_SECONDS = 120
+
+# Outbound API connections share one keep-alive session, with a connection pool per host
+API_CLIENT_CONNECT_TIMEOUT_SECONDS = 5
+API_CLIENT_READ_TIMEOUT_SECONDS = 30
+API_CLIENT_DEFAULT_POOL_SIZE = 2
+API_CLIENT_POOL_SIZES = {
+    'api.football-data.org': 4,
+}
+
+# Regular polls only ask football-data.org for fixtures in a window around today; the full season is reconciled
+# separately with `manage.py reconcile_fixtures`
+FDDO_FETCH_MODE = 'window'
+FDDO_WINDOW_PAST_DAYS = 2
+FDDO_WINDOW_FUTURE_DAYS = 7
+
+# football-data.org competitions polled by the ingestion worker and `manage.py fetch_competitions`; 2021 is the
+# Premier League
+FDDO_COMPETITION_IDS = [2021]
+
+# The async fetcher runs network round trips on this many threads, with at most this many requests in flight per
+# Api (fewer for rate limited APIs whose bucket is smaller), and gives up on a request slot after this many waits
+ASYNC_FETCH_MAX_WORKERS = 8
+ASYNC_FETCH_CONCURRENCY_PER_API = 4
+ASYNC_FETCH_MAX_ATTEMPTS = 3
+
+# Read, hash and parse API responses chunk by chunk instead of loading the whole body at once
+API_CLIENT_STREAM_RESPONSES = False
+API_CLIENT_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Ingested fixtures are written to the database in batches of this many changes
+INGESTION_BATCH_SIZE = 500
+
+# Serve Prometheus metrics at /metrics and time every request for them
+METRICS_ENABLED = True
+
+# Time every request's queries, template rendering and API calls into a Server-Timing header, logging a warning
+# for requests slower than PROFILING_SLOW_REQUEST_SECONDS.  Staff sending an X-Profile header get the request's
+# cProfile stats, the top PROFILING_STATS_LIMIT functions by cumulative time, instead of the page.
+PROFILING_ENABLED = True
+PROFILING_HEADER = 'HTTP_X_PROFILE'
+PROFILING_SLOW_REQUEST_SECONDS = 1.0
+PROFILING_STATS_LIMIT = 50
+
+# Views over their @query_budget log an error, or fail when this is set (as the test runner does)
+QUERY_BUDGET_RAISE = False
+
+TEST_RUNNER = 'sportsfeed.test_runner.QueryBudgetTestRunner'
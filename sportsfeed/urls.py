@@ -19,14 +19,18 @@ from django.contrib import admin
 from login import views as login_views
 from home import views as home_views
 from preferences import views as preferences_views
+from . import metrics
 
 urlpatterns = [
     path('login/new/submit/', login_views.new_user_submit),
     path('login/new/', login_views.new_user),
     path('home/', home_views.home),
+    path('home/feed/', home_views.feed),
+    path('home/changes/', home_views.changes),
     path('login/submit/', login_views.login_submit),
     path('login/', login_views.login_user),
     path('admin/', admin.site.urls),
+    path('metrics', metrics.metrics_view),
     path('user-preferences/<int:user_id>/',
         preferences_views.user_preferences),
 ]